@@ -1,14 +1,33 @@
 #!/usr/bin/env python3
 """
 Download Raspberry Shake waveforms day-by-day starting 2025-06-01 (UTC),
-saving one MiniSEED file per day and skipping any that already exist
-or that already have a corresponding dayplot PNG like:
-    AM_RF90E_EHZ_2025-06-02_5-40Hz.png
+saving one MiniSEED file per day for the days that processingManifest
+reports as still needed by the amplitude or dayplot stage (and that are
+not already in shake_data).
 
 Improvements:
-- Skips download if dayplot already exists.
+- Planning reads the processing manifest, so it only touches pending days
+  and a day whose amplitudes failed is fetched again even if its PNG exists.
+- Records every fetched day (samples, checksum, gap fraction) in the manifest.
+- Chunk-level resume: each chunk is kept in fetch_chunks/<day>/ and logged in
+  the manifest as soon as it arrives, so an interrupted day only requests
+  the chunks it is missing. A day with missing chunks is saved as 'partial'
+  and those intervals are requested again on the next runs (up to
+  MAX_CHUNK_ATTEMPTS), after which the gap is accepted.
+- Gaps are not zero-filled on disk: the day file keeps them as separate
+  records, so readers can tell missing data from quiet data.
 - Gracefully handles corrupt MiniSEED records (Steim-2).
 - Exponential backoff for rate limits and transient errors.
+- Optional concurrent mode: chunks of several days are fetched in parallel
+  under one shared token-bucket rate limit, which pauses all workers when
+  the server answers 429 / Retry-After.
+- iter_fetched_days() yields fetched days in memory, so fusedPipeline.py can
+  process them without the MiniSEED round trip through shake_data.
+- Each day's requests, retries, 429s, bytes and waiting time go to the run
+  report (runReport.py).
+- Complete days are kept in the local waveform cache (waveformCache.py); a
+  day that has to be processed again is restored from there instead of
+  being downloaded.
 """
 
 from obspy import UTCDateTime, Stream, read
@@ -17,9 +36,19 @@ from obspy.io.mseed import InternalMSEEDError
 from pathlib import Path
 from datetime import datetime, timedelta, timezone
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
 import time
 import random
 import re
+import shutil
+
+import numpy as np
+
+import runReport
+from mseedDayBuffer import DayBuffer
+from processingManifest import Manifest, DONE, PARTIAL, PROCESSING_STAGES, checksum
+from waveformCache import open_cache
 
 # -----------------------------
 # User configuration
@@ -33,17 +62,24 @@ START_DATE_UTC = "2025-06-01"  # inclusive YYYY-MM-DD (UTC)
 END_DATE_UTC = datetime.now(timezone.utc).date().isoformat()  # exclusive upper bound
 
 OUT_DIR = Path("shake_data")
+CHUNK_DIR = Path("fetch_chunks")  # chunks of days that are not complete yet, kept between runs
 DAYPLOT_DIR = Path("dayplots")  # directory where PNGs are stored
 FILENAME_PATTERN = "{network}.{station}.{location}.{channel}.{date}.mseed"
-DAYPLOT_PATTERN = "{network}_{station}_{channel}_{date}_5-40Hz.png"
 
 # Request tuning
 CHUNK_HOURS = 4
 REQUEST_PAUSE_SECONDS = 5
 MAX_RETRIES = 6
+MAX_CHUNK_ATTEMPTS = 3  # runs in which a missing chunk is requested before its gap is accepted
 BACKOFF_INITIAL = 10
 BACKOFF_MAX = 600
 JITTER_MAX = 1.5
+
+# Concurrent mode (shared rate-limit budget across all workers)
+CONCURRENT_FETCH = True
+FETCH_WORKERS = 3                               # parallel chunk requests in flight
+RATE_LIMIT_PER_SEC = 1 / REQUEST_PAUSE_SECONDS  # sustained requests per second, all workers
+RATE_LIMIT_BURST = 1                            # requests allowed back-to-back after idling
 # -----------------------------
 
 
@@ -79,11 +115,64 @@ def parse_retry_after_from_exception(exc_msg: str):
 
 
 def polite_sleep(seconds):
-    time.sleep(seconds + random.random() * JITTER_MAX)
+    seconds += random.random() * JITTER_MAX
+    time.sleep(seconds)
+    runReport.count(wait_s=seconds)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by all fetch workers.
+    acquire() blocks until a request may be sent; penalize() freezes the
+    whole bucket, e.g. for the Retry-After period of a 429 response.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    break
+                else:
+                    wait = (1.0 - self.tokens) / self.rate
+            wait += random.random() * JITTER_MAX
+            time.sleep(wait)
+            waited += wait
+        if waited:
+            runReport.count(wait_s=waited)
+
+    def penalize(self, seconds):
+        with self.lock:
+            now = time.monotonic()
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.tokens = 0.0
+            self.last = now
 
 
 def fetch_chunk_normal(client, net, sta, loc, cha, t0, t1) -> Stream:
-    return client.get_waveforms(net, sta, loc, cha, t0, t1, attach_response=False)
+    # Download into a buffer first, so the run report gets the byte count;
+    # parsed and trimmed like get_waveforms() does without `filename`
+    buf = BytesIO()
+    client.get_waveforms(net, sta, loc, cha, t0, t1, filename=buf)
+    runReport.count(bytes=buf.tell())
+    if buf.tell() == 0:
+        return Stream()
+    buf.seek(0)
+    return read(buf, format="MSEED").trim(t0, t1)
 
 
 def fetch_chunk_fallback_ignore_errors(client, net, sta, loc, cha, t0, t1) -> Stream:
@@ -93,23 +182,34 @@ def fetch_chunk_fallback_ignore_errors(client, net, sta, loc, cha, t0, t1) -> St
         starttime=t0, endtime=t1
     )
     data = resp.read()
+    runReport.count(bytes=len(data))
     if not data:
         return Stream()
     return read(BytesIO(data), format="MSEED", ignore_data_errors=True)
 
 
-def fetch_with_retries(client, net, sta, loc, cha, t0, t1):
-    """Fetch one chunk with exponential backoff and corruption recovery."""
+def fetch_with_retries(client, net, sta, loc, cha, t0, t1, limiter=None):
+    """
+    Fetch one chunk with exponential backoff and corruption recovery.
+    With a shared TokenBucket `limiter`, every request draws from its budget
+    and 429 waits are applied to all workers instead of only this one.
+    """
     attempt = 0
     backoff = BACKOFF_INITIAL
 
     while True:
         try:
+            if limiter is not None:
+                limiter.acquire()
+            runReport.count(requests=1)
             return fetch_chunk_normal(client, net, sta, loc, cha, t0, t1)
 
         except InternalMSEEDError as e:
             print(f"  - Corrupt MiniSEED {t0}–{t1}: {e}")
             try:
+                if limiter is not None:
+                    limiter.acquire()
+                runReport.count(requests=1)
                 st = fetch_chunk_fallback_ignore_errors(client, net, sta, loc, cha, t0, t1)
                 if len(st) > 0:
                     print(f"    -> Fallback recovered {len(st)} trace(s).")
@@ -128,6 +228,7 @@ def fetch_with_retries(client, net, sta, loc, cha, t0, t1):
             if attempt > MAX_RETRIES:
                 print(f"  - Giving up on chunk {t0}–{t1}: {msg[:180]}")
                 return Stream()
+            runReport.count(retries=1, throttled=int(is_429))
 
             wait_sec = parse_retry_after_from_exception(msg) if is_429 else None
             if wait_sec is None:
@@ -135,75 +236,296 @@ def fetch_with_retries(client, net, sta, loc, cha, t0, t1):
                 backoff = min(backoff * (2 if is_429 else 1.5), BACKOFF_MAX)
 
             print(f"  - Retry {attempt}/{MAX_RETRIES} after {wait_sec}s ({'429' if is_429 else 'error'}).")
-            polite_sleep(wait_sec)
+            if limiter is not None and is_429:
+                # Pause every worker; the next acquire() waits out the penalty
+                limiter.penalize(wait_sec)
+            else:
+                polite_sleep(wait_sec)
 
 
-def main():
-    OUT_DIR.mkdir(parents=True, exist_ok=True)
-    DAYPLOT_DIR.mkdir(parents=True, exist_ok=True)
-    client = Client("RASPISHAKE", timeout=120)
+def pending_days(start_date, end_date, manifest):
+    """Yield (day, mseed_path) for days a processing stage still needs and that are not downloaded yet."""
+    todo = manifest.plan_fetch(start_date, end_date)
+    print(f"[INFO] {len(todo)} day(s) pending in the processing manifest.")
+    cache = open_cache()
+    for day in todo:
+        day = datetime.fromisoformat(day).date()
+        mseed_path = OUT_DIR / FILENAME_PATTERN.format(
+            network=NETWORK, station=STATION, location=LOCATION, channel=CHANNEL, date=day.isoformat()
+        )
 
-    start_date = datetime.fromisoformat(START_DATE_UTC).date()
-    end_date = datetime.fromisoformat(END_DATE_UTC).date()
+        if mseed_path.exists():
+            print(f"[SKIP] {day} — waveform already exists: {mseed_path.name}")
+            continue
+        if cached_day(manifest, day, cache) and cache.restore(day.isoformat(), mseed_path):
+            print(f"[CACHE] {day} — restored {mseed_path.name} from {cache.root}")
+            continue
+        if no_data_left(manifest, day):
+            print(f"[SKIP] {day} — no data after {MAX_CHUNK_ATTEMPTS} attempts.")
+            continue
 
-    print(f"Downloading {NETWORK}.{STATION}.{LOCATION}.{CHANNEL}")
-    print(f"Range: {start_date} → {end_date} (exclusive)\n")
+        yield day, mseed_path
 
-    for day in daterange(start_date, end_date):
-        # Build expected file names
-        mseed_name = FILENAME_PATTERN.format(
-            network=NETWORK, station=STATION, location=LOCATION, channel=CHANNEL, date=day.isoformat()
-        )
-        dayplot_name = DAYPLOT_PATTERN.format(
-            network=NETWORK, station=STATION, channel=CHANNEL, date=day.isoformat()
-        )
 
-        mseed_path = OUT_DIR / mseed_name
-        dayplot_path = DAYPLOT_DIR / dayplot_name
+def cached_day(manifest, day, cache=None):
+    """Path of the day in the waveform cache if it was fetched completely, else None."""
+    cache = cache or open_cache()
+    fetched = manifest.get("fetch", day)
+    if cache is None or not fetched or fetched["status"] != DONE:
+        return None
+    return cache.get(day.isoformat())
+
 
-        # Skip if MiniSEED or dayplot already exist
-        if dayplot_path.exists():
-            print(f"[SKIP] {day} — dayplot already exists: {dayplot_path.name}")
+def cache_day(manifest, day, s_all=None, mseed_path=None):
+    """Keep a complete fetched day (stream or written file) in the waveform cache."""
+    cache = open_cache()
+    fetched = manifest.get("fetch", day)
+    if cache is None or not fetched or fetched["status"] != DONE or not fetched["rows"]:
+        return
+    try:
+        if mseed_path is not None:
+            cache.put_file(day.isoformat(), mseed_path)
+        else:
+            cache.put(day.isoformat(), s_all)
+    except Exception as e:
+        print(f"[WARN] {day} — not cached: {e}")
+
+
+def no_data_left(manifest, day):
+    """True if every chunk of the day came back empty MAX_CHUNK_ATTEMPTS times."""
+    fetched = manifest.get("fetch", day)
+    return bool(fetched) and fetched["status"] == DONE and not fetched["rows"]
+
+
+def chunk_path(day, t0):
+    return CHUNK_DIR / day.isoformat() / f"{t0.strftime('%H%M')}.mseed"
+
+
+def chunks_to_fetch(manifest, day):
+    """Chunk bounds of the day that are neither stored nor given up on."""
+    known = manifest.chunks(day)
+    todo = []
+    for (t0, t1) in chunk_bounds_for_day(day, CHUNK_HOURS):
+        status, attempts = known.get(str(t0), (None, 0))
+        if status == "ok" and chunk_path(day, t0).exists():
             continue
-        if mseed_path.exists():
-            print(f"[SKIP] {day} — waveform already exists: {mseed_path.name}")
+        if status == "missing" and attempts >= MAX_CHUNK_ATTEMPTS:
             continue
+        todo.append((t0, t1))
+    return todo
+
+
+def stored_chunks(day):
+    """Chunks of the day kept by an earlier, incomplete run."""
+    s_all = Stream()
+    day_dir = CHUNK_DIR / day.isoformat()
+    if day_dir.exists():
+        for path in sorted(day_dir.glob("*.mseed")):
+            s_all += read(str(path))
+    return s_all
+
+
+def save_chunk(manifest, day, t0, t1, st):
+    """Keep a fetched chunk on disk and log it, so an interrupted day resumes from here."""
+    if len(st) == 0:
+        print(f"  - No data kept for {t0}–{t1}")
+        manifest.record_chunk(day, t0, "missing")
+        return
+    path = chunk_path(day, t0)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    st.write(str(path), format="MSEED")
+    manifest.record_chunk(day, t0, "ok")
+
+
+def fetch_status(manifest, day):
+    """DONE once every chunk is stored or given up on; PARTIAL while one is due another request."""
+    known = manifest.chunks(day)
+    for (t0, _) in chunk_bounds_for_day(day, CHUNK_HOURS):
+        status, attempts = known.get(str(t0), (None, 0))
+        if status != "ok" and attempts < MAX_CHUNK_ATTEMPTS:
+            return PARTIAL
+    return DONE
+
+
+def assemble_day(day, s_all):
+    """
+    Place the fetched chunks of one day in a single UTC-day trace (one copy
+    into a preallocated buffer, no merge or trim; see mseedDayBuffer); None
+    if empty. Gaps and padding stay masked; tr.stats.gap_fraction is their
+    share of the day.
+    """
+    if len(s_all) == 0:
+        print(f"[NONE] {day} — no data retrieved.\n")
+        return None
+
+    day_start = UTCDateTime(datetime(day.year, day.month, day.day, tzinfo=timezone.utc))
+    s_all = s_all.select(network=NETWORK, station=STATION, location=LOCATION, channel=CHANNEL)
+    tr = DayBuffer(day_start).add_stream(s_all).trace(masked=True)
+    if tr is None:
+        print(f"[NONE] {day} — empty after trim.\n")
+        return None
+    return Stream([tr])
+
+
+def record_fetch(manifest, day, s_all, status=None):
+    """
+    Log a fetched day (None = no data) in the processing manifest. When a
+    partial day comes back with different data, its processing stages are
+    queued again; once the day is final its chunk files are dropped.
+    """
+    if status is None:
+        status = fetch_status(manifest, day)
+    previous = manifest.get("fetch", day)
+
+    if s_all is None:
+        manifest.record("fetch", day, status, rows=0, gap_fraction=1.0)
+    else:
+        tr = s_all[0]
+        manifest.record("fetch", day, status, rows=int(tr.stats.npts),
+                        checksum=checksum(np.ascontiguousarray(np.ma.filled(tr.data, 0))),
+                        gap_fraction=tr.stats.gap_fraction)
+        current = manifest.get("fetch", day)
+        if previous and previous["status"] == PARTIAL and previous["checksum"] != current["checksum"]:
+            for stage in PROCESSING_STAGES:
+                manifest.force(stage, days=[day])
+
+    if status == DONE:
+        shutil.rmtree(CHUNK_DIR / day.isoformat(), ignore_errors=True)
+        manifest.drop_chunks(day)
+
+
+def write_day(day, s_all, mseed_path, manifest):
+    """Merge, trim to the UTC day and save the fetched chunks of one day."""
+    s_all = assemble_day(day, s_all)
+    if s_all is None:
+        record_fetch(manifest, day, None)
+        return
+
+    try:
+        # split() writes gaps as breaks between records instead of zeros
+        s_all.split().write(str(mseed_path), format="MSEED")
+        print(f"[OK] {day} — saved {mseed_path.name}\n")
+        record_fetch(manifest, day, s_all)
+        cache_day(manifest, day, mseed_path=mseed_path)
+    except Exception as e:
+        print(f"[FAIL] {day} — write error: {e}\n")
+        record_fetch(manifest, day, s_all, status="failed")
+
+
+def fetch_days_serial(days, manifest):
+    """Original mode: one chunk at a time with a fixed pause before each request."""
+    client = Client("RASPISHAKE", timeout=120)
 
-        print(f"[FETCH] {day} — downloading 24h ({24 // CHUNK_HOURS} chunks)...")
-        s_all = Stream()
-        chunks = chunk_bounds_for_day(day, CHUNK_HOURS)
+    for day, mseed_path in days:
+        chunks = chunks_to_fetch(manifest, day)
+        print(f"[FETCH] {day} — downloading {len(chunks)} of {24 // CHUNK_HOURS} chunks...")
+        with runReport.span("fetch", day.isoformat(), chunks=len(chunks)):
+            s_all = stored_chunks(day)
 
-        for (t0, t1) in chunks:
-            polite_sleep(REQUEST_PAUSE_SECONDS)
-            st = fetch_with_retries(client, NETWORK, STATION, LOCATION, CHANNEL, t0, t1)
-            if len(st) > 0:
+            for (t0, t1) in chunks:
+                polite_sleep(REQUEST_PAUSE_SECONDS)
+                st = fetch_with_retries(client, NETWORK, STATION, LOCATION, CHANNEL, t0, t1)
+                save_chunk(manifest, day, t0, t1, st)
                 s_all += st
-            else:
-                print(f"  - No data kept for {t0}–{t1}")
 
-        if len(s_all) == 0:
-            print(f"[NONE] {day} — no data retrieved.\n")
-            continue
+            write_day(day, s_all, mseed_path, manifest)
+
+
+def iter_fetched_days(days, manifest, workers=None, rate=None, burst=None, max_days_in_flight=None):
+    """
+    Fetch the missing chunks of `days` with a thread pool and yield
+    (day, Stream) as soon as the last chunk of a day has arrived; chunks
+    stored by earlier runs are included. All requests share one TokenBucket,
+    so throughput scales with `workers` only up to `rate`.
+    max_days_in_flight bounds how many days are downloading or waiting to be
+    consumed at once (None = submit everything up front). workers, rate and
+    burst default to the module settings at call time.
+    """
+    workers = FETCH_WORKERS if workers is None else workers
+    limiter = TokenBucket(RATE_LIMIT_PER_SEC if rate is None else rate,
+                          RATE_LIMIT_BURST if burst is None else burst)
+    local = threading.local()
+
+    def fetch_chunk(day, t0, t1):
+        # The chunk requests of a day add up to its "fetch" record in the run report
+        with runReport.span("fetch", day.isoformat(), finish=False):
+            # obspy clients are not shared between threads
+            if not hasattr(local, "client"):
+                limiter.acquire()
+                local.client = Client("RASPISHAKE", timeout=120)
+            return fetch_with_retries(local.client, NETWORK, STATION, LOCATION, CHANNEL, t0, t1,
+                                      limiter=limiter)
+
+    days = iter(days)
+    parts = {}
+    remaining = {}
+    futures = {}
+    ready = []      # days with nothing left to request
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        def submit_more():
+            while max_days_in_flight is None or len(parts) < max_days_in_flight:
+                day = next(days, None)
+                if day is None:
+                    return
+                chunks = chunks_to_fetch(manifest, day)
+                print(f"[FETCH] {day} — queued {len(chunks)} of {24 // CHUNK_HOURS} chunks...")
+                parts[day] = stored_chunks(day)
+                remaining[day] = len(chunks)
+                if not chunks:
+                    ready.append(day)
+                for (t0, t1) in chunks:
+                    futures[pool.submit(fetch_chunk, day, t0, t1)] = (day, t0, t1)
+
+        submit_more()
+        while futures or ready:
+            if ready:
+                day = ready.pop(0)
+                del remaining[day]
+                runReport.finish("fetch", day.isoformat())
+                yield day, parts.pop(day)
+                submit_more()
+                continue
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for fut in done:
+                day, t0, t1 = futures.pop(fut)
+                try:
+                    st = fut.result()
+                except Exception as e:
+                    print(f"  - Chunk {t0}–{t1} failed: {e}")
+                    st = Stream()
+                save_chunk(manifest, day, t0, t1, st)
+                parts[day] += st
+
+                remaining[day] -= 1
+                if remaining[day] == 0:
+                    ready.append(day)
+
+
+def fetch_days_concurrent(days, manifest, workers=None, rate=None, burst=None):
+    """Fetch all pending days concurrently; each day is written as soon as it is complete."""
+    paths = dict(days)
+    for day, s_all in iter_fetched_days(paths, manifest, workers, rate, burst):
+        write_day(day, s_all, paths[day], manifest)
 
-        # Merge and trim
-        day_start = UTCDateTime(datetime(day.year, day.month, day.day, tzinfo=timezone.utc))
-        day_end = day_start + 24 * 3600
-        try:
-            s_all.merge(method=1, fill_value=0)
-        except Exception:
-            s_all.merge(method=0)
-        s_all.trim(day_start, day_end, pad=True, fill_value=0)
-        s_all = s_all.select(network=NETWORK, station=STATION, location=LOCATION, channel=CHANNEL)
-
-        if len(s_all) == 0:
-            print(f"[NONE] {day} — empty after trim.\n")
-            continue
 
-        try:
-            s_all.write(str(mseed_path), format="MSEED")
-            print(f"[OK] {day} — saved {mseed_path.name}\n")
-        except Exception as e:
-            print(f"[FAIL] {day} — write error: {e}\n")
+def main():
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    DAYPLOT_DIR.mkdir(parents=True, exist_ok=True)
+
+    start_date = datetime.fromisoformat(START_DATE_UTC).date()
+    end_date = datetime.fromisoformat(END_DATE_UTC).date()
+
+    print(f"Downloading {NETWORK}.{STATION}.{LOCATION}.{CHANNEL}")
+    print(f"Range: {start_date} → {end_date} (exclusive)\n")
+
+    with runReport.run("fetch"), Manifest() as manifest:
+        days = pending_days(start_date, end_date, manifest)
+        if CONCURRENT_FETCH:
+            fetch_days_concurrent(days, manifest)
+        else:
+            fetch_days_serial(days, manifest)
 
 
 if __name__ == "__main__":
@@ -1,55 +1,285 @@
 #!/usr/bin/env python3
 import os
+from functools import lru_cache
 from pathlib import Path
 import numpy as np
 import pandas as pd
 from obspy import read, UTCDateTime
 from obspy.signal.invsim import cosine_taper
-from scipy.fft import rfft, rfftfreq
+from scipy.fft import rfft, rfftfreq, next_fast_len
+from amplitudeStore import open_store, to_epoch_seconds
+from amplitudeCleaning import QUALITY_COLUMN
+from mseedDayBuffer import read_day
+import runReport
+from processingManifest import Manifest, DONE, ADOPT, checksum
 
 # -----------------------
 # Config
 # -----------------------
 INPUT_DIR = Path("./shake_data")     # directory containing daily .mseed files
-DAYPLOT_DIR = Path("./dayplots")     # directory containing existing PNG dayplots
-OUTPUT_CSV = "mean_amplitudes.csv"   # CSV file (time, amplitude)
+STORE_DIR = Path("./amplitude_store")  # columnar amplitude store (see amplitudeStore.py)
+LEGACY_CSV = "mean_amplitudes.csv"   # imported into the store on first run, if present
 CHUNK_DURATION_SEC = 60              # segment length for mean amplitude calculation
 FREQ_RANGE = (1.0, 50.0)             # Hz
 CHANNEL = "EHZ"                      # process this channel
-AMP_THRESHOLD = 10e6                 # if mean amplitude exceeds this, replace via interpolation
-
-# File name patterns
-DAYPLOT_PATTERN = "AM_RF90E_EHZ_{date}_5-40Hz.png"
+BATCHED = True                       # compute all minute windows of a day in one vectorized pass
+BATCH_WINDOWS = 256                  # windows per rfft call in batched mode (bounds peak memory)
+FFT_PAD = False                      # zero-pad windows to a fast FFT length (6001 -> 6075 samples), see SpectralKernel
+                                     # (changes stored amplitudes: bump STAGE_VERSIONS["amplitude"] when enabling it)
+FFT_WORKERS = -1                     # scipy.fft threads per call (-1: all CPUs; stationRunner shares them out)
+
+# Spectral features (batched mode only), stored as extra columns next to "amplitude".
+# They come from the same rfft as the amplitude (see spectral_features), so they
+# add little to the stage. Days processed before they were enabled have NaN
+# there; re-run them with `python processingManifest.py --force amplitude ...`
+# while their raw data exists.
+SPECTRAL_FEATURES = True             # band powers and spectral centroid per minute
+FEATURE_BANDS = {                    # store column -> (fmin, fmax) in Hz; band power in counts²
+    "power_1_5": (1.0, 5.0),
+    "power_5_15": (5.0, 15.0),
+    "power_15_40": (15.0, 40.0),
+}
+CENTROID_RANGE = (1.0, 50.0)         # Hz; stored as "centroid"
 # -----------------------
 
+class SpectralKernel:
+    """
+    What the mean band amplitude of windows of n samples needs, built once
+    per (n, fs, band, pad) by spectral_kernel(): the 10 % cosine taper, the
+    FFT length, the frequency grid and the band's bins.
+
+    With pad=True windows are zero-padded to scipy.fft.next_fast_len(n):
+    6001 samples (17 x 353) need Bluestein's algorithm, 6075 (3^5 x 5^2)
+    take about 8x less time. Padding samples the same spectrum on a finer
+    grid (fs / nfft instead of fs / n) and leaves |X| at a given frequency
+    unchanged, so the *mean* over the band needs no correction (a band sum
+    or power would scale by nfft / n). It is a mean over other sample
+    points, though, so values differ from unpadded ones per minute: on the
+    synthetic benchmark day by 0.05 % on average, 0.36 % standard deviation
+    and 2.8 % at most, and up to 3.6 % on other days (benchmarks/bench_fft.py).
+    Padding is therefore off by default; the stored amplitudes stay those of
+    the unpadded transform.
+    """
+
+    def __init__(self, n, fs, freq_range, pad):
+        self.n = n
+        self.nfft = next_fast_len(n, real=True) if pad else n
+        self.taper = cosine_taper(n, 0.10)
+        self.freqs = rfftfreq(self.nfft, d=1.0 / fs)
+
+        fmin, fmax = max(0.0, freq_range[0]), min(freq_range[1], fs / 2.0)
+        sel = np.flatnonzero((self.freqs >= fmin) & (self.freqs <= fmax)) if fmax > fmin else []
+        # The band's bins are contiguous: a slice instead of a boolean mask
+        self.band = slice(sel[0], sel[-1] + 1) if len(sel) else None
+
+    def spectrum(self, windows):
+        """rfft of the tapered (..., n) windows; non-finite samples count as zero."""
+        x = windows * self.taper                  # float64, also for integer windows
+        bad = ~np.isfinite(x)
+        if bad.any():
+            x[bad] = 0.0
+        return rfft(x, n=self.nfft, axis=-1, workers=FFT_WORKERS)
+
+
+@lru_cache(maxsize=8)
+def _spectral_kernel(n, fs, freq_range, pad):
+    return SpectralKernel(n, fs, freq_range, pad)
+
+
+def spectral_kernel(n, fs, freq_range, pad=None):
+    """The cached SpectralKernel for (n, fs, freq_range); pad defaults to FFT_PAD."""
+    return _spectral_kernel(int(n), float(fs), tuple(freq_range), FFT_PAD if pad is None else bool(pad))
+
+
 def calculate_mean_amplitude(tr, freq_range=(1.0, 50.0)):
-    fs = float(tr.stats.sampling_rate)
     data = tr.data.astype(np.float64, copy=False)
     if data.size == 0 or not np.any(np.isfinite(data)):
         return np.nan
 
-    n = data.size
-    win = cosine_taper(n, 0.10)
-    x = np.nan_to_num(data * win, nan=0.0, posinf=0.0, neginf=0.0)
-
-    X = rfft(x)
-    freqs = rfftfreq(n, d=1.0 / fs)
-
-    fmin, fmax = freq_range
-    fmin = max(0.0, fmin)
-    fmax = min(fmax, fs / 2.0)
-    if fmax <= fmin:
+    kernel = spectral_kernel(data.size, tr.stats.sampling_rate, freq_range)
+    if kernel.band is None:
         return np.nan
+    return float(np.mean(np.abs(kernel.spectrum(data)[kernel.band])))
+
+
+def calculate_mean_amplitudes_batched(windows, fs, freq_range=(1.0, 50.0)):
+    """
+    Vectorized calculate_mean_amplitude over the rows of a 2-D (n_windows, n) array.
+    Returns one mean band amplitude per row, identical to the per-window function.
+    """
+    return spectral_columns(windows, fs, freq_range, features=False)["amplitude"]
+
+
+def spectral_columns(windows, fs, freq_range=(1.0, 50.0), features=True):
+    """
+    {column: values} of the rows of a 2-D (n_windows, n) array: "amplitude"
+    as calculate_mean_amplitudes_batched(), plus with features=True the
+    spectral_features() columns, from the same rfft of each block.
+    """
+    n_windows, n = windows.shape
+    out = {"amplitude": np.full(n_windows, np.nan)}
+    kernel = spectral_kernel(n, fs, freq_range) if n > 0 else None
+    if features:
+        out.update({name: np.full(n_windows, np.nan) for name in (*FEATURE_BANDS, "centroid")})
+    if kernel is None or kernel.band is None:
+        return out
+
+    for b0 in range(0, n_windows, BATCH_WINDOWS):
+        block = windows[b0:b0 + BATCH_WINDOWS]
+        X = kernel.spectrum(block)
+        # Row-wise means keep the 1-D summation order, so values are bit-identical
+        amps = np.array([np.mean(row) for row in np.abs(X[:, kernel.band])])
+        # Windows without any finite sample are NaN, as in calculate_mean_amplitude
+        empty = ~np.any(np.isfinite(block), axis=-1)
+        amps[empty] = np.nan
+        out["amplitude"][b0:b0 + len(block)] = amps
+        if features:
+            for name, values in spectral_features(X, kernel, fs).items():
+                values[empty] = np.nan
+                out[name][b0:b0 + len(block)] = values
+
+    return out
+
+
+def spectral_features(X, kernel, fs, bands=None, centroid_range=CENTROID_RANGE):
+    """
+    Power in each band {name: (fmin, fmax)} and the spectral centroid of
+    windows, from their rfft X by kernel (the spectrum the amplitude uses):
+    the one-sided periodogram of the tapered window, in counts², scaled by
+    the taper's power, so values do not depend on FFT_PAD. Every band is one
+    difference of the cumulative sum. Returns {column: values}.
+    """
+    bands = tuple((bands or FEATURE_BANDS).items())
+    freqs = kernel.freqs
+
+    def bins(fmin, fmax):
+        return (int(np.searchsorted(freqs, fmin, side="left")),
+                int(np.searchsorted(freqs, fmax, side="right")))
+
+    band_bins = [(name, *bins(*band)) for name, band in bands]
+    c0, c1 = bins(*centroid_range)
+    lo = min([c0] + [i0 for _, i0, _ in band_bins])
+    hi = max([c1] + [i1 for _, _, i1 in band_bins])
+
+    # Periodogram bins lo..hi-1 (one-sided, DC and Nyquist not doubled)
+    k = np.arange(lo, hi)
+    psd = X[:, lo:hi].real ** 2 + X[:, lo:hi].imag ** 2
+    psd *= np.where((k == 0) | (2 * k == kernel.nfft), 1.0, 2.0) / (fs * np.sum(kernel.taper ** 2))
+    df = fs / kernel.nfft
+
+    cum = np.concatenate([np.zeros((len(X), 1)), np.cumsum(psd, axis=-1)], axis=-1)
+    out = {name: (cum[:, i1 - lo] - cum[:, i0 - lo]) * df for name, i0, i1 in band_bins}
+    total = cum[:, c1 - lo] - cum[:, c0 - lo]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out["centroid"] = psd[:, c0 - lo:c1 - lo] @ freqs[c0:c1] / total
+    return out
+
+
+def fill_gaps(tr):
+    """
+    Zero-fill the masked samples of a merged trace in place and keep their
+    [start, stop) sample spans in tr.stats.gap_spans, so later stages can
+    tell filled samples from quiet data.
+    """
+    mask = np.ma.getmaskarray(tr.data)
+    edges = np.flatnonzero(np.diff(np.r_[False, mask, False].astype(np.int8)))
+    tr.stats.gap_spans = edges.reshape(-1, 2).tolist()
+    tr.data = np.ma.filled(tr.data, 0)
+    return tr
+
+
+def gap_mask(tr):
+    """Boolean mask of the zero-filled samples of a trace, or None if it has no gaps."""
+    spans = tr.stats.get("gap_spans")
+    if not spans:
+        return None
+    mask = np.zeros(tr.stats.npts, dtype=bool)
+    for i0, i1 in spans:
+        mask[i0:i1] = True
+    return mask
+
+
+def load_day_trace(file_path):
+    """
+    Read one MiniSEED file as its CHANNEL trace over the whole UTC day (or
+    None). Records are decoded straight into one day buffer (mseedDayBuffer),
+    without merge() and trim(); gaps are zero-filled and listed in
+    tr.stats.gap_spans, as fill_gaps() does.
+    """
+    return read_day(file_path, CHANNEL)
+
+
+def amplitude_rows(tr, chunk_duration=CHUNK_DURATION_SEC, freq_range=FREQ_RANGE, n_windows=None):
+    """
+    Minute rows of an already merged trace. The day array is viewed as
+    (n_windows, chunk_samples) and transformed in a few rfft calls instead of
+    one Trace slice and FFT per minute. With SPECTRAL_FEATURES, the rows also
+    carry the spectral_features() columns of the same spectra. Minutes that
+    overlap a zero-filled gap (tr.stats.gap_spans) are NaN. The trace is not
+    modified.
+
+    By default only windows that fit without sharing the trace's last sample
+    are used; n_windows asks for that many, which a trace of exactly
+    n_windows minutes (plus the closing boundary sample) holds, as the live
+    service cuts them.
+    """
+    rows = []
+    fs = float(tr.stats.sampling_rate)
+    start_t = tr.stats.starttime
+
+    chunk_samples = int(chunk_duration * fs) + 1
+    if chunk_samples <= 0:
+        return rows
+
+    # Consecutive windows share their boundary sample, exactly like the
+    # inclusive [t0, t1] slices of the per-minute loop.
+    data = np.asarray(tr.data)
+    step = int(round(chunk_duration * fs))
+    n_full = data.size // chunk_samples
+    if n_windows is not None:
+        n_full = min(n_windows, max(0, (data.size - chunk_samples) // step + 1))
+    if n_full == 0:
+        return rows
+    windows = np.lib.stride_tricks.sliding_window_view(data, chunk_samples)[::step][:n_full]
+
+    columns = spectral_columns(windows, fs, freq_range=freq_range, features=SPECTRAL_FEATURES)
+
+    mask = gap_mask(tr)
+    if mask is not None:
+        # Filled samples per window from a cumulative count
+        filled = np.r_[0, np.cumsum(mask)]
+        starts = np.arange(n_full) * step
+        gappy = filled[starts + chunk_samples] > filled[starts]
+        for values in columns.values():
+            values[gappy] = np.nan
+
+    names = list(columns)
+    for k, values in enumerate(zip(*columns.values())):
+        row = {"time": f"{(start_t + k * chunk_duration).isoformat()}Z"}
+        row.update(zip(names, map(float, values)))
+        rows.append(row)
+    return rows
 
-    sel = (freqs >= fmin) & (freqs <= fmax)
-    if not np.any(sel):
-        return np.nan
 
-    return float(np.mean(np.abs(X[sel])))
+def process_miniseed_file_batched(file_path, chunk_duration=CHUNK_DURATION_SEC,
+                                  freq_range=FREQ_RANGE):
+    """Same output as process_miniseed_file_in_chunks, via amplitude_rows()."""
+    try:
+        tr = load_day_trace(file_path)
+        if tr is None:
+            return []
+        return amplitude_rows(tr, chunk_duration, freq_range)
+    except Exception as e:
+        print(f"[ERROR] {file_path}: {e}")
+        return []
 
 
 def process_miniseed_file_in_chunks(file_path, chunk_duration=CHUNK_DURATION_SEC,
                                     freq_range=FREQ_RANGE):
+    """
+    One Trace slice and FFT per minute (BATCHED = False). Minutes that
+    overlap a gap are NaN, as in amplitude_rows().
+    """
     rows = []
     try:
         st = read(str(file_path))
@@ -57,7 +287,7 @@ def process_miniseed_file_in_chunks(file_path, chunk_duration=CHUNK_DURATION_SEC
             return rows
 
         try:
-            st.merge(method=1, fill_value=0)
+            st.merge(method=1)
         except Exception:
             st.merge(method=0)
 
@@ -65,7 +295,8 @@ def process_miniseed_file_in_chunks(file_path, chunk_duration=CHUNK_DURATION_SEC
         if len(st) == 0:
             return rows
 
-        tr = st[0]
+        tr = fill_gaps(st[0])
+        mask = gap_mask(tr)
         fs = float(tr.stats.sampling_rate)
         npts = int(tr.stats.npts)
         start_t = tr.stats.starttime
@@ -78,9 +309,15 @@ def process_miniseed_file_in_chunks(file_path, chunk_duration=CHUNK_DURATION_SEC
         if n_full == 0:
             return rows
 
+        step = int(round(chunk_duration * fs))
         for k in range(n_full):
             t0 = start_t + k * chunk_duration
             t1 = t0 + chunk_duration
+            ts = f"{UTCDateTime(t0).isoformat()}Z"
+            if mask is not None and mask[k * step:k * step + chunk_samples].any():
+                rows.append({"time": ts, "amplitude": np.nan})
+                continue
+
             chunk_tr = tr.slice(starttime=t0, endtime=t1, nearest_sample=False)
 
             if int(chunk_tr.stats.npts) != chunk_samples:
@@ -93,7 +330,6 @@ def process_miniseed_file_in_chunks(file_path, chunk_duration=CHUNK_DURATION_SEC
                     continue
 
             amp = calculate_mean_amplitude(chunk_tr, freq_range=freq_range)
-            ts = f"{UTCDateTime(t0).isoformat()}Z"
             rows.append({"time": ts, "amplitude": amp})
 
     except Exception as e:
@@ -102,9 +338,9 @@ def process_miniseed_file_in_chunks(file_path, chunk_duration=CHUNK_DURATION_SEC
     return rows
 
 
-def process_all_miniseed(input_dir: Path, dayplot_dir: Path):
-    """Process only MiniSEED files that do NOT already have a PNG dayplot."""
-    all_rows = []
+def process_all_miniseed(input_dir: Path, manifest):
+    """Process the MiniSEED files whose amplitude stage is not done; returns {day: rows}."""
+    day_rows = {}
     for root, _, files in os.walk(input_dir):
         for name in sorted(files):
             if not name.lower().endswith(".mseed"):
@@ -118,67 +354,82 @@ def process_all_miniseed(input_dir: Path, dayplot_dir: Path):
                 print(f"[WARN] Skipping malformed file: {name}")
                 continue
 
-            expected_png = DAYPLOT_PATTERN.format(date=date_part)
-            png_path = dayplot_dir / expected_png
-
-            # Skip if dayplot exists
-            if png_path.exists():
-                print(f"[SKIP] {name} — dayplot exists ({png_path.name})")
+            # Skip days the manifest already has amplitudes for
+            if manifest.is_done("amplitude", date_part, adopt=ADOPT["amplitude"]):
+                print(f"[SKIP] {name} — amplitudes already stored")
                 continue
 
-            print(f"Processing {name} (no dayplot found)...")
-            all_rows.extend(process_miniseed_file_in_chunks(fp))
-    return all_rows
+            print(f"Processing {name}...")
+            with runReport.span("amplitude", date_part) as rec:
+                if BATCHED:
+                    day_rows[date_part] = process_miniseed_file_batched(fp)
+                else:
+                    day_rows[date_part] = process_miniseed_file_in_chunks(fp)
+                rec["rows"] = len(day_rows[date_part])
+    return day_rows
+
+
+def append_rows(store, rows, replace=False):
+    """
+    Append amplitude rows (with any spectral feature columns); returns the
+    number of new timestamps. replace=True overwrites stored minutes (a day
+    processed again). Raw amplitudes are stored as they are; spikes and gaps
+    are handled by amplitudeCleaning, and the rows are marked for it.
+    """
+    if not rows:
+        return 0
+    new_df = pd.DataFrame(rows)
+    new_df.sort_values("time", inplace=True)
 
+    # NaN quality = not cleaned yet (amplitudeCleaning.clean_store)
+    new_df[QUALITY_COLUMN] = np.nan
 
-def main():
-    # ----------------------------------------------------------
-    # Step 1: Load existing CSV (if any)
-    # ----------------------------------------------------------
-    existing_times = set()
-    if os.path.exists(OUTPUT_CSV):
-        try:
-            df_existing = pd.read_csv(OUTPUT_CSV, usecols=["time"])
-            existing_times = set(df_existing["time"].astype(str))
-            print(f"[INFO] Loaded existing CSV with {len(existing_times)} timestamps.")
-        except Exception as e:
-            print(f"[WARN] Could not read existing CSV ({e}); starting fresh.")
-            existing_times = set()
+    # Timestamps already stored are skipped unless replacing
+    return store.append(to_epoch_seconds(new_df["time"]), replace=replace,
+                        **{name: new_df[name].to_numpy() for name in new_df.columns if name != "time"})
 
-    # ----------------------------------------------------------
-    # Step 2: Process MiniSEED files without PNGs
-    # ----------------------------------------------------------
-    rows = process_all_miniseed(INPUT_DIR, DAYPLOT_DIR)
+
+def record_rows(manifest, day, rows):
+    """Log a day's amplitude rows in the processing manifest (none = 'empty')."""
     if not rows:
-        print("[INFO] No new data found (all days already have PNGs).")
+        manifest.record("amplitude", day, "empty")
         return
+    amps = np.array([r["amplitude"] for r in rows], dtype=np.float32)
+    manifest.record("amplitude", day, DONE, rows=len(rows), checksum=checksum(amps))
 
-    new_df = pd.DataFrame(rows, columns=["time", "amplitude"])
-    new_df.sort_values("time", inplace=True)
-
-    # Filter out already existing timestamps
-    before = len(new_df)
-    new_df = new_df[~new_df["time"].astype(str).isin(existing_times)]
-    after = len(new_df)
 
-    if after == 0:
+def main():
+    # ----------------------------------------------------------
+    # Step 1: Open the amplitude store (imports the old CSV once)
+    # ----------------------------------------------------------
+    store = open_store(STORE_DIR, LEGACY_CSV)
+
+    with runReport.run("amplitude"), Manifest() as manifest:
+        # ------------------------------------------------------
+        # Step 2: Process MiniSEED files the manifest has not seen done
+        # ------------------------------------------------------
+        day_rows = process_all_miniseed(INPUT_DIR, manifest)
+        rows = [row for day in day_rows.values() for row in day]
+        if not day_rows:
+            print("[INFO] No new data found (all days already processed).")
+            return
+
+        # ------------------------------------------------------
+        # Step 3: Append; timestamps already stored are skipped
+        # ------------------------------------------------------
+        # Only days the manifest lists as not done get here, so their minutes are replaced
+        with runReport.span("store_append") as rec:
+            added = append_rows(store, rows, replace=True)
+            rec["rows"] = added
+        for day, rows_of_day in day_rows.items():
+            record_rows(manifest, day, rows_of_day)
+
+    if added == 0:
         print("[INFO] No new timestamps to append.")
         return
 
-    print(f"[INFO] Found {before} total rows, {after} new unique timestamps to add.")
-
-    # Apply amplitude threshold
-    new_df.loc[new_df["amplitude"] > AMP_THRESHOLD, "amplitude"] = np.nan
-
-    # ----------------------------------------------------------
-    # Step 3: Append or create CSV
-    # ----------------------------------------------------------
-    if os.path.exists(OUTPUT_CSV):
-        new_df.to_csv(OUTPUT_CSV, mode="a", index=False, header=False)
-        print(f"[OK] Appended {len(new_df)} new rows to {OUTPUT_CSV}")
-    else:
-        new_df.to_csv(OUTPUT_CSV, index=False)
-        print(f"[OK] Created {OUTPUT_CSV} with {len(new_df)} rows")
+    print(f"[INFO] Found {len(rows)} total rows, {added} new unique timestamps to add.")
+    print(f"[OK] Appended {added} new rows to {STORE_DIR} ({len(store)} total)")
 
 
 if __name__ == "__main__":
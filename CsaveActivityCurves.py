@@ -7,23 +7,101 @@ Tremor / Activity Processor (Headless)
 - Produces tremor (blue) and activity (red) lines
 - Saves hourly-sampled values to processed_activity.csv
 - No plotting, no tidal calculations
+
+The curves use the cleaned amplitudes (despiked, short gaps interpolated,
+see amplitudeCleaning.py); every run first cleans the minutes added since
+the last one.
+
+Incremental mode
+----------------
+The first run does a full recompute and saves a small state file. Later runs
+only load the minutes added to the amplitude store since then, recompute the
+trailing PATCH_MINUTES (plus CONTEXT_MINUTES of read-only look-back for the
+centered windows and a windowed Hilbert envelope), and patch the hourly rows
+from that point on. Everything before is frozen; global statistics (mean of
+the difference curve, min/max used for normalization) are kept as running
+aggregates in the state. New minutes inside the history, or stored minutes
+before the frozen point whose values changed (a re-processed day; see
+AmplitudeStore.replaced_from()), make the run a full recompute instead.
+
+Run with --verify to compare the current output with a full recompute.
+
+Out-of-core mode
+----------------
+Full recomputes of histories longer than OUT_OF_CORE_MINUTES (or of any,
+with --chunked) stream the store in blocks of BLOCK_MINUTES rows, read with
+BLOCK_OVERLAP rows of context on either side, instead of loading it into
+one DataFrame (see compute_activity_chunked). Per-minute intermediates go
+to scratch files on disk, so memory stays at a few blocks plus the
+hourly table however many years are processed. The activity score matches
+the in-memory path to rounding; the tremor score uses a Hilbert envelope
+per block and agrees with it within VERIFY_TOLERANCE, like the incremental
+mode. The CSV, tiers and incremental state are written as usual.
+
+Dashboard tiers
+---------------
+Besides the CSV, every run writes the scores pre-aggregated to TIER_DIR for
+index.html: hourly, 6-hourly and daily slots with min/mean/max of both
+scores, as raw little-endian Float32 files (six values per slot, NaN for
+missing slots). Hourly files hold one UTC month, the coarser tiers one UTC
+year; a file starts at its partition start and ends at the last slot with
+data. manifest.json only holds the covered time range and this layout, so
+the dashboard can compute which files a time range needs and its first load
+does not grow with the history.
 """
 
 import pandas as pd
 import numpy as np
 from scipy.signal import hilbert
+from pathlib import Path
+import json
 import time
 import os
-
-start = time.time()
+import sys
+import tempfile
+import runReport
+from amplitudeStore import open_store
+from amplitudeCleaning import clean_store, CLEAN_COLUMN
 
 # ---------------- Parameters ----------------
 MINUTES_PER_DAY = 24 * 60
 WINDOW_DAY = MINUTES_PER_DAY         # 1-day smoothing window
 WINDOW_HOUR = 60                     # 1-hour smoothing window
 WINDOW_ENVELOPE_SMOOTH = 1200        # smoothing window for envelope
-CSV_INPUT = "mean_amplitudes.csv"
+STORE_DIR = Path("./amplitude_store")  # minute amplitudes (see amplitudeStore.py)
+LEGACY_CSV = "mean_amplitudes.csv"   # imported into the store on first run, if present
 CSV_OUTPUT = "processed_activity2.csv"
+AMPLITUDE_SCALE = 2_500_000          # amplitudes are divided by this on load
+
+# Incremental mode
+INCREMENTAL = True
+STATE_FILE = "activity_state.npz"
+PATCH_MINUTES = 2 * MINUTES_PER_DAY  # trailing minutes recomputed and patched on every run
+CONTEXT_MINUTES = 3 * MINUTES_PER_DAY  # read-only look-back before the patched tail
+# Max abs score deviation accepted by --verify on the settled history. The
+# activity score matches to rounding; the tremor score follows a full-series
+# Hilbert transform, so its past values shift a little as history grows
+# (about 0.003 after ten incremental days, 0.005 for the chunked mode, on
+# synthetic stores; tests/test_activity_verify.py). Its first day (where the
+# full transform wraps around to the series end) and the still-open tail are
+# reported but not gated.
+VERIFY_TOLERANCE = 0.02
+
+# Out-of-core mode
+OUT_OF_CORE_MINUTES = 3 * 365 * MINUTES_PER_DAY  # longer histories are recomputed block-wise (None: never)
+BLOCK_MINUTES = 30 * MINUTES_PER_DAY  # rows per block
+BLOCK_OVERLAP = CONTEXT_MINUTES      # rows of context read on either side of a block
+SCRATCH_DIR = None                   # directory of the per-minute scratch arrays (None: system temp)
+
+# Pre-aggregated tiers for the dashboard
+TIER_DIR = Path("activity_tiers")
+TIERS = (                            # name, slot length [s], one file per UTC ...
+    ("1h", 3600, "month"),
+    ("6h", 6 * 3600, "year"),
+    ("1d", 24 * 3600, "year"),
+)
+TIER_COLUMNS = ('tremor_score_blue', 'activity_score_red')
+TIER_STATS = ('min', 'mean', 'max')
 
 # ---------------- Helper function ----------------
 def normalize(series):
@@ -33,60 +111,586 @@ def normalize(series):
         return np.zeros_like(series)
     return (series - smin) / (smax - smin)
 
-# ---------------- Load and preprocess ----------------
-if not os.path.exists(CSV_INPUT):
-    raise FileNotFoundError(f"❌ Input file not found: {CSV_INPUT}")
 
-print(f"[INFO] Loading {CSV_INPUT} ...")
-df = pd.read_csv(CSV_INPUT)
-df['time'] = pd.to_datetime(df['time'], utc=True, errors='coerce')
-df['amplitude'] /= 2_500_000  # scale amplitudes
+def time_ns(times):
+    """Nanosecond epoch integers of a tz-aware datetime Series."""
+    return times.to_numpy(dtype="datetime64[ns]").view("int64")
+
+
+def load_amplitudes(store, start=None, end=None):
+    """Load scaled, cleaned minute amplitudes from the store, for epoch seconds start <= t < end."""
+    return amplitude_frame(*store.load(start=start, end=end, columns=(CLEAN_COLUMN,)))
+
+
+def amplitude_frame(times, cols):
+    """(time, amplitude) frame of store rows."""
+    return pd.DataFrame({
+        'time': pd.to_datetime(times, unit='s', utc=True),
+        'amplitude': cols[CLEAN_COLUMN].astype(float) / AMPLITUDE_SCALE,  # scale amplitudes
+    })
+
 
 # ---------------- Rolling windows ----------------
-df['smooth_day'] = df['amplitude'].rolling(window=WINDOW_DAY, center=True).mean()
-df['smooth_hour'] = df['amplitude'].rolling(window=WINDOW_HOUR, center=True).mean()
-
-# Interpolate daily smooth to match timestamps
-valid_mask = df['smooth_day'].notna()
-if valid_mask.sum() > 2:
-    df['smooth_day_interp'] = np.interp(
-        df['time'].view('int64'),
-        df.loc[valid_mask, 'time'].view('int64'),
-        df.loc[valid_mask, 'smooth_day']
-    )
-else:
-    df['smooth_day_interp'] = np.nan
-
-# ---------------- Difference and normalization ----------------
-df['difference'] = df['smooth_hour'] - df['smooth_day_interp']
-df['difference_demean'] = df['difference'] - df['difference'].mean()
-max_abs = np.nanmax(np.abs(df['difference_demean']))
-if np.isfinite(max_abs) and max_abs > 0:
-    df['difference_demean'] /= max_abs
-else:
-    df['difference_demean'] = 0
+def rolling_means(amplitude):
+    """Centered 1-day and 1-hour rolling means of the amplitude series."""
+    return (amplitude.rolling(window=WINDOW_DAY, center=True).mean(),
+            amplitude.rolling(window=WINDOW_HOUR, center=True).mean())
+
+
+def smooth_curves(df):
+    """Add smooth_day, smooth_hour, smooth_day_interp and difference columns."""
+    df['smooth_day'], df['smooth_hour'] = rolling_means(df['amplitude'])
+
+    # Interpolate daily smooth to match timestamps
+    valid_mask = df['smooth_day'].notna()
+    if valid_mask.sum() > 2:
+        t = time_ns(df['time'])
+        df['smooth_day_interp'] = np.interp(
+            t,
+            t[valid_mask.to_numpy()],
+            df.loc[valid_mask, 'smooth_day']
+        )
+    else:
+        df['smooth_day_interp'] = np.nan
+
+    df['difference'] = df['smooth_hour'] - df['smooth_day_interp']
+    return df
+
 
 # ---------------- Hilbert envelope (tremor indicator) ----------------
-analytic_signal = hilbert(df['difference_demean'].fillna(0))
-envelope_raw = np.abs(analytic_signal)
-df['envelope_smooth'] = (
-    pd.Series(envelope_raw)
-    .rolling(window=WINDOW_ENVELOPE_SMOOTH, center=True, min_periods=1)
-    .mean()
-)
+def envelope_curve(difference_demean):
+    """Smoothed Hilbert envelope of the (demeaned) difference curve."""
+    analytic_signal = hilbert(difference_demean.fillna(0).to_numpy())
+    envelope_raw = np.abs(analytic_signal)
+    return (
+        pd.Series(envelope_raw, index=difference_demean.index)
+        .rolling(window=WINDOW_ENVELOPE_SMOOTH, center=True, min_periods=1)
+        .mean()
+    )
+
+
+def compute_activity(df):
+    """Full recompute over the whole minute series; returns the hourly scores."""
+    smooth_curves(df)
+
+    # ---------------- Difference and normalization ----------------
+    df['difference_demean'] = df['difference'] - df['difference'].mean()
+    max_abs = np.nanmax(np.abs(df['difference_demean']))
+    if np.isfinite(max_abs) and max_abs > 0:
+        df['difference_demean'] /= max_abs
+    else:
+        df['difference_demean'] = 0.0
+    df.attrs['max_abs'] = max_abs
+
+    df['envelope_smooth'] = envelope_curve(df['difference_demean'])
+
+    # ---------------- Normalize indicators ----------------
+    df['D'] = normalize(df['envelope_smooth'])   # Tremor (blue)
+    df['E'] = normalize(df['smooth_day'])        # Activity (red)
+
+    # ---------------- Resample to hourly sampling ----------------
+    df_final = df[['time', 'D', 'E']].copy()
+    df_final.rename(columns={'D': 'tremor_score_blue', 'E': 'activity_score_red'}, inplace=True)
+    df_final.set_index('time', inplace=True)
+    return df_final.resample('1h').mean().reset_index()
+
+
+# ---------------- Incremental state ----------------
+def hourly_means(times, envelope, smooth_day):
+    """Hourly means of the un-normalized envelope and daily curve."""
+    frame = pd.DataFrame({'env': envelope.to_numpy(), 'day': smooth_day.to_numpy()},
+                         index=pd.DatetimeIndex(times))
+    return frame.resample('1h').mean()
+
+
+def next_boundary(times, start):
+    """
+    Row index where the next frozen region ends: the first row of the hour that
+    contains row len - PATCH_MINUTES, never before `start`.
+    """
+    t = time_ns(times)
+    r = max(start, len(t) - PATCH_MINUTES)
+    if r >= len(t):
+        return start
+    hour_ns = 3600 * 10**9
+    hour_start = t[r] - t[r] % hour_ns
+    return start + int(np.searchsorted(t[start:], hour_start, side="left"))
+
+
+def _nan_stat(func, values, default):
+    values = np.asarray(values, dtype=float)
+    return float(func(values)) if np.any(np.isfinite(values)) else default
+
+
+def build_state(df, start, stop, base, envelope, hourly, row_count):
+    """
+    Fold rows [start, stop) of the computed frame into the frozen aggregates
+    of `base` and keep the look-back needed by the next run.
+    """
+    frozen = slice(start, stop)
+    diff = df['difference'].to_numpy()[frozen]
+    env = envelope.to_numpy()[frozen]
+    day = df['smooth_day'].to_numpy()[frozen]
+    ctx = max(0, stop - CONTEXT_MINUTES)
+
+    # Hour-aligned, so no hourly row mixes frozen and recomputed minutes
+    t = time_ns(df['time'])
+    hour_ns = 3600 * 10**9
+    frozen_until = int(t[stop] - t[stop] % hour_ns) if stop < len(t) else int(t[-1]) + 1
+
+    return {
+        'diff_sum': base['diff_sum'] + float(np.nansum(diff)),
+        'diff_count': base['diff_count'] + int(np.count_nonzero(np.isfinite(diff))),
+        'env_min': min(base['env_min'], _nan_stat(np.nanmin, env, np.inf)),
+        'env_max': max(base['env_max'], _nan_stat(np.nanmax, env, -np.inf)),
+        'day_min': min(base['day_min'], _nan_stat(np.nanmin, day, np.inf)),
+        'day_max': max(base['day_max'], _nan_stat(np.nanmax, day, -np.inf)),
+        'frozen_until': frozen_until,
+        'tail_time': t[ctx:].copy(),
+        'n_context': stop - ctx,
+        'hour_time': hourly.index.to_numpy(dtype="datetime64[ns]").view("int64"),
+        'hour_env': hourly['env'].to_numpy(),
+        'hour_day': hourly['day'].to_numpy(),
+        'last_time': int(t[-1] // 10**9),
+        'row_count': row_count,
+    }
+
+
+EMPTY_STATE = {'diff_sum': 0.0, 'diff_count': 0, 'env_min': np.inf, 'env_max': -np.inf,
+               'day_min': np.inf, 'day_max': -np.inf}
+
+
+def save_state(state, path=STATE_FILE):
+    np.savez(path, **{k: np.asarray(v) for k, v in state.items()})
+
+
+def load_state(path=STATE_FILE):
+    with np.load(path) as z:
+        return {k: (z[k].item() if z[k].ndim == 0 else z[k]) for k in z.files}
+
+
+def hourly_scores(state, norm):
+    """Normalize the stored hourly means into the output frame."""
+    env_min, env_max, day_min, day_max = norm
+    env = state['hour_env']
+    day = state['hour_day']
+    blue = (env - env_min) / (env_max - env_min) if env_max > env_min else np.zeros_like(env)
+    red = (day - day_min) / (day_max - day_min) if day_max > day_min else np.zeros_like(day)
+    return pd.DataFrame({
+        'time': pd.to_datetime(state['hour_time'], utc=True),
+        'tremor_score_blue': blue,
+        'activity_score_red': red,
+    })
+
+
+def write_scores(df_hourly, patch_from=None, patch_offset=None, keep_from=None):
+    """
+    Write hourly rows. With patch_from/patch_offset, the file is truncated at
+    patch_offset and only rows from hour patch_from on are rewritten.
+    Returns the byte offset of the first row at or after hour keep_from.
+    """
+    t = time_ns(df_hourly['time'])
+    if patch_offset is not None:
+        rows = df_hourly[t >= patch_from]
+        t = t[t >= patch_from]
+        mode, header = "r+b", False
+    else:
+        rows = df_hourly
+        mode, header = "wb", True
+
+    split = int(np.searchsorted(t, keep_from, side="left")) if keep_from is not None else len(rows)
+    with open(CSV_OUTPUT, mode) as f:
+        if patch_offset is not None:
+            f.seek(patch_offset)
+            f.truncate()
+        f.write(rows.iloc[:split].to_csv(index=False, header=header).encode())
+        offset = f.tell()
+        f.write(rows.iloc[split:].to_csv(index=False, header=header and split == 0).encode())
+    return offset
+
+
+def partition_key(seconds, partition):
+    """UTC month ('2025-06') or year ('2025') of epoch seconds, as datetime64."""
+    unit = 'M' if partition == "month" else 'Y'
+    return seconds.astype('datetime64[s]').astype(f'datetime64[{unit}]')
+
+
+def _write_atomic(path, data):
+    """Replace a file in one step, so the dashboard never reads half of it."""
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def write_tiers(df_hourly, since=None):
+    """
+    Write the dashboard tiers from the hourly frame. With `since` (epoch ns),
+    only partitions reaching that hour or later are rewritten; otherwise all
+    of them are, and files of partitions without data are removed.
+    """
+    if len(df_hourly) == 0:
+        return
+    seconds = time_ns(df_hourly['time']) // 1_000_000_000
+    values = df_hourly[list(TIER_COLUMNS)].astype(float)
+
+    written = 0
+    for name, step, partition in TIERS:
+        tier_dir = TIER_DIR / name
+        tier_dir.mkdir(parents=True, exist_ok=True)
+        keys = partition_key(seconds, partition)
+        first_key = keys[0] if since is None else partition_key(np.array([since // 1_000_000_000]), partition)[0]
+        kept = set()
+        for key in np.unique(keys[keys >= first_key]):
+            rows = keys == key
+            start = key.astype('datetime64[s]').astype(np.int64)
+            slot = (seconds[rows] - start) // step
+            agg = values[rows].groupby(slot).agg(list(TIER_STATS))   # columns: (score, stat)
+            out = np.full((int(slot[-1]) + 1, agg.shape[1]), np.nan, dtype='<f4')
+            out[agg.index.to_numpy()] = agg.to_numpy()
+            path = tier_dir / f"{key}.bin"
+            _write_atomic(path, out.tobytes())
+            kept.add(path.name)
+            written += 1
+        if since is None:
+            for stale in tier_dir.glob("*.bin"):
+                if stale.name not in kept:
+                    stale.unlink()
+
+    manifest = {
+        "format": "float32le",
+        "fields": [f"{c}_{stat}" for c in TIER_COLUMNS for stat in TIER_STATS],
+        "tiers": [{"name": name, "step": step, "partition": partition} for name, step, partition in TIERS],
+        "start": int(seconds[0]),
+        "end": int(seconds[-1]) + 3600,   # exclusive
+        "updated": int(time.time()),
+    }
+    _write_atomic(TIER_DIR / "manifest.json", json.dumps(manifest, indent=1).encode())
+    print(f"[OK] Wrote {written} tier files to {TIER_DIR}/")
+
+
+def full_state(df):
+    """Incremental state of a frame computed by compute_activity()."""
+    max_abs = df.attrs['max_abs']
+    scale = max_abs if np.isfinite(max_abs) and max_abs > 0 else 1.0
+    envelope = df['envelope_smooth'] * scale   # un-normalized, comparable across runs
+    stop = next_boundary(df['time'], 0)
+    hourly = hourly_means(df['time'], envelope, df['smooth_day'])
+    return build_state(df, 0, stop, EMPTY_STATE, envelope, hourly, len(df))
+
+
+# ---------------- Out-of-core mode ----------------
+def row_blocks(n, size=BLOCK_MINUTES):
+    """[start, stop) row ranges of at most `size` rows covering n rows."""
+    return [(a, min(a + size, n)) for a in range(0, n, size)]
+
+
+def _extend(extremes, i, values):
+    """Widen the (min, max) pair at extremes[i:i + 2] to the finite values."""
+    extremes[i] = min(extremes[i], _nan_stat(np.nanmin, values, np.inf))
+    extremes[i + 1] = max(extremes[i + 1], _nan_stat(np.nanmax, values, -np.inf))
+
+
+def compute_activity_chunked(store, scratch_dir=SCRATCH_DIR):
+    """
+    compute_activity() and full_state() without holding the history in
+    memory; returns (hourly scores, state), the state None for an empty store.
+
+    Three passes over blocks of BLOCK_MINUTES rows. Blocks are read with
+    BLOCK_OVERLAP rows of context on either side, so the centered windows
+    and the Hilbert transform see past their edges:
+
+    1. Rolling daily and hourly means of each block go to scratch files,
+       with the first and last valid daily value per block.
+    2. The daily curve, interpolated over its gaps with the valid values of
+       neighbouring blocks, gives the difference curve and its mean.
+    3. The envelope of the demeaned difference is summed per hour, next to
+       the daily curve, and the min/max of both are taken over the blocks.
+       These then normalize the hourly means, which equals normalizing the
+       minutes first (to rounding) as normalization is linear.
+    """
+    n = len(store)
+    if n == 0:
+        return compute_activity(load_amplitudes(store)), None
+    blocks = row_blocks(n)
+    margin = max(BLOCK_OVERLAP, WINDOW_DAY)
+    hour_ns = 3600 * 10**9
+
+    with tempfile.TemporaryDirectory(prefix="activity-", dir=scratch_dir) as tmp:
+        # One .npy file per block and column, read back whole (not memory-mapped)
+        def save(name, k, values):
+            np.save(os.path.join(tmp, f"{name}-{k}.npy"), values)
+
+        def load(name, k):
+            return np.load(os.path.join(tmp, f"{name}-{k}.npy"))
+
+        def rows(name, lo, hi):
+            """Rows [lo, hi) of a scratch column."""
+            return np.concatenate([load(name, k)[max(lo, a) - a:min(hi, b) - a]
+                                   for k, (a, b) in enumerate(blocks) if a < hi and b > lo])
+
+        # ---------------- Pass 1: rolling means ----------------
+        anchors = []     # ((time, value) of the first, of the last valid smooth_day) per block
+        n_valid = 0
+        for k, (a, b) in enumerate(blocks):
+            lo, hi = max(0, a - margin), min(n, b + margin)
+            df = amplitude_frame(*store.load_rows(lo, hi, columns=(CLEAN_COLUMN,)))
+            core = slice(a - lo, b - lo)
+            smooth_day, smooth_hour = rolling_means(df['amplitude'])
+            t = time_ns(df['time'])[core]
+            day = smooth_day.to_numpy()[core]
+            save("time", k, t)
+            save("day", k, day)
+            save("hour", k, smooth_hour.to_numpy()[core])
+            valid = np.flatnonzero(np.isfinite(day))
+            anchors.append(((t[valid[0]], day[valid[0]]), (t[valid[-1]], day[valid[-1]]))
+                           if len(valid) else None)
+            n_valid += len(valid)
+
+        # End of the frozen region, as next_boundary() finds it on the whole series
+        tail = max(0, n - PATCH_MINUTES - CONTEXT_MINUTES - 60)
+        stop = tail + next_boundary(pd.Series(pd.to_datetime(rows("time", tail, n), utc=True)), 0)
+
+        # ---------------- Pass 2: difference curve ----------------
+        following = [None] * len(blocks)   # first valid (time, value) after each block
+        for k in range(len(blocks) - 2, -1, -1):
+            following[k] = anchors[k + 1][0] if anchors[k + 1] else following[k + 1]
+        preceding = None                   # last valid (time, value) before the block
+        diff_sum, diff_count, frozen_sum, frozen_count = 0.0, 0, 0.0, 0
+        for k, (a, b) in enumerate(blocks):
+            t, day = load("time", k), load("day", k)
+            if n_valid > 2:
+                valid = np.isfinite(day)
+                before = [preceding] if preceding is not None else []
+                after = [following[k]] if following[k] is not None else []
+                xp = np.concatenate([[p[0] for p in before], t[valid], [p[0] for p in after]])
+                fp = np.concatenate([[p[1] for p in before], day[valid], [p[1] for p in after]])
+                diff = load("hour", k) - np.interp(t, xp, fp)
+            else:
+                diff = np.full(b - a, np.nan)
+            save("diff", k, diff)
+            if anchors[k]:
+                preceding = anchors[k][1]
+            f = max(0, min(b, stop) - a)
+            diff_sum += float(np.nansum(diff))
+            diff_count += int(np.count_nonzero(np.isfinite(diff)))
+            frozen_sum += float(np.nansum(diff[:f]))
+            frozen_count += int(np.count_nonzero(np.isfinite(diff[:f])))
+        mean = diff_sum / diff_count if diff_count else 0.0
+
+        # ---------------- Pass 3: envelope, hourly means, min/max ----------------
+        t_first, t_last = int(load("time", 0)[0]), int(load("time", len(blocks) - 1)[-1])
+        h0 = t_first - t_first % hour_ns
+        n_hours = (t_last - h0) // hour_ns + 1
+        sums = np.zeros((4, n_hours))      # envelope sum, count, daily sum, count
+        norm = [np.inf, -np.inf, np.inf, -np.inf]      # envelope and daily min/max
+        frozen = list(norm)                # the same over the frozen rows
+        for k, (a, b) in enumerate(blocks):
+            lo, hi = max(0, a - margin), min(n, b + margin)
+            env = envelope_curve(pd.Series(rows("diff", lo, hi) - mean)).to_numpy()[a - lo:b - lo]
+            hour = (load("time", k) - h0) // hour_ns
+            first, span = int(hour[0]), slice(int(hour[0]), int(hour[-1]) + 1)
+            f = max(0, min(b, stop) - a)
+            for i, values in ((0, env), (2, load("day", k))):
+                ok = np.isfinite(values)
+                sums[i, span] += np.bincount(hour[ok] - first, weights=values[ok],
+                                             minlength=span.stop - first)
+                sums[i + 1, span] += np.bincount(hour[ok] - first, minlength=span.stop - first)
+                _extend(norm, i, values)
+                _extend(frozen, i, values[:f])
+
+        ctx = max(0, stop - CONTEXT_MINUTES)
+        t_stop = int(rows("time", stop, stop + 1)[0]) if stop < n else None
+        tail_time = rows("time", ctx, n)
+
+    with np.errstate(invalid="ignore"):
+        hour_env, hour_day = sums[0] / sums[1], sums[2] / sums[3]
+    state = {
+        'diff_sum': frozen_sum,
+        'diff_count': frozen_count,
+        'env_min': frozen[0], 'env_max': frozen[1],
+        'day_min': frozen[2], 'day_max': frozen[3],
+        'frozen_until': t_stop - t_stop % hour_ns if t_stop is not None else t_last + 1,
+        'tail_time': tail_time,
+        'n_context': stop - ctx,
+        'hour_time': h0 + np.arange(n_hours, dtype=np.int64) * hour_ns,
+        'hour_env': hour_env,
+        'hour_day': hour_day,
+        'last_time': t_last // 10**9,
+        'row_count': n,
+    }
+    return hourly_scores(state, norm), state
+
+
+def run_full(store, chunked=None):
+    """
+    Recompute everything from the amplitude store and (re)initialize the
+    state; returns the hourly row count. chunked=None runs out-of-core for
+    histories longer than OUT_OF_CORE_MINUTES.
+    """
+    if chunked is None:
+        chunked = OUT_OF_CORE_MINUTES is not None and len(store) > OUT_OF_CORE_MINUTES
+    if chunked:
+        print(f"[INFO] Processing {store.root} in blocks of {BLOCK_MINUTES} minutes ...")
+        df_hourly, state = compute_activity_chunked(store)
+    else:
+        print(f"[INFO] Loading {store.root} ...")
+        df = load_amplitudes(store)
+        df_hourly = compute_activity(df)
+        state = full_state(df) if len(df) > 0 else None
+    df_hourly.to_csv(CSV_OUTPUT, index=False)
+    print(f"✅ Hourly-sampled tremor (blue) and activity (red) lines saved to: {CSV_OUTPUT}")
+    print(f"Rows written: {len(df_hourly)}")
+    write_tiers(df_hourly)
+
+    if INCREMENTAL and state is not None:
+        state['norm'] = np.array([np.nan] * 4)
+        state['patch_offset'] = -1
+        save_state(state)
+        print(f"[INFO] Saved incremental state to {STATE_FILE}")
+    # Every replaced minute is in the new output
+    store.clear_replaced()
+    return len(df_hourly)
+
+
+def run_incremental(store, state):
+    """Recompute only the tail affected by minutes appended since the last run; returns the hourly rows written."""
+    new = load_amplitudes(store, start=state['last_time'] + 1)
+    row_count = len(store)
+    if row_count != state['row_count'] + len(new):
+        print("[WARN] Minutes were added inside the existing history; running a full recompute.")
+        return run_full(store)
+    # Re-processed days overwrite minutes in place (same row count)
+    replaced = store.replaced_from()
+    if replaced is not None and replaced * 10**9 < state['frozen_until']:
+        print("[WARN] Minutes before the patched tail were replaced; running a full recompute.")
+        return run_full(store)
+    if len(new) == 0:
+        print("[INFO] No new minutes since last run; output unchanged.")
+        return 0
+    print(f"[INFO] {len(new)} new minutes; recomputing tail.")
+
+    # The look-back is reloaded rather than kept in the state: cleaning
+    # revises the newest minutes of the last run once later ones arrive
+    tail = load_amplitudes(store, start=int(state['tail_time'][0] // 10**9),
+                           end=int(state['last_time']) + 1)
+    if len(tail) != len(state['tail_time']):
+        print("[WARN] Look-back minutes changed; running a full recompute.")
+        return run_full(store)
+    buf = pd.concat([tail, new], ignore_index=True)
+    start = int(state['n_context'])
+    smooth_curves(buf)
+
+    # Global mean of the difference = frozen running sum + recomputed tail
+    diff_tail = buf['difference'].to_numpy()[start:]
+    count = state['diff_count'] + np.count_nonzero(np.isfinite(diff_tail))
+    mean = (state['diff_sum'] + np.nansum(diff_tail)) / count if count else 0.0
+
+    # Windowed envelope: the look-back absorbs the Hilbert edge effect at the start
+    envelope = envelope_curve(buf['difference'] - mean)
+
+    # Hourly table: frozen hours + re-derived hours from the boundary on
+    patch_from = state['frozen_until']
+    keep = state['hour_time'] < patch_from
+    new_hours = hourly_means(buf['time'].iloc[start:], envelope.iloc[start:],
+                             buf['smooth_day'].iloc[start:])
+    hour_time = np.concatenate([state['hour_time'][keep],
+                                new_hours.index.to_numpy(dtype="datetime64[ns]").view("int64")])
+    hourly = pd.DataFrame(
+        {'env': np.concatenate([state['hour_env'][keep], new_hours['env'].to_numpy()]),
+         'day': np.concatenate([state['hour_day'][keep], new_hours['day'].to_numpy()])},
+        index=pd.to_datetime(hour_time, utc=True)
+    )
+
+    env_tail = envelope.to_numpy()[start:]
+    day_tail = buf['smooth_day'].to_numpy()[start:]
+    norm = np.array([
+        min(state['env_min'], _nan_stat(np.nanmin, env_tail, np.inf)),
+        max(state['env_max'], _nan_stat(np.nanmax, env_tail, -np.inf)),
+        min(state['day_min'], _nan_stat(np.nanmin, day_tail, np.inf)),
+        max(state['day_max'], _nan_stat(np.nanmax, day_tail, -np.inf)),
+    ])
+
+    stop = next_boundary(buf['time'], start)
+    new_state = build_state(buf, start, stop, state, envelope, hourly, row_count)
+    df_hourly = hourly_scores(new_state, norm)
+
+    # Patch in place when normalization is unchanged, otherwise rewrite all rows
+    can_patch = (np.array_equal(norm, state['norm']) and state['patch_offset'] >= 0
+                 and os.path.exists(CSV_OUTPUT))
+    if can_patch:
+        offset = write_scores(df_hourly, patch_from, state['patch_offset'], new_state['frozen_until'])
+        written = int(np.sum(time_ns(df_hourly['time']) >= patch_from))
+        print(f"[OK] Patched {written} hourly rows in {CSV_OUTPUT}")
+    else:
+        offset = write_scores(df_hourly, keep_from=new_state['frozen_until'])
+        written = len(df_hourly)
+        print(f"[OK] Rewrote {written} hourly rows in {CSV_OUTPUT} (normalization changed)")
+    write_tiers(df_hourly, since=patch_from if can_patch else None)
+
+    new_state['norm'] = norm
+    new_state['patch_offset'] = offset
+    save_state(new_state)
+    # Replaced minutes after frozen_until were reloaded with the tail
+    store.clear_replaced()
+    return written
+
+
+def verify_incremental(store, tolerance=VERIFY_TOLERANCE):
+    """Compare CSV_OUTPUT with a full in-memory recompute; True if within tolerance."""
+    df = load_amplitudes(store)
+    full = compute_activity(df)
+    current = pd.read_csv(CSV_OUTPUT)
+    current['time'] = pd.to_datetime(current['time'], utc=True)
+    merged = full.merge(current, on='time', how='outer', suffixes=('_full', '_out'))
+
+    # Settled history: after the first day, before the patched tail
+    t = time_ns(merged['time'])
+    settled = t >= t[0] + MINUTES_PER_DAY * 60 * 10**9
+    if os.path.exists(STATE_FILE):
+        settled &= t < load_state()['frozen_until']
+
+    ok = len(full) == len(current)
+    for col in ('tremor_score_blue', 'activity_score_red'):
+        a = merged[f'{col}_full'].to_numpy()
+        b = merged[f'{col}_out'].to_numpy()
+        if not np.array_equal(np.isnan(a), np.isnan(b)):
+            ok = False
+        dev = np.abs(a - b)
+        err = _nan_stat(np.nanmax, dev[settled], 0.0)
+        edge = _nan_stat(np.nanmax, dev[~settled], 0.0)
+        print(f"[VERIFY] {col}: max abs deviation {err:.3g} (tolerance {tolerance}), "
+              f"{edge:.3g} at the series edges")
+        ok = ok and err <= tolerance
+    print("[VERIFY] PASS" if ok else "[VERIFY] FAIL")
+    return ok
+
+
+def main():
+    start = time.time()
+
+    # ---------------- Load and preprocess ----------------
+    store = open_store(STORE_DIR, LEGACY_CSV)
+    if not store.partitions():
+        raise FileNotFoundError(f"❌ Input store not found or empty: {STORE_DIR}")
+
+    clean_store(store)
+
+    if "--verify" in sys.argv[1:]:
+        sys.exit(0 if verify_incremental(store) else 1)
+
+    # The live service updates the same curves and state (under the same lock)
+    with runReport.run("activity"), store.locked():
+        if "--chunked" in sys.argv[1:]:
+            with runReport.span("activity", mode="chunked") as rec:
+                rec["rows"] = run_full(store, chunked=True)
+        elif INCREMENTAL and os.path.exists(STATE_FILE) and os.path.exists(CSV_OUTPUT):
+            with runReport.span("activity", mode="incremental") as rec:
+                rec["rows"] = run_incremental(store, load_state())
+        else:
+            with runReport.span("activity", mode="full") as rec:
+                rec["rows"] = run_full(store)
+    print("Execution time:", round(time.time() - start, 2), "s")
+
 
-# ---------------- Normalize indicators ----------------
-df['D'] = normalize(df['envelope_smooth'])   # Tremor (blue)
-df['E'] = normalize(df['smooth_day'])        # Activity (red)
-
-# ---------------- Resample to hourly sampling ----------------
-df_final = df[['time', 'D', 'E']].copy()
-df_final.rename(columns={'D': 'tremor_score_blue', 'E': 'activity_score_red'}, inplace=True)
-df_final.set_index('time', inplace=True)
-df_hourly = df_final.resample('1H').mean().reset_index()
-
-# ---------------- Save output ----------------
-df_hourly.to_csv(CSV_OUTPUT, index=False)
-print(f"✅ Hourly-sampled tremor (blue) and activity (red) lines saved to: {CSV_OUTPUT}")
-print(f"Rows written: {len(df_hourly)}")
-print("Execution time:", round(time.time() - start, 2), "s")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Per-day spectrograms and hourly PSD summaries as compact arrays, the
+frequency-content product next to the dayplots.
+
+From a day's merged trace, one Welch PSD per minute (SEGMENT_SEC segments,
+Hann window, 50 % overlap) is computed for all 1440 minutes in a few
+vectorized calls and averaged into FREQ_BINS log-spaced bins between
+FREQ_MIN and FREQ_MAX. Minutes that overlap a zero-filled gap are left
+empty. Files in SPEC_DIR:
+
+    <day>.u8.gz      spectrogram, uint8 (1440 minutes x FREQ_BINS), gzip;
+                     0 = no data, 1..255 = DB_RANGE in dB re 1 count²/Hz
+    psd/<day>.f16    hourly PSD, float16 little-endian (24 hours x
+                     len(PSD_PERCENTILES) x FREQ_BINS), the percentiles of
+                     the hour's minute spectra in dB; NaN = no data
+    manifest.json    bin centres, dB range, layout and the list of days
+
+The arrays are small enough to commit next to the dayplots (a day is a few
+tens of kB) and are rendered on demand: by the dashboard in the browser, or
+with render_strip() into a PNG through a colour lookup table, without a
+matplotlib figure.
+
+Days the pipeline had processed before this stage first ran count as done
+without tiles (processingManifest.NO_BACKFILL), so adding the product does
+not re-download the whole history; backfill with
+`python processingManifest.py --force spectrogram --from ... --to ...`.
+
+Usage:
+    python EsaveSpectrograms.py                         # days in shake_data
+    python EsaveSpectrograms.py --render 2025-06-01 [2025-06-07] [--out strip.png]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import warnings
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from scipy.fft import rfftfreq
+from scipy.signal import welch
+
+import runReport
+from BmakeKavachiNoiseProfile import load_day_trace, gap_mask
+from processingManifest import Manifest, DONE, ADOPT, checksum
+
+# ---------------- CONFIG ----------------
+INPUT_DIR = Path("./shake_data")     # directory with daily MiniSEED files
+SPEC_DIR = Path("spectrograms")      # output directory for the tiles
+SPEC_STEP_SEC = 60                   # one spectrogram column per minute
+SEGMENT_SEC = 10.24                  # Welch segment length (0.1 Hz resolution at 100 Hz)
+FREQ_MIN, FREQ_MAX = 1.0, 50.0       # Hz, log-spaced bins in between
+FREQ_BINS = 64
+DB_RANGE = (0.0, 127.0)              # dB mapped to uint8 1..255 (0.5 dB steps)
+PSD_PERCENTILES = (10, 50, 90)       # of the minute spectra in each hour
+BATCH_MINUTES = 240                  # minutes per welch() call (bounds peak memory)
+# ----------------------------------------
+
+
+def tile_path(day):
+    return SPEC_DIR / f"{day}.u8.gz"
+
+
+def psd_path(day):
+    return SPEC_DIR / "psd" / f"{day}.f16"
+
+
+def freq_edges():
+    """Edges of the log-spaced frequency bins (FREQ_BINS + 1 values, Hz)."""
+    return np.geomspace(FREQ_MIN, FREQ_MAX, FREQ_BINS + 1)
+
+
+@lru_cache(maxsize=4)
+def _bins(nperseg, fs):
+    """Centres of the frequency bins and the [i0, i1) Welch bin range of each."""
+    freqs = rfftfreq(nperseg, d=1.0 / fs)
+    edges = freq_edges()
+    i0 = np.searchsorted(freqs, edges[:-1], side="left")
+    i1 = np.searchsorted(freqs, edges[1:], side="left")
+    # Bins narrower than the Welch resolution take the nearest Welch bin
+    i1 = np.maximum(i1, i0 + 1)
+    return np.sqrt(edges[:-1] * edges[1:]), i0, i1
+
+
+def day_spectrogram(tr):
+    """
+    (minutes, FREQ_BINS) PSD in dB of a merged day trace; NaN for minutes
+    that overlap a zero-filled gap (tr.stats.gap_spans) or are missing.
+    """
+    fs = float(tr.stats.sampling_rate)
+    step = int(round(SPEC_STEP_SEC * fs))
+    minutes = 86400 // SPEC_STEP_SEC
+    data = np.asarray(tr.data)
+    n = min(minutes, data.size // step)
+    nperseg = int(round(SEGMENT_SEC * fs))
+    centres, i0, i1 = _bins(nperseg, fs)
+
+    out = np.full((minutes, FREQ_BINS), np.nan)
+    frames = data[:n * step].reshape(n, step)     # a view of the day, no copy
+    for b0 in range(0, n, BATCH_MINUTES):
+        block = frames[b0:b0 + BATCH_MINUTES].astype(np.float64)
+        _, psd = welch(block, fs=fs, nperseg=nperseg, axis=-1)
+        # Mean power per log bin from one cumulative sum over the Welch bins
+        cum = np.concatenate([np.zeros((len(block), 1)), np.cumsum(psd, axis=-1)], axis=-1)
+        power = (cum[:, i1] - cum[:, i0]) / (i1 - i0)
+        with np.errstate(divide="ignore"):
+            out[b0:b0 + len(block)] = 10 * np.log10(power)
+
+    mask = gap_mask(tr)
+    if mask is not None:
+        gappy = mask[:n * step].reshape(n, step).any(axis=1)
+        out[:n][gappy] = np.nan
+    out[~np.isfinite(out)] = np.nan
+    return out
+
+
+def hourly_psd(spec):
+    """(24, len(PSD_PERCENTILES), FREQ_BINS) percentiles of each hour's minute spectra."""
+    hours = spec.reshape(24, -1, spec.shape[1])
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)   # hours without data
+        return np.nanpercentile(hours, PSD_PERCENTILES, axis=1).transpose(1, 0, 2)
+
+
+def quantize(spec):
+    """dB values to uint8: 0 for NaN, 1..255 across DB_RANGE (clipped)."""
+    lo, hi = DB_RANGE
+    q = np.clip(np.rint((spec - lo) / (hi - lo) * 254), 0, 254) + 1
+    return np.where(np.isnan(spec), 0, q).astype(np.uint8)
+
+
+def dequantize(tile):
+    """uint8 tile back to dB (NaN where there was no data)."""
+    lo, hi = DB_RANGE
+    spec = lo + (tile.astype(np.float64) - 1) / 254 * (hi - lo)
+    spec[tile == 0] = np.nan
+    return spec
+
+
+def _write_atomic(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def save_day(day, tr):
+    """Compute and write a day's tiles; returns (minutes with data, checksum of the tile)."""
+    spec = day_spectrogram(tr)
+    tile = quantize(spec)
+    _write_atomic(tile_path(day), gzip.compress(tile.tobytes(), compresslevel=9, mtime=0))
+    _write_atomic(psd_path(day), hourly_psd(spec).astype("<f2").tobytes())
+    return int(np.count_nonzero(tile.any(axis=1))), checksum(tile)
+
+
+def load_tile(day):
+    """A day's uint8 spectrogram tile, or None if there is none."""
+    path = tile_path(day)
+    if not path.exists():
+        return None
+    return np.frombuffer(gzip.decompress(path.read_bytes()), dtype=np.uint8).reshape(-1, FREQ_BINS)
+
+
+def write_manifest():
+    """Layout and day list for the dashboard."""
+    edges = freq_edges()
+    centres = np.sqrt(edges[:-1] * edges[1:])
+    days = sorted(p.name[:-len(".u8.gz")] for p in SPEC_DIR.glob("*.u8.gz"))
+    manifest = {
+        "minutes": 86400 // SPEC_STEP_SEC,
+        "freqs": [round(float(f), 3) for f in centres],
+        "db_range": list(DB_RANGE),
+        "psd_percentiles": list(PSD_PERCENTILES),
+        "days": days,
+    }
+    _write_atomic(SPEC_DIR / "manifest.json", json.dumps(manifest).encode())
+
+
+def render_strip(days, out_file, cmap="viridis"):
+    """Days side by side as a PNG (low frequencies at the bottom), via a colour lookup table."""
+    import matplotlib
+    import matplotlib.image as mpimg
+
+    lut = (matplotlib.colormaps[cmap](np.linspace(0, 1, 255)) * 255).astype(np.uint8)
+    lut = np.vstack([np.zeros((1, 4), np.uint8), lut])    # no data: transparent
+    columns = []
+    for day in days:
+        tile = load_tile(day)
+        columns.append(tile if tile is not None else np.zeros((86400 // SPEC_STEP_SEC, FREQ_BINS), np.uint8))
+    image = lut[np.concatenate(columns).T[::-1]]
+    mpimg.imsave(str(out_file), image)
+    return out_file
+
+
+def process_file(file_path, manifest=None):
+    """Tiles for one MiniSEED file of shake_data."""
+    day = file_path.name.split(".")[-2]
+    try:
+        tr = load_day_trace(file_path)
+        if tr is None:
+            msg, status, rows, crc = f"[WARN] No data in {file_path.name}", "empty", None, None
+        else:
+            rows, crc = save_day(day, tr)
+            msg, status = f"[OK] {file_path.name} → {tile_path(day).name}", DONE
+    except Exception as e:
+        msg, status, rows, crc = f"[ERROR] {file_path.name}: {e}", "failed", None, None
+    if manifest is not None:
+        manifest.record("spectrogram", day, status, rows=rows, checksum=crc)
+    return msg
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--render", nargs="+", metavar="DAY", help="render a strip of these days (first..last)")
+    parser.add_argument("--out", default="spectrogram.png")
+    args = parser.parse_args()
+
+    if args.render:
+        first, last = np.datetime64(args.render[0]), np.datetime64(args.render[-1])
+        days = [str(d) for d in np.arange(first, last + 1)]
+        print(f"[OK] {render_strip(days, args.out)} ({len(days)} day(s))")
+        return
+
+    files = sorted(INPUT_DIR.glob("*.mseed"))
+    if not files:
+        print("No MiniSEED files found.")
+        return
+    with runReport.run("spectrogram"), Manifest() as manifest:
+        for file_path in files:
+            day = file_path.name.split(".")[-2]
+            if manifest.is_done("spectrogram", day, adopt=ADOPT["spectrogram"]):
+                print(f"[SKIP] {file_path.name} — spectrogram already saved.")
+                continue
+            with runReport.span("spectrogram", day):
+                print(process_file(file_path, manifest))
+        write_manifest()
+
+
+if __name__ == "__main__":
+    main()
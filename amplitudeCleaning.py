@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Despiking and gap filling of the minute amplitudes, stored next to the raw
+values in the amplitude store (replacing the fixed AMP_THRESHOLD cut).
+
+- Spikes: a Hampel filter on log10 amplitudes. A minute is an outlier if it
+  is more than DESPIKE_SIGMAS robust standard deviations (1.4826 x MAD)
+  from the rolling median of DESPIKE_WINDOW minutes around it. Median and
+  MAD run over the valid minutes only, compressed into one array, so each
+  is a single scipy.ndimage.median_filter pass (a sorted sliding window in
+  C) and a year of minutes is cleaned in a fraction of a second.
+- Gaps: NaN minutes and zero / negative amplitudes (zero-filled data).
+- Spikes and gaps are replaced by log-linear interpolation in time between
+  the neighbouring good minutes, if those are at most MAX_INTERP_MINUTES
+  apart; longer stretches stay NaN rather than being invented.
+
+Columns written:
+    amplitude_clean   cleaned amplitude (raw units, like "amplitude")
+    quality           QUALITY_OK, QUALITY_SPIKE, QUALITY_GAP (both filled)
+                      or QUALITY_MISSING (left NaN); NaN = not cleaned yet
+
+clean_store() cleans only what changed: appended or replaced minutes have
+NaN quality (see BmakeKavachiNoiseProfile.append_rows), and it re-cleans
+from the first of them with CLEAN_CONTEXT_MINUTES of look-back. Minutes
+within half a window of the newest one are provisional until later minutes
+arrive. The live service passes since= (the first minute of its poll), so
+only the minutes from there on are searched and POLL_CONTEXT_MINUTES of
+look-back, enough for the median window and an interpolated gap, is
+loaded: the work per poll does not grow with the history.
+
+Usage:
+    python amplitudeCleaning.py           # clean pending minutes
+    python amplitudeCleaning.py --all     # clean the whole store again
+"""
+
+import sys
+import time
+
+import numpy as np
+from scipy.ndimage import median_filter
+
+from amplitudeStore import AmplitudeStore, STORE_DIR
+
+# ---------------- CONFIG ----------------
+DESPIKE_WINDOW = 61                  # valid minutes in the rolling median / MAD window
+DESPIKE_SIGMAS = 6.0                 # outlier threshold in robust standard deviations
+MIN_MAD = 0.01                       # log10 units; floor for flat stretches (about 2 %)
+MAX_INTERP_MINUTES = 60              # longest run of bad minutes that is interpolated
+CLEAN_CONTEXT_MINUTES = 24 * 60      # look-back loaded before the first pending minute
+POLL_CONTEXT_MINUTES = 2 * (DESPIKE_WINDOW + MAX_INTERP_MINUTES)   # look-back with clean_store(since=...)
+RAW_COLUMN = "amplitude"
+CLEAN_COLUMN = "amplitude_clean"
+QUALITY_COLUMN = "quality"
+# ----------------------------------------
+
+QUALITY_OK, QUALITY_SPIKE, QUALITY_GAP, QUALITY_MISSING = 0, 1, 2, 3
+MAD_SCALE = 1.4826                   # MAD -> standard deviation for normal data
+
+
+def hampel(values, window=DESPIKE_WINDOW, sigmas=DESPIKE_SIGMAS):
+    """Outlier flags of a NaN-free array against its rolling median and MAD."""
+    if len(values) == 0:
+        return np.zeros(0, dtype=bool)
+    med = median_filter(values, size=window, mode="nearest")
+    dev = np.abs(values - med)
+    mad = np.maximum(median_filter(dev, size=window, mode="nearest"), MIN_MAD)
+    return dev > sigmas * MAD_SCALE * mad
+
+
+def clean(times, amplitude):
+    """
+    Despike and gap-fill minute amplitudes (epoch seconds, raw values).
+    Returns (cleaned amplitudes, quality codes), both float arrays.
+    """
+    amp = np.asarray(amplitude, dtype=np.float64)
+    times = np.asarray(times, dtype=np.int64)
+    quality = np.full(len(amp), float(QUALITY_OK))
+
+    valid = np.isfinite(amp) & (amp > 0)
+    log_amp = np.log10(amp[valid])
+    spike = np.zeros(len(amp), dtype=bool)
+    spike[valid] = hampel(log_amp)
+    good = valid & ~spike
+    quality[spike] = QUALITY_SPIKE
+    quality[~valid] = QUALITY_GAP
+
+    cleaned = np.where(good, amp, np.nan)
+    bad = np.flatnonzero(~good)
+    if len(bad) and np.any(good):
+        t_good = times[good]
+        log_good = np.log10(amp[good])
+        i = np.searchsorted(t_good, times[bad])
+        inside = (i > 0) & (i < len(t_good))
+        i_in = i[inside]
+        # Neighbouring good minutes at most MAX_INTERP_MINUTES bad minutes apart
+        span = t_good[i_in] - t_good[i_in - 1]
+        fill = np.zeros(len(bad), dtype=bool)
+        fill[inside] = span <= (MAX_INTERP_MINUTES + 1) * 60
+        cleaned[bad[fill]] = 10 ** np.interp(times[bad[fill]], t_good, log_good)
+        quality[bad[~fill]] = QUALITY_MISSING
+    else:
+        quality[bad] = QUALITY_MISSING
+    return cleaned, quality
+
+
+def clean_store(store, full=False, since=None):
+    """
+    Clean the minutes with NaN quality (all of them with full=True) and the
+    look-back they affect; returns the number of minutes written. With
+    since (epoch seconds), only minutes from then on are looked at, with
+    POLL_CONTEXT_MINUTES of look-back.
+    """
+    with store.locked():
+        times, cols = store.load(start=since, columns=(QUALITY_COLUMN,))
+        pending = np.flatnonzero(np.isnan(cols[QUALITY_COLUMN])) if not full else np.arange(len(times))
+        if len(pending) == 0:
+            return 0
+
+        first = int(times[pending[0]])
+        context = (CLEAN_CONTEXT_MINUTES if since is None else POLL_CONTEXT_MINUTES) * 60
+        times, cols = store.load(start=first - context, columns=(RAW_COLUMN,))
+        cleaned, quality = clean(times, cols[RAW_COLUMN])
+
+        # The first half of the look-back only served as context for the rest
+        keep = times >= first - context // 2
+        store.append(times[keep], replace=True,
+                     **{CLEAN_COLUMN: cleaned[keep], QUALITY_COLUMN: quality[keep]})
+    return int(np.count_nonzero(keep))
+
+
+def summary(quality):
+    """Counts of each quality code."""
+    q = quality[np.isfinite(quality)].astype(int)
+    names = ("ok", "spike", "gap", "missing")
+    return {name: int(np.count_nonzero(q == code)) for code, name in enumerate(names)}
+
+
+def main():
+    store = AmplitudeStore(STORE_DIR)
+    if not store.partitions():
+        print(f"[INFO] No amplitude store at {STORE_DIR}.")
+        return
+    start = time.perf_counter()
+    written = clean_store(store, full="--all" in sys.argv[1:])
+    print(f"[OK] Cleaned {written} minutes in {time.perf_counter() - start:.2f} s")
+    _, cols = store.load(columns=(QUALITY_COLUMN,))
+    print(f"[INFO] Quality: {summary(cols[QUALITY_COLUMN])}")
+
+
+if __name__ == "__main__":
+    main()
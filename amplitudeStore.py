@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Columnar on-disk store for the per-minute amplitude series, replacing
+mean_amplitudes.csv.
+
+Layout (one directory per UTC month, one .npy file per column):
+    amplitude_store/
+        2025-06/time.npy        int64 epoch seconds, sorted and unique
+        2025-06/amplitude.npy   float32
+
+- Appends dedupe by timestamp with a sorted-index lookup (np.searchsorted),
+  so no string sets of historical timestamps are built.
+- Loads memory-map only the monthly partitions overlapping the requested
+  range and copy just the matching rows; load_rows() reads by row position,
+  for processing the history in blocks.
+- import_csv() migrates an existing mean_amplitudes.csv once.
+- Overwriting stored values (append(replace=True)) that changes any of
+  them lowers a watermark, the earliest time changed (replaced_from()), so
+  CsaveActivityCurves notices edits to history it has already frozen.
+- Writers in different processes (the live service and the daily run)
+  take turns through an exclusive lock on LOCK_FILE in the store root;
+  see AmplitudeStore.locked().
+
+Run directly to import the legacy CSV:
+    python amplitudeStore.py
+"""
+
+import os
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:                       # Windows: no cross-process locking
+    fcntl = None
+
+# -----------------------
+# Config
+# -----------------------
+STORE_DIR = Path("./amplitude_store")     # root directory of the partitions
+LEGACY_CSV = Path("mean_amplitudes.csv")  # CSV written by earlier versions (time, amplitude)
+TIME_COLUMN = "time"
+VALUE_DTYPE = np.float32                  # dtype of every value column
+IMPORT_CHUNK_ROWS = 500_000               # rows parsed per chunk when importing the CSV
+LOCK_FILE = ".lock"                       # in the store root, see AmplitudeStore.locked()
+REPLACED_FILE = "replaced_from.txt"       # in the store root, see AmplitudeStore.replaced_from()
+# -----------------------
+
+_held = {}    # lock file -> [open file, depth] of the store locks this process holds
+
+
+def to_epoch_seconds(values):
+    """Convert ISO strings / datetimes / Timestamps to int64 epoch seconds."""
+    idx = pd.DatetimeIndex(pd.to_datetime(values, utc=True))
+    return np.asarray((idx - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1), dtype=np.int64)
+
+
+def partition_key(epoch_seconds):
+    """'YYYY-MM' partition name(s) for epoch seconds."""
+    months = np.asarray(epoch_seconds, dtype="datetime64[s]").astype("datetime64[M]")
+    return np.datetime_as_string(months, unit="M")
+
+
+class AmplitudeStore:
+    """Month-partitioned columnar time series (int64 epoch seconds + float32 columns)."""
+
+    def __init__(self, root=STORE_DIR):
+        self.root = Path(root)
+
+    # ---------------- Layout helpers ----------------
+    def partitions(self):
+        """Sorted partition directories that contain a time column."""
+        if not self.root.exists():
+            return []
+        return sorted(p for p in self.root.iterdir()
+                      if p.is_dir() and (p / f"{TIME_COLUMN}.npy").exists())
+
+    def columns(self):
+        """Names of all value columns present in any partition."""
+        names = set()
+        for part in self.partitions():
+            names.update(f.stem for f in part.glob("*.npy") if f.stem != TIME_COLUMN)
+        return sorted(names)
+
+    @staticmethod
+    def _read(part, name, mmap=True):
+        path = part / f"{name}.npy"
+        if not path.exists():
+            return None
+        return np.load(path, mmap_mode="r" if mmap else None)
+
+    @staticmethod
+    def _write(part, name, arr):
+        # Write to a temp file and rename, so readers never see a partial column
+        tmp = part / f".{name}.npy.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, arr)
+        os.replace(tmp, part / f"{name}.npy")
+
+    def __len__(self):
+        return sum(len(self._read(p, TIME_COLUMN)) for p in self.partitions())
+
+    def first_time(self):
+        parts = self.partitions()
+        return int(self._read(parts[0], TIME_COLUMN)[0]) if parts else None
+
+    def last_time(self):
+        parts = self.partitions()
+        return int(self._read(parts[-1], TIME_COLUMN)[-1]) if parts else None
+
+    # ---------------- Replaced history ----------------
+    def replaced_from(self):
+        """Earliest time (epoch seconds) whose stored values changed since clear_replaced(), or None."""
+        path = self.root / REPLACED_FILE
+        return int(path.read_text()) if path.exists() else None
+
+    def clear_replaced(self):
+        (self.root / REPLACED_FILE).unlink(missing_ok=True)
+
+    def _note_replaced(self, t):
+        current = self.replaced_from()
+        if current is None or t < current:
+            tmp = self.root / f".{REPLACED_FILE}.tmp"
+            tmp.write_text(str(int(t)))
+            os.replace(tmp, self.root / REPLACED_FILE)
+
+    # ---------------- Locking ----------------
+    @contextmanager
+    def locked(self):
+        """
+        Hold the store's exclusive lock for the block, waiting for other
+        processes that hold it. Re-entrant within a process, so a
+        read-modify-write (load, then append()) can wrap its own appends.
+        """
+        path = str((self.root / LOCK_FILE).resolve())
+        held = _held.get(path)
+        if held is None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            f = open(path, "a")
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            held = _held[path] = [f, 0]
+        held[1] += 1
+        try:
+            yield
+        finally:
+            held[1] -= 1
+            if held[1] == 0:
+                del _held[path]
+                held[0].close()           # releases the flock
+
+    # ---------------- Append ----------------
+    def append(self, times, replace=False, **columns):
+        """
+        Insert rows, skipping timestamps already stored (and duplicates within
+        the input, first occurrence wins). With replace=True the given columns
+        of stored timestamps are overwritten instead, for days that are
+        processed again. Returns the number of rows added.
+        """
+        times = np.asarray(times, dtype=np.int64)
+        if times.size == 0:
+            return 0
+        columns = {k: np.asarray(v, dtype=VALUE_DTYPE) for k, v in columns.items()}
+
+        order = np.argsort(times, kind="stable")
+        times = times[order]
+        columns = {k: v[order] for k, v in columns.items()}
+        first = np.r_[True, times[1:] != times[:-1]]
+        times = times[first]
+        columns = {k: v[first] for k, v in columns.items()}
+
+        added = 0
+        keys = partition_key(times)
+        bounds = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1], True])
+        with self.locked():
+            for i0, i1 in zip(bounds[:-1], bounds[1:]):
+                part = self.root / str(keys[i0])
+                added += self._merge_partition(part, times[i0:i1],
+                                               {k: v[i0:i1] for k, v in columns.items()}, replace)
+        return added
+
+    def _merge_partition(self, part, times, columns, replace=False):
+        old_t = self._read(part, TIME_COLUMN, mmap=False)
+        if old_t is None:
+            part.mkdir(parents=True, exist_ok=True)
+            old_t = np.empty(0, dtype=np.int64)
+
+        # Dedupe against the stored index by binary search
+        pos = np.searchsorted(old_t, times)
+        dup = (pos < len(old_t)) & (old_t[np.minimum(pos, len(old_t) - 1)] == times) \
+            if len(old_t) else np.zeros(len(times), dtype=bool)
+        if replace and np.any(dup):
+            changed = np.zeros(np.count_nonzero(dup), dtype=bool)
+            for name, values in columns.items():
+                old = self._read(part, name, mmap=False)
+                if old is None:
+                    old = np.full(len(old_t), np.nan, dtype=VALUE_DTYPE)
+                before, after = old[pos[dup]], values[dup]
+                changed |= (before != after) & ~(np.isnan(before) & np.isnan(after))
+                old[pos[dup]] = after
+                self._write(part, name, old)
+            if changed.any():
+                self._note_replaced(times[dup][changed].min())
+        keep = ~dup
+        if not np.any(keep):
+            return 0
+        times = times[keep]
+
+        merged_t = np.concatenate([old_t, times])
+        order = np.argsort(merged_t, kind="stable")
+        names = set(columns) | {f.stem for f in part.glob("*.npy") if f.stem != TIME_COLUMN}
+        for name in names:
+            old = self._read(part, name, mmap=False)
+            if old is None:
+                old = np.full(len(old_t), np.nan, dtype=VALUE_DTYPE)
+            new = columns[name][keep] if name in columns else np.full(len(times), np.nan, dtype=VALUE_DTYPE)
+            self._write(part, name, np.concatenate([old, new])[order])
+        # Time column last: a partition is only extended once its values are in place
+        self._write(part, TIME_COLUMN, merged_t[order])
+        return int(len(times))
+
+    # ---------------- Load ----------------
+    def load(self, start=None, end=None, columns=("amplitude",)):
+        """
+        Rows with start <= time < end (epoch seconds, either bound optional).
+        Returns (times, {column: values}); columns missing in a partition are NaN.
+        """
+        lo_key = str(partition_key(start)) if start is not None else None
+        hi_key = str(partition_key(end)) if end is not None else None
+
+        ranges = []
+        for part in self.partitions():
+            if (lo_key and part.name < lo_key) or (hi_key and part.name > hi_key):
+                continue
+            t = self._read(part, TIME_COLUMN)
+            i0 = int(np.searchsorted(t, start, side="left")) if start is not None else 0
+            i1 = int(np.searchsorted(t, end, side="left")) if end is not None else len(t)
+            ranges.append((part, t, i0, i1))
+        return self._gather(ranges, columns)
+
+    def load_rows(self, start, stop, columns=("amplitude",)):
+        """
+        Rows start <= i < stop by position in the whole store (time order),
+        for reading it in blocks. Returns (times, {column: values}) like load().
+        """
+        ranges = []
+        offset = 0
+        for part in self.partitions():
+            if offset >= stop:
+                break
+            t = self._read(part, TIME_COLUMN)
+            ranges.append((part, t, max(start - offset, 0), min(stop - offset, len(t))))
+            offset += len(t)
+        return self._gather(ranges, columns)
+
+    def _gather(self, ranges, columns):
+        """Copy rows [i0, i1) of each (partition, time column, i0, i1) into one array per column."""
+        t_parts = []
+        c_parts = {name: [] for name in columns}
+        for part, t, i0, i1 in ranges:
+            if i1 <= i0:
+                continue
+            t_parts.append(np.array(t[i0:i1]))
+            for name in columns:
+                col = self._read(part, name)
+                c_parts[name].append(np.array(col[i0:i1]) if col is not None
+                                     else np.full(i1 - i0, np.nan, dtype=VALUE_DTYPE))
+
+        if not t_parts:
+            return (np.empty(0, dtype=np.int64),
+                    {name: np.empty(0, dtype=VALUE_DTYPE) for name in columns})
+        return (np.concatenate(t_parts),
+                {name: np.concatenate(c_parts[name]) for name in columns})
+
+
+def import_csv(csv_path=LEGACY_CSV, store=None):
+    """Import a (time, amplitude) CSV into the store; returns rows added."""
+    if store is None:                 # an empty store is falsy (__len__)
+        store = AmplitudeStore()
+    added = 0
+    for chunk in pd.read_csv(csv_path, chunksize=IMPORT_CHUNK_ROWS):
+        chunk = chunk.dropna(subset=["time"])
+        added += store.append(to_epoch_seconds(chunk["time"].astype(str)),
+                              amplitude=chunk["amplitude"].to_numpy(dtype=float))
+    return added
+
+
+def open_store(root=STORE_DIR, legacy_csv=LEGACY_CSV):
+    """Open the store, importing the legacy CSV the first time if it exists."""
+    store = AmplitudeStore(root)
+    if not store.partitions() and Path(legacy_csv).exists():
+        added = import_csv(legacy_csv, store)
+        print(f"[INFO] Imported {added} rows from {legacy_csv} into {store.root}")
+    return store
+
+
+def main():
+    store = AmplitudeStore()
+    if not LEGACY_CSV.exists():
+        print(f"[INFO] No {LEGACY_CSV} to import.")
+        return
+    added = import_csv(LEGACY_CSV, store)
+    print(f"[OK] Imported {added} new rows into {store.root} ({len(store)} total)")
+
+
+if __name__ == "__main__":
+    main()
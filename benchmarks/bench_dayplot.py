@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Compare the obspy and envelope dayplot renderers of DsaveDayplots on a
+synthetic day: wall time, peak traced memory and pixel difference.
+
+    python benchmarks/bench_dayplot.py [--repeat N]
+"""
+
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.image as mpimg
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import DsaveDayplots  # noqa: E402
+from dayplotStore import DayplotStore  # noqa: E402
+from synthetic import write_day_file  # noqa: E402
+
+
+def run(renderer, mseed, out_dir, repeat):
+    DsaveDayplots.OUTPUT_DIR = out_dir
+    times, peaks = [], []
+    for _ in range(repeat):
+        # An empty store each time: put() skips images it already holds
+        shutil.rmtree(out_dir, ignore_errors=True)
+        out_dir.mkdir(parents=True)
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        msg = DsaveDayplots.process_file(mseed, renderer=renderer)
+        times.append(time.perf_counter() - t0)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        if not msg.startswith("[OK]"):
+            raise RuntimeError(msg)
+    # process_file() reports "[OK] <file> → <name>"
+    return min(times), max(peaks), DayplotStore(out_dir).full_path(msg.rsplit(" ", 1)[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        mseed = write_day_file(tmp)
+        # Warm up imports (scipy.signal, matplotlib) outside the timings
+        run("envelope", mseed, tmp / "warmup", 1)
+
+        results = {}
+        for renderer in ("obspy", "envelope"):
+            results[renderer] = run(renderer, mseed, tmp / renderer, args.repeat)
+            t, peak, _ = results[renderer]
+            print(f"{renderer:>9}: {t:6.2f} s  peak {peak / 2**20:7.1f} MiB")
+
+        a = mpimg.imread(results["obspy"][2])
+        b = mpimg.imread(results["envelope"][2])
+        if a.shape != b.shape:
+            print(f"image shapes differ: {a.shape} vs {b.shape}")
+            return
+        diff = np.abs(a[..., :3] - b[..., :3]).max(axis=2)
+        print(f"speedup {results['obspy'][0] / results['envelope'][0]:.1f}x, "
+              f"memory {results['obspy'][1] / results['envelope'][1]:.1f}x lower; "
+              f"pixels differing > 0.25: {np.mean(diff > 0.25):.2%}, "
+              f"mean abs diff {diff.mean():.4f}")
+
+
+if __name__ == "__main__":
+    main()
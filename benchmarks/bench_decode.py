@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Compare obspy's read() + merge() + trim(pad=True) + zero-filling with
+mseedDayBuffer.read_day() on synthetic days: wall time, peak traced memory
+and whether samples and gap spans are identical.
+
+Files: one trace in 4096-byte records (obspy's default), the same day with
+gaps and overlapping records, and that day in 512-byte records as the
+Raspberry Shake servers deliver it.
+
+    python benchmarks/bench_decode.py [--repeat N]
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+from obspy import read, UTCDateTime
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from BmakeKavachiNoiseProfile import fill_gaps  # noqa: E402
+from mseedDayBuffer import read_day  # noqa: E402
+from synthetic import make_day_stream, write_day_file, CHANNEL  # noqa: E402
+
+
+def obspy_day(path):
+    """The previous load_day_trace(): read, merge, pad to the UTC day, zero-fill."""
+    st = read(str(path))
+    st.merge(method=1)
+    tr = st.select(channel=CHANNEL)[0]
+    day_start = UTCDateTime(tr.stats.starttime.date)
+    tr.trim(day_start, day_start + 86400, pad=True)
+    return fill_gaps(tr)
+
+
+def measure(load, path, repeat):
+    """Best wall time of `repeat` runs (without tracemalloc) and the peak traced memory of one."""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        load(path)
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    tr = load(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak, tr
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        files = {
+            "plain, 4096 B": write_day_file(tmp, day="2025-06-01"),
+            "gaps, 4096 B": write_day_file(tmp, day="2025-06-02", defects=True),
+        }
+        path = tmp / "AM.RF90E.00.EHZ.2025-06-03.mseed"
+        make_day_stream("2025-06-03").write(str(path), format="MSEED", reclen=512)
+        files["gaps, 512 B"] = path
+
+        read_day(path, CHANNEL)          # warm up imports outside the timings
+        for name, path in files.items():
+            t_old, m_old, a = measure(obspy_day, path, args.repeat)
+            t_new, m_new, b = measure(lambda p: read_day(p, CHANNEL), path, args.repeat)
+            same = (np.array_equal(a.data, b.data) and a.stats.gap_spans == b.stats.gap_spans
+                    and a.stats.starttime == b.stats.starttime)
+            print(f"{name:>14}: obspy {t_old:5.3f} s {m_old / 2**20:6.1f} MiB | "
+                  f"day buffer {t_new:5.3f} s {m_new / 2**20:6.1f} MiB | "
+                  f"{t_old / t_new:.1f}x faster, {m_old / m_new:.1f}x less memory, "
+                  f"{'identical' if same else 'DIFFERENT'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Time the streaming tremor detector per minute fed, on synthetic minute
+amplitudes, and compare with a full CsaveActivityCurves recompute.
+
+    python benchmarks/bench_detector.py [--days 365]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import CsaveActivityCurves  # noqa: E402
+import tremorDetector  # noqa: E402
+from synthetic import make_minute_amplitudes  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args()
+
+    times, amps = make_minute_amplitudes(args.days)
+    amps = amps.astype(float) / CsaveActivityCurves.AMPLITUDE_SCALE
+
+    detector = tremorDetector.TremorDetector()
+    t0 = time.perf_counter()
+    tremor, activity, events = detector.process(times, amps)
+    streaming = time.perf_counter() - t0
+
+    # One minute at a time, as a live feed calls it
+    t_live, a_live = times[-1] + 60 * np.arange(1, 1441), amps[:1440]
+    t0 = time.perf_counter()
+    for t, a in zip(t_live.tolist(), a_live.tolist()):
+        detector.update(t, a)
+    live = time.perf_counter() - t0
+
+    df = pd.DataFrame({"time": pd.to_datetime(times, unit="s", utc=True), "amplitude": amps})
+    t0 = time.perf_counter()
+    CsaveActivityCurves.compute_activity(df)
+    batch = time.perf_counter() - t0
+
+    n = len(times)
+    print(f"{args.days} days, {n} minutes, {len(events)} events")
+    print(f"  streaming replay   {streaming:8.2f} s   {streaming / n * 1e6:6.1f} µs per minute")
+    print(f"  live update()      {live:8.3f} s   {live / 1440 * 1e6:6.1f} µs per minute")
+    print(f"  batch recompute    {batch:8.2f} s   (every run, for the whole history)")
+
+
+if __name__ == "__main__":
+    main()
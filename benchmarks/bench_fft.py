@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Per-window cost of the mean band amplitude (BmakeKavachiNoiseProfile) on
+the minute windows of a synthetic day, before and after SpectralKernel:
+
+    rebuilt     taper, frequency grid and band mask built for every window,
+                unpadded rfft (calculate_mean_amplitude before the kernel)
+    kernel      calculate_mean_amplitude() with the cached kernel, unpadded
+    batched     calculate_mean_amplitudes_batched(), unpadded
+    padded      batched, zero-padded to next_fast_len, 1 FFT thread
+    threads     padded with FFT_WORKERS = -1 (all CPUs)
+
+and how far the padded amplitudes are from the unpadded ones.
+
+    python benchmarks/bench_fft.py [--windows N] [--repeat N]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from obspy import Trace
+from obspy.signal.invsim import cosine_taper
+from scipy.fft import rfft, rfftfreq
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import BmakeKavachiNoiseProfile as amplitude  # noqa: E402
+from synthetic import make_day_trace  # noqa: E402
+
+FREQ_RANGE = amplitude.FREQ_RANGE
+
+
+def rebuilt(windows, fs):
+    """The per-window function as it was: everything rebuilt, odd-length rfft."""
+    out = []
+    for w in windows:
+        x = np.nan_to_num(w * cosine_taper(len(w), 0.10))
+        X = rfft(x)
+        freqs = rfftfreq(len(w), d=1.0 / fs)
+        sel = (freqs >= FREQ_RANGE[0]) & (freqs <= min(FREQ_RANGE[1], fs / 2.0))
+        out.append(np.mean(np.abs(X[sel])))
+    return np.array(out)
+
+
+def per_window(windows, fs):
+    tr = Trace(header={"sampling_rate": fs})
+    out = []
+    for w in windows:
+        tr.data = w
+        out.append(amplitude.calculate_mean_amplitude(tr, FREQ_RANGE))
+    return np.array(out)
+
+
+def batched(windows, fs):
+    return amplitude.calculate_mean_amplitudes_batched(windows, fs, FREQ_RANGE)
+
+
+def timed(func, windows, fs, repeat, pad, workers):
+    amplitude.FFT_PAD, amplitude.FFT_WORKERS = pad, workers
+    func(windows[:4], fs)                      # build the kernel outside the timing
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        values = func(windows, fs)
+        times.append(time.perf_counter() - t0)
+    return min(times) / len(windows), values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--windows", type=int, default=1440)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    tr = make_day_trace()
+    fs = tr.stats.sampling_rate
+    n = int(amplitude.CHUNK_DURATION_SEC * fs) + 1
+    step = int(amplitude.CHUNK_DURATION_SEC * fs)
+    windows = np.lib.stride_tricks.sliding_window_view(tr.data, n)[::step][:args.windows].astype(np.float64)
+    print(f"{len(windows)} windows of {n} samples, FFT length {amplitude.spectral_kernel(n, fs, FREQ_RANGE, True).nfft} "
+          f"when padded\n")
+
+    cases = [
+        ("rebuilt", rebuilt, False, 1),
+        ("kernel", per_window, False, 1),
+        ("batched", batched, False, 1),
+        ("padded", batched, True, 1),
+        ("threads", batched, True, -1),
+    ]
+    results = {}
+    for name, func, pad, workers in cases:
+        results[name] = timed(func, windows, fs, args.repeat, pad, workers)
+        cost = results[name][0]
+        print(f"{name:>8}: {cost * 1e6:7.1f} µs/window  ({results['rebuilt'][0] / cost:4.1f}x)")
+
+    exact = np.array_equal(results["kernel"][1], results["batched"][1])
+    rel = results["padded"][1] / results["batched"][1] - 1
+    print(f"\nper-window == batched: {exact}; padded vs unpadded: mean {rel.mean():+.3%}, "
+          f"std {rel.std():.3%}, max |{np.abs(rel).max():.3%}|")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Time every pipeline stage on synthetic data for 1, 30 and 365 days and write
+the results as JSON, to compare runs across commits.
+
+    python benchmarks/bench_pipeline.py [--days 1 30 365] [--stages fetch amplitude ...]
+                                        [--profile] [--output FILE] [--compare OLD.json]
+
+Stages:
+    fetch             AfetchData.fetch_with_retries against a MockClient, plus
+                      assemble_day() (day buffer, gap mask) for every day
+    amplitude         load_day_trace() + amplitude_rows(), the path fusedPipeline runs
+    amplitude_legacy  process_miniseed_file_in_chunks()
+    activity          amplitudeCleaning.clean_store() + CsaveActivityCurves.run_full()
+                      on a store of N days of minutes
+    activity_chunked  CsaveActivityCurves.run_full(chunked=True) on a cleaned store of
+                      N days, built a year at a time so the setup stays small too
+    dayplot           DsaveDayplots.process_file()
+
+The MiniSEED days have gaps, spikes and overlapping records (see
+synthetic.make_day_stream). Only POOL_DAYS distinct days are generated and
+the N-day cases cycle through them, which keeps the setup and disk use
+small; the work per day is the same as for N distinct days.
+
+Every (stage, days) case runs in a fresh process, so its peak RSS is its own.
+--profile also writes a cProfile dump per case next to the JSON file. The
+default output directory, benchmarks/results/, is git-ignored, so the daily
+workflow's `git add -A` never commits local results.
+"""
+
+import argparse
+import cProfile
+import io
+import json
+import os
+import platform
+import pstats
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from datetime import date
+from multiprocessing import get_context
+from pathlib import Path
+
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+from obspy import Stream
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import AfetchData  # noqa: E402
+import BmakeKavachiNoiseProfile  # noqa: E402
+import CsaveActivityCurves  # noqa: E402
+import DsaveDayplots  # noqa: E402
+from amplitudeStore import AmplitudeStore  # noqa: E402
+from amplitudeCleaning import clean_store  # noqa: E402
+from synthetic import write_day_file, make_minute_amplitudes, MockClient  # noqa: E402
+
+POOL_DAYS = 3                        # distinct synthetic MiniSEED days
+DEFAULT_DAYS = (1, 30, 365)
+STAGES = ("fetch", "amplitude", "amplitude_legacy", "activity", "activity_chunked", "dayplot")
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+def pool_files(data_dir):
+    """The POOL_DAYS synthetic day files, generated once per benchmark run."""
+    files = []
+    for k in range(POOL_DAYS):
+        day = date(2025, 6, 1 + k).isoformat()
+        path = data_dir / synthetic_name(day)
+        files.append(path if path.exists() else write_day_file(data_dir, day, seed=k, defects=True))
+    return files
+
+
+def synthetic_name(day):
+    return AfetchData.FILENAME_PATTERN.format(
+        network=AfetchData.NETWORK, station=AfetchData.STATION, location=AfetchData.LOCATION,
+        channel=AfetchData.CHANNEL, date=day)
+
+
+# ---------------- Stages: setup(n_days, files) -> work() -> items ----------------
+def setup_fetch(n_days, files, fail_every=0):
+    client = MockClient(files, lambda d: AfetchData.chunk_bounds_for_day(d, AfetchData.CHUNK_HOURS),
+                        fail_every=fail_every)
+    AfetchData.JITTER_MAX = 0
+    days = [date.fromisoformat(f.name.split(".")[-2]) for f in files]
+
+    def work():
+        samples = 0
+        for i in range(n_days):
+            day = days[i % len(days)]
+            s_all = Stream()
+            for t0, t1 in AfetchData.chunk_bounds_for_day(day, AfetchData.CHUNK_HOURS):
+                s_all += AfetchData.fetch_with_retries(
+                    client, AfetchData.NETWORK, AfetchData.STATION, AfetchData.LOCATION,
+                    AfetchData.CHANNEL, t0, t1)
+            st = AfetchData.assemble_day(day, s_all)
+            samples += sum(tr.stats.npts for tr in st) if st else 0
+        work.extra = {"requests": client.requests, "429s": client.failures}
+        return samples
+    return work
+
+
+def setup_amplitude(n_days, files):
+    def work():
+        rows = 0
+        for i in range(n_days):
+            tr = BmakeKavachiNoiseProfile.load_day_trace(files[i % len(files)])
+            rows += len(BmakeKavachiNoiseProfile.amplitude_rows(tr))
+        return rows
+    return work
+
+
+def setup_amplitude_legacy(n_days, files):
+    def work():
+        rows = 0
+        for i in range(n_days):
+            rows += len(BmakeKavachiNoiseProfile.process_miniseed_file_in_chunks(files[i % len(files)]))
+        return rows
+    return work
+
+
+def setup_activity(n_days, files):
+    times, amps = make_minute_amplitudes(n_days)
+    store = AmplitudeStore(CsaveActivityCurves.STORE_DIR)
+    store.append(times, amplitude=amps)
+
+    def work():
+        clean_store(store, full=True)
+        CsaveActivityCurves.run_full(store)
+        return len(store)
+    return work
+
+
+def setup_activity_chunked(n_days, files):
+    store = AmplitudeStore(CsaveActivityCurves.STORE_DIR)
+    for k, d0 in enumerate(range(0, n_days, 365)):
+        start = np.datetime64("2025-06-01") + d0
+        times, amps = make_minute_amplitudes(min(365, n_days - d0), start=str(start), seed=k)
+        store.append(times, amplitude=amps)
+        clean_store(store)
+
+    def work():
+        CsaveActivityCurves.run_full(store, chunked=True)
+        return len(store)
+    return work
+
+
+def setup_dayplot(n_days, files):
+    DsaveDayplots.OUTPUT_DIR = Path("dayplots")
+    DsaveDayplots.ensure_output_dir()
+    DsaveDayplots.init_worker()
+
+    def work():
+        for i in range(n_days):
+            msg = DsaveDayplots.process_file(files[i % len(files)])
+            if not msg.startswith("[OK]"):
+                raise RuntimeError(msg)
+        return n_days
+    return work
+
+
+SETUP = {
+    "fetch": setup_fetch,
+    "amplitude": setup_amplitude,
+    "amplitude_legacy": setup_amplitude_legacy,
+    "activity": setup_activity,
+    "activity_chunked": setup_activity_chunked,
+    "dayplot": setup_dayplot,
+}
+
+
+def max_rss_mb():
+    """Peak RSS of this process in MiB."""
+    # Linux: VmHWM starts over with the process image, unlike ru_maxrss, which
+    # a spawned child inherits from the benchmark's main process
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10   # bytes on macOS, KiB elsewhere
+
+
+def run_case(stage, n_days, data_dir, profile_path=None, fail_every=0):
+    """One (stage, days) case in the current (fresh) process; returns its result dict."""
+    files = pool_files(Path(data_dir))
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)   # everything the stages write stays in here
+        kwargs = {"fail_every": fail_every} if stage == "fetch" else {}
+        work = SETUP[stage](n_days, files, **kwargs)
+        baseline = max_rss_mb()
+
+        profiler = cProfile.Profile() if profile_path else None
+        wall, cpu = time.perf_counter(), time.process_time()
+        with redirect_stdout(io.StringIO()):
+            if profiler:
+                profiler.enable()
+            items = work()
+            if profiler:
+                profiler.disable()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+    if profiler:
+        profiler.dump_stats(profile_path)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(12)
+    result = {
+        "stage": stage,
+        "days": n_days,
+        "seconds": round(wall, 3),
+        "cpu_seconds": round(cpu, 3),
+        "items": int(items),
+        "days_per_sec": round(n_days / wall, 3) if wall else None,
+        "items_per_sec": round(items / wall, 1) if wall else None,
+        "baseline_rss_mb": round(baseline, 1),
+        "peak_rss_mb": round(max_rss_mb(), 1),
+    }
+    result.update(getattr(work, "extra", {}))
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True,
+                              capture_output=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, old_path):
+    """Print the time and peak RSS ratio new/old for the cases both files have."""
+    with open(old_path, encoding="utf-8") as f:
+        old = {(r["stage"], r["days"]): r for r in json.load(f)["results"]}
+    print(f"\nvs {old_path}:")
+    for r in results:
+        o = old.get((r["stage"], r["days"]))
+        if o:
+            print(f"{r['stage']:>17} {r['days']:>4} d: time x{r['seconds'] / o['seconds']:.2f}, "
+                  f"peak RSS x{r['peak_rss_mb'] / o['peak_rss_mb']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--days", type=int, nargs="+", default=list(DEFAULT_DAYS))
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--fail-every", type=int, default=0,
+                        help="mock client answers every Nth request with a 429 first")
+    parser.add_argument("--profile", action="store_true", help="write a cProfile dump per case")
+    parser.add_argument("--output", type=Path, help="result JSON (default: benchmarks/results/...)")
+    parser.add_argument("--compare", type=Path, help="earlier result JSON to compare with")
+    args = parser.parse_args()
+
+    revision = git_revision()
+    output = args.output or RESULTS_DIR / f"pipeline-{revision or 'norev'}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    results = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        pool_files(Path(data_dir))
+        for stage in args.stages:
+            for n_days in args.days:
+                profile_path = (str(output.with_name(f"{output.stem}-{stage}-{n_days}d.prof"))
+                                if args.profile else None)
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                    r = pool.submit(run_case, stage, n_days, data_dir, profile_path,
+                                    args.fail_every).result()
+                results.append(r)
+                print(f"{stage:>17} {n_days:>4} d: {r['seconds']:8.2f} s  "
+                      f"{r['days_per_sec']:7.2f} days/s  peak RSS {r['peak_rss_mb']:7.1f} MiB")
+
+    report = {
+        "revision": revision,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "pool_days": POOL_DAYS,
+        "results": results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
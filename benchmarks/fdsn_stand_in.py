@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for an FDSN dataselect service with a live station, to run
+liveService.py without the Raspberry Shake servers.
+
+    python benchmarks/fdsn_stand_in.py [--port 8080] [--latency 5] [--drop 0.0]
+    python liveService.py --url http://localhost:8080
+
+GET /fdsnws/dataselect/1/query?network=..&station=..&location=..&channel=..
+    &starttime=..&endtime=.. returns Steim-2 MiniSEED of a synthetic 100 Hz
+trace for the requested channel, but only up to `latency` seconds before
+now, like a real-time server; 204 when there is nothing yet. Samples are a
+function of their time (one seeded generator per second, a daily swell and
+hourly bursts), so repeated and overlapping requests agree. With --drop,
+that share of seconds is missing, for gaps.
+"""
+
+import argparse
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+from obspy import Stream, Trace, UTCDateTime
+
+SAMPLING_RATE = 100
+QUERY_PATH = "/fdsnws/dataselect/1/query"
+
+
+def second_samples(sec, drop=0.0):
+    """The 100 samples of epoch second `sec` (int32), or None if it is dropped."""
+    rng = np.random.default_rng(sec)
+    if drop and rng.random() < drop:
+        return None
+    daily = 1.0 + 0.3 * np.sin(2 * np.pi * (sec % 86400) / 86400)
+    burst = 4.0 if sec % 3600 < 120 else 1.0          # two loud minutes every hour
+    return (rng.normal(0, 400 * daily * burst, SAMPLING_RATE)).astype(np.int32)
+
+
+def make_stream(net, sta, loc, cha, t0, t1, drop=0.0):
+    """Synthetic samples in [t0, t1) as a stream, one trace per run without dropped seconds."""
+    traces, run, run_start = [], [], None
+    for sec in range(int(np.floor(t0.timestamp)), int(np.ceil(t1.timestamp))):
+        samples = second_samples(sec, drop)
+        if samples is None:
+            if run:
+                traces.append((run_start, np.concatenate(run)))
+            run, run_start = [], None
+            continue
+        if run_start is None:
+            run_start = sec
+        run.append(samples)
+    if run:
+        traces.append((run_start, np.concatenate(run)))
+
+    st = Stream()
+    for start, data in traces:
+        tr = Trace(data=data)
+        tr.stats.network, tr.stats.station, tr.stats.location, tr.stats.channel = net, sta, loc, cha
+        tr.stats.sampling_rate = SAMPLING_RATE
+        tr.stats.starttime = UTCDateTime(start)
+        st.append(tr)
+    return st.trim(t0, t1 - 1.0 / SAMPLING_RATE)
+
+
+class Handler(BaseHTTPRequestHandler):
+    latency = 5.0
+    drop = 0.0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != QUERY_PATH:
+            self.send_error(404)
+            return
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        try:
+            t0 = UTCDateTime(q["starttime"])
+            t1 = min(UTCDateTime(q["endtime"]), UTCDateTime(time.time() - self.latency))
+        except (KeyError, ValueError) as e:
+            self.send_error(400, f"Bad query: {e}")
+            return
+        st = make_stream(q.get("network", "AM"), q.get("station", "RF90E"),
+                         q.get("location", "00"), q.get("channel", "EHZ"), t0, t1, self.drop) \
+            if t1 > t0 else Stream()
+        if len(st) == 0:
+            self.send_response(204)
+            self.end_headers()
+            return
+        buf = BytesIO()
+        st.write(buf, format="MSEED", encoding="STEIM2", reclen=512)
+        body = buf.getvalue()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.fdsn.mseed")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        print(f"[STAND-IN] {self.address_string()} {fmt % args}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=5.0, help="seconds before now that are served")
+    parser.add_argument("--drop", type=float, default=0.0, help="share of missing seconds")
+    args = parser.parse_args()
+
+    Handler.latency, Handler.drop = args.latency, args.drop
+    server = ThreadingHTTPServer(("localhost", args.port), Handler)
+    print(f"[INFO] FDSN stand-in on http://localhost:{args.port}{QUERY_PATH}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
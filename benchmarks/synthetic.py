@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Synthetic Raspberry Shake day traces for offline benchmarks.
+
+make_day_trace() returns a 100 Hz AM.RF90E.00.EHZ trace covering one UTC day:
+Gaussian background noise, a few band-limited tremor bursts and isolated
+spikes, as int32 counts like the real station delivers. make_day_stream()
+cuts it into records with gaps and overlapping (repeated) records,
+make_minute_amplitudes() fakes the amplitude store contents for the
+activity curves, and MockClient serves synthetic days in place of the
+RASPISHAKE FDSN client.
+"""
+
+from io import BytesIO
+
+import numpy as np
+from obspy import Trace, Stream, UTCDateTime, read
+
+NETWORK, STATION, LOCATION, CHANNEL = "AM", "RF90E", "00", "EHZ"
+SAMPLING_RATE = 100.0
+
+
+def make_day_trace(day="2025-06-01", seed=0, sampling_rate=SAMPLING_RATE, noise=800.0):
+    """One day (+1 sample, as written by AfetchData) of synthetic counts."""
+    rng = np.random.default_rng(seed)
+    start = UTCDateTime(day)
+    npts = int(86400 * sampling_rate) + 1
+    data = rng.normal(0.0, noise, npts)
+
+    # Tremor bursts: 10 Hz carrier under a smooth envelope, minutes long
+    t = np.arange(npts) / sampling_rate
+    for _ in range(6):
+        t0 = rng.uniform(0, 86400 - 1800)
+        dur = rng.uniform(120, 1200)
+        sel = (t >= t0) & (t < t0 + dur)
+        env = np.sin(np.pi * (t[sel] - t0) / dur) ** 2
+        data[sel] += rng.uniform(2, 6) * noise * env * np.sin(2 * np.pi * 10.0 * t[sel])
+
+    # Isolated spikes
+    for k in rng.integers(0, npts - 50, 20):
+        data[k:k + 50] += rng.uniform(20, 50) * noise * np.exp(-np.arange(50) / 8.0)
+
+    tr = Trace(np.round(data).astype(np.int32))
+    tr.stats.network, tr.stats.station = NETWORK, STATION
+    tr.stats.location, tr.stats.channel = LOCATION, CHANNEL
+    tr.stats.sampling_rate = sampling_rate
+    tr.stats.starttime = start
+    return tr
+
+
+def make_day_stream(day="2025-06-01", seed=0, gaps=3, overlaps=3, record_sec=600):
+    """
+    The synthetic day as a stream of record_sec records, with `gaps` missing
+    stretches (30 s to 30 min) and `overlaps` records that repeat the last
+    few seconds of the record before them.
+    """
+    tr = make_day_trace(day, seed=seed)
+    rng = np.random.default_rng(seed + 1)
+    fs = tr.stats.sampling_rate
+    npts = tr.stats.npts
+
+    keep = np.ones(npts, dtype=bool)
+    for _ in range(gaps):
+        n = int(rng.uniform(30, 1800) * fs)
+        i0 = rng.integers(0, npts - n)
+        keep[i0:i0 + n] = False
+
+    # Overlaps go to records without gaps, where obspy's merge can drop the repeat
+    step = int(record_sec * fs)
+    whole = [k for k in range(1, npts // step) if keep[k * step - 10 * int(fs):(k + 1) * step].all()]
+    repeat = set(rng.choice(whole, size=min(overlaps, len(whole)), replace=False).tolist())
+    pieces = []
+    for k, i0 in enumerate(range(0, npts, step)):
+        i1 = min(i0 + step, npts)
+        if k in repeat:
+            i0 -= int(rng.uniform(1, 10) * fs)
+        edges = np.flatnonzero(np.diff(np.r_[False, keep[i0:i1], False].astype(np.int8)))
+        for a, b in edges.reshape(-1, 2) + i0:
+            piece = Trace(tr.data[a:b].copy())
+            piece.stats.network, piece.stats.station = NETWORK, STATION
+            piece.stats.location, piece.stats.channel = LOCATION, CHANNEL
+            piece.stats.sampling_rate = fs
+            piece.stats.starttime = tr.stats.starttime + a / fs
+            pieces.append(piece)
+    return Stream(pieces)
+
+
+def write_day_file(out_dir, day="2025-06-01", seed=0, defects=False):
+    """
+    Write a synthetic day with AfetchData's file naming; returns the path.
+    defects=True writes make_day_stream() (gaps, overlaps) instead of one trace.
+    """
+    st = make_day_stream(day, seed=seed) if defects else Stream([make_day_trace(day, seed=seed)])
+    path = out_dir / f"{NETWORK}.{STATION}.{LOCATION}.{CHANNEL}.{day}.mseed"
+    st.write(str(path), format="MSEED")
+    return path
+
+
+def make_minute_amplitudes(n_days, start="2025-06-01", seed=0):
+    """(epoch seconds, float32 amplitudes) for n_days of minutes, like the amplitude store."""
+    rng = np.random.default_rng(seed)
+    n = n_days * 1440
+    times = int(UTCDateTime(start).timestamp) + 60 * np.arange(n, dtype=np.int64)
+    daily = 1.0 + 0.3 * np.sin(2 * np.pi * np.arange(n) / 1440)
+    slow = np.repeat(rng.lognormal(0.0, 0.5, n_days + 1), 1440)[:n]   # day-to-day activity
+    amps = 1e6 * daily * slow * rng.lognormal(0.0, 0.3, n)
+    return times, amps.astype(np.float32)
+
+
+class MockClient:
+    """
+    Offline stand-in for obspy's Client("RASPISHAKE") as used by
+    AfetchData.fetch_with_retries: get_waveforms() decodes MiniSEED bytes cut
+    from the given day files, so parsing costs what it costs for real data.
+    Every fail_every-th request first fails with a 429 (Retry-After: 0).
+    """
+
+    def __init__(self, day_files, chunk_bounds, fail_every=0):
+        self.chunks = {}
+        for path in day_files:
+            st = read(str(path))
+            for t0, t1 in chunk_bounds(st[0].stats.starttime.date):
+                buf = BytesIO()
+                st.slice(t0, t1).write(buf, format="MSEED")
+                self.chunks[(t0.timestamp, t1.timestamp)] = buf.getvalue()
+        self.fail_every = fail_every
+        self.requests = 0
+        self.failures = 0
+
+    def get_waveforms(self, network, station, location, channel, starttime, endtime,
+                      filename=None, **kwargs):
+        self.requests += 1
+        if self.fail_every and self.requests % self.fail_every == 0:
+            self.failures += 1
+            raise Exception("HTTP Error 429: Too Many Requests (Retry-After: 0)")
+        data = self.chunks.get((starttime.timestamp, endtime.timestamp), b"")
+        if filename is not None:   # raw download, like the real client
+            filename.write(data)
+            return None
+        return read(BytesIO(data), format="MSEED") if data else Stream()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Compressed, content-addressed storage of the dayplot images, replacing one
+full-colour PNG per day (AM_RF90E_EHZ_<date>_5-40Hz.png) in dayplots/.
+
+Layout:
+    dayplots/
+        index.json        {"full": "full/", "thumb": "thumb/", "days": {date: name}}
+        full/<name>       the dayplot, FULL_LEVELS grey levels
+        thumb/<name>      THUMB_SIZE preview, THUMB_LEVELS grey levels
+
+- Dayplots are black lines on white, so matplotlib's RGBA PNG is reduced to
+  16 grey levels and saved as a 4-bit palette PNG (or lossless WebP), about
+  a quarter of its size. The thumbnail tier is what the dashboard shows
+  first, while the full image loads.
+- <name> is the first HASH_CHARS hex digits of the SHA-256 of the encoded
+  full image, plus its extension; the thumbnail, derived from it, has the
+  same name. Identical images (e.g. days without data, or a re-render that
+  changed nothing) are stored once, and writing an image again adds no file.
+- index.json maps dates to names. Only one process writes it (the parent
+  of the rendering workers); workers only add image files.
+- Days rendered before this store keep their PNG until migrated, and the
+  dashboard falls back to it for days the index does not list. The
+  renderers open the store with open_store(), which migrates them, and
+  prune it once their run is done, so replaced images are not committed.
+
+Usage:
+    python dayplotStore.py             # migrate legacy PNGs into the store
+    python dayplotStore.py --prune     # remove images no date refers to
+"""
+
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# -----------------------
+# Config
+# -----------------------
+DAYPLOT_DIR = Path("dayplots")        # root of the store
+IMAGE_FORMAT = "png"                  # "png" (palette) or "webp" (lossless)
+FULL_LEVELS = 16                      # grey levels of the full image
+THUMB_SIZE = (400, 300)               # pixels of the thumbnail tier
+THUMB_LEVELS = 4                      # grey levels of the thumbnail
+HASH_CHARS = 16                       # hex digits of SHA-256 in file names
+LEGACY_GLOB = "*_5-40Hz.png"          # one PNG per day, as written before this store
+# -----------------------
+
+_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def _save(image, levels, fmt):
+    """
+    A grey-level image rounded to `levels` evenly spaced greys (black and
+    white stay exact), as palette PNG or lossless WebP bytes.
+    """
+    from PIL import Image
+
+    grey = np.asarray(image, dtype=np.uint16)
+    palette = Image.fromarray(((grey * (levels - 1) + 127) // 255).astype(np.uint8), "P")
+    palette.putpalette(np.repeat(np.rint(np.linspace(0, 255, levels)).astype(np.uint8), 3).tolist())
+    buf = io.BytesIO()
+    if fmt == "webp":
+        palette.convert("L").save(buf, format="WEBP", lossless=True, method=6)
+    else:
+        # zlib's default level: level 9 is ~7x slower for ~2 % smaller files
+        palette.save(buf, format="PNG", bits=max(1, (levels - 1).bit_length()))
+    return buf.getvalue()
+
+
+def encode(data, fmt=IMAGE_FORMAT, thumbnail=True):
+    """(full image, thumbnail or None) bytes of a rendered dayplot (image file bytes)."""
+    from PIL import Image
+
+    grey = Image.open(io.BytesIO(data)).convert("L")   # no colours to keep
+    if not thumbnail:
+        return _save(grey, FULL_LEVELS, fmt), None
+    thumb = grey.resize(THUMB_SIZE, Image.Resampling.LANCZOS)
+    return _save(grey, FULL_LEVELS, fmt), _save(thumb, THUMB_LEVELS, fmt)
+
+
+def _write_atomic(path, data):
+    # Per-process temp name: workers may store the same image at the same time
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+class DayplotStore:
+    """Dayplot images named by content, with a thumbnail tier and a date -> name index."""
+
+    def __init__(self, root=DAYPLOT_DIR):
+        self.root = Path(root)
+        self.index_path = self.root / "index.json"
+
+    def full_path(self, name):
+        return self.root / "full" / name
+
+    def thumb_path(self, name):
+        return self.root / "thumb" / name
+
+    # ---------------- Images ----------------
+    def put(self, data, fmt=IMAGE_FORMAT):
+        """Store a rendered dayplot (image file bytes) unless already there; returns its name."""
+        full, thumb = encode(data, fmt)
+        name = f"{hashlib.sha256(full).hexdigest()[:HASH_CHARS]}.{fmt}"
+        if not self.full_path(name).exists():
+            # Thumbnail first: a full image is only there once its thumbnail is
+            _write_atomic(self.thumb_path(name), thumb)
+            _write_atomic(self.full_path(name), full)
+        return name
+
+    # ---------------- Index ----------------
+    def days(self):
+        """{date: name} of the indexed days."""
+        if not self.index_path.exists():
+            return {}
+        with open(self.index_path, encoding="utf-8") as f:
+            return json.load(f)["days"]
+
+    def get(self, day):
+        """Path of a day's full image, or None if the index has none."""
+        name = self.days().get(day)
+        return self.full_path(name) if name else None
+
+    def add(self, days):
+        """Point dates at stored names ({date: name}) and rewrite the index."""
+        if not days:
+            return
+        index = {**self.days(), **days}
+        body = {"full": "full/", "thumb": "thumb/", "days": dict(sorted(index.items()))}
+        # One date per line, so a day's commit changes one line
+        _write_atomic(self.index_path, json.dumps(body, indent=1).encode())
+
+    # ---------------- Maintenance ----------------
+    def prune(self):
+        """Remove images no date refers to (left by re-renders); returns the number removed."""
+        used = set(self.days().values())
+        removed = 0
+        for tier in ("full", "thumb"):
+            for path in (self.root / tier).glob("*"):
+                if path.name not in used and not path.name.startswith("."):
+                    path.unlink()
+                    removed += 1
+        return removed
+
+    def migrate(self, remove=True):
+        """
+        Move legacy <...>_<date>_5-40Hz.png files into the store (days the
+        index already lists keep their entry); returns (days added, bytes
+        before, bytes after).
+        """
+        indexed = self.days()
+        added, before, after = {}, 0, 0
+        legacy = [p for p in sorted(self.root.glob(LEGACY_GLOB))
+                  if _DATE.fullmatch(p.name.split("_")[-2])]
+        for path in legacy:
+            day = path.name.split("_")[-2]
+            before += path.stat().st_size
+            if day not in indexed:
+                added[day] = name = self.put(path.read_bytes())
+                after += self.full_path(name).stat().st_size + self.thumb_path(name).stat().st_size
+        self.add(added)
+        if remove:
+            for path in legacy:
+                path.unlink()
+        return len(added), before, after
+
+
+def open_store(root=DAYPLOT_DIR):
+    """Open the store, migrating legacy per-day PNGs into it if there are any."""
+    store = DayplotStore(root)
+    added, before, after = store.migrate()
+    if added:
+        print(f"[INFO] Migrated {added} legacy dayplots into {store.root}: "
+              f"{before / 2**20:.1f} MiB → {after / 2**20:.1f} MiB")
+    return store
+
+
+def main():
+    store = DayplotStore()
+    if "--prune" in sys.argv[1:]:
+        print(f"[OK] Removed {store.prune()} unreferenced images from {store.root}")
+        return
+    added, before, after = store.migrate()
+    if not added:
+        print(f"[INFO] No legacy dayplots to migrate in {store.root}.")
+        return
+    print(f"[OK] Migrated {added} days: {before / 2**20:.1f} MiB → {after / 2**20:.1f} MiB "
+          f"(full + thumbnail)")
+
+
+if __name__ == "__main__":
+    main()
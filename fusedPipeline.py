@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Single-pass pipeline over ./shake_data/: every MiniSEED day is read and
+merged once, and the in-memory trace is handed to each registered stage
+(minute amplitude profile, dayplot, spectrogram tiles, ...). Replaces running
+BmakeKavachiNoiseProfile.py and DsaveDayplots.py one after the other, which
+decoded every file twice.
+
+A stage is a small class with:
+- name            short label used in log lines and as the manifest stage
+- exists(day)     whether its product is already on disk; only asked once per
+                  day, for history from before the processing manifest
+- process(day, tr) derive the product from the merged trace, without
+                  modifying it; returns {"detail": log text, "rows": ...,
+                  "checksum": ...} for the manifest
+- close()         flush anything buffered after the last day
+
+Which stages still have work for a day comes from processingManifest, so
+fully finished days are never decoded and a failed stage is retried even
+when the other stages succeeded. New products subclass Stage and are added
+to default_stages().
+
+After all days succeed, shake_data is emptied (as DsaveDayplots does).
+
+Decoding and every stage are timed per day in the run report (runReport.py).
+
+Streaming mode (STREAM_FROM_FETCH = True or `python fusedPipeline.py --stream`)
+skips shake_data altogether: days are fetched from FDSN by AfetchData's
+concurrent fetcher and handed over in memory through a bounded queue, so
+downloading day N+1 overlaps processing day N. Writing MiniSEED is then only
+an optional archival sink (ARCHIVE_MSEED): it archives the days the other
+stages fetch, but never asks for days by itself, so enabling it does not
+re-fetch the history. Days already in the waveform cache (waveformCache.py)
+are read from there instead of being fetched, and fetched days are added
+to it.
+"""
+
+import os
+import queue
+import sys
+import threading
+from datetime import date, datetime
+from pathlib import Path
+
+import numpy as np
+from obspy import Stream
+
+import AfetchData as fetch
+import BmakeKavachiNoiseProfile as amplitude
+import DsaveDayplots as dayplots
+import EsaveSpectrograms as spectrograms
+import dayplotStore
+import runReport
+from amplitudeStore import open_store
+from processingManifest import Manifest, DONE, ADOPT, checksum, file_checksum
+
+# ---------------- CONFIG ----------------
+INPUT_DIR = Path("./shake_data")     # directory with daily MiniSEED files
+STREAM_FROM_FETCH = False            # fetch days from FDSN and process them in memory
+STREAM_QUEUE_DEPTH = 2               # fetched days waiting for processing (bounds memory)
+ARCHIVE_MSEED = False                # in streaming mode, also keep each day as MiniSEED
+# ----------------------------------------
+
+
+class Stage:
+    """One data product derived from a day's merged trace."""
+
+    name = "stage"
+
+    def exists(self, day):
+        return False
+
+    def process(self, day, tr):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class AmplitudeStage(Stage):
+    """Minute mean amplitudes appended to the amplitude store."""
+
+    name = "amplitude"
+
+    def __init__(self):
+        self.store = open_store(amplitude.STORE_DIR, amplitude.LEGACY_CSV)
+
+    def exists(self, day):
+        return ADOPT[self.name](day, self.store)
+
+    def process(self, day, tr):
+        rows = amplitude.amplitude_rows(tr)
+        added = amplitude.append_rows(self.store, rows, replace=True)
+        amps = np.array([r["amplitude"] for r in rows], dtype=np.float32)
+        return {"detail": f"{added} new rows", "rows": len(rows), "checksum": checksum(amps)}
+
+
+class DayplotStage(Stage):
+    """5–40 Hz dayplot and thumbnail in the dayplot store (dayplotStore.py)."""
+
+    name = "dayplot"
+
+    def __init__(self):
+        dayplots.ensure_output_dir()
+        dayplots.init_worker()
+        self.store = dayplotStore.open_store(dayplots.OUTPUT_DIR)
+
+    def exists(self, day):
+        return ADOPT[self.name](day)
+
+    def process(self, day, tr):
+        name = dayplots.save_dayplot(tr)
+        self.store.add({day: name})
+        return {"detail": name, "rows": 1, "checksum": name.split(".")[0]}
+
+    def close(self):
+        # Images of re-rendered days that no date refers to any more
+        self.store.prune()
+
+
+class SpectrogramStage(Stage):
+    """Spectrogram and hourly PSD tiles (EsaveSpectrograms)."""
+
+    name = "spectrogram"
+
+    def exists(self, day):
+        return ADOPT[self.name](day)
+
+    def process(self, day, tr):
+        rows, crc = spectrograms.save_day(day, tr)
+        return {"detail": spectrograms.tile_path(day).name, "rows": rows, "checksum": crc}
+
+    def close(self):
+        spectrograms.write_manifest()
+
+
+class MseedArchiveStage(Stage):
+    """Raw day written as MiniSEED to AfetchData.OUT_DIR (streaming mode only)."""
+
+    name = "archive"
+
+    def __init__(self):
+        fetch.OUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    def path(self, day):
+        return fetch.OUT_DIR / fetch.FILENAME_PATTERN.format(
+            network=fetch.NETWORK, station=fetch.STATION, location=fetch.LOCATION,
+            channel=fetch.CHANNEL, date=day)
+
+    def exists(self, day):
+        return self.path(day).exists()
+
+    def process(self, day, tr):
+        out_file = self.path(day)
+        # Put the gaps back, so the archive does not store the zero fill
+        mask = amplitude.gap_mask(tr)
+        if mask is not None:
+            tr = tr.copy()
+            tr.data = np.ma.masked_array(tr.data, mask=mask)
+        Stream([tr]).split().write(str(out_file), format="MSEED")
+        return {"detail": out_file.name, "rows": 1, "checksum": file_checksum(out_file)}
+
+
+def default_stages():
+    return [AmplitudeStage(), DayplotStage(), SpectrogramStage()]
+
+
+def day_from_name(name):
+    """Date part of a file name like AM.RF90E.00.EHZ.2025-06-02.mseed."""
+    return name.split(".")[-2]
+
+
+def pending_stages(day, stages, manifest):
+    """Stages the manifest does not list as done for the day."""
+    return [s for s in stages if not manifest.is_done(s.name, day, adopt=s.exists)]
+
+
+def run_day(file_path, stages, manifest):
+    """Decode one day once and run every stage that still has work; True if no errors."""
+    day = day_from_name(file_path.name)
+    pending = pending_stages(day, stages, manifest)
+    if not pending:
+        print(f"[SKIP] {file_path.name} — all stages done")
+        return True
+
+    try:
+        with runReport.span("decode", day):
+            tr = amplitude.load_day_trace(file_path)
+    except Exception as e:
+        print(f"[ERROR] {file_path.name}: {e}")
+        for stage in pending:
+            manifest.record(stage.name, day, "failed")
+        return False
+    if tr is None:
+        print(f"[WARN] No {amplitude.CHANNEL} in {file_path.name}")
+        for stage in pending:
+            manifest.record(stage.name, day, "empty")
+        return True
+
+    return run_trace(day, tr, pending, manifest)
+
+
+def run_trace(day, tr, stages, manifest):
+    """Run each stage on an already merged trace and record it; True if no errors."""
+    # Gap share is known when the trace comes straight from the fetcher,
+    # otherwise from the fetch that wrote the file
+    gap = tr.stats.get("gap_fraction")
+    if gap is None:
+        fetched = manifest.get("fetch", day)
+        gap = fetched["gap_fraction"] if fetched else None
+
+    ok = True
+    for stage in stages:
+        try:
+            with runReport.span(stage.name, day) as rec:
+                result = stage.process(day, tr)
+                rec["rows"] = result.get("rows")
+        except Exception as e:
+            print(f"[ERROR] {day} {stage.name}: {e}")
+            manifest.record(stage.name, day, "failed", gap_fraction=gap)
+            ok = False
+            continue
+        print(f"[OK] {day} {stage.name}: {result['detail']}")
+        manifest.record(stage.name, day, DONE, rows=result.get("rows"),
+                        checksum=result.get("checksum"), gap_fraction=gap)
+    return ok
+
+
+def run(mseed_files, stages, manifest):
+    ok = True
+    try:
+        for file_path in mseed_files:
+            ok = run_day(file_path, stages, manifest) and ok
+    finally:
+        for stage in stages:
+            stage.close()
+    return ok
+
+
+def run_streaming(days, stages, manifest, queue_depth=STREAM_QUEUE_DEPTH):
+    """
+    Fetch `days` in a background thread and process each one as it arrives.
+    The queue holds at most queue_depth fetched days, and the fetcher keeps
+    only one more day in flight, so memory stays bounded however long the
+    backlog is. True if no errors.
+    """
+    handoff = queue.Queue(maxsize=queue_depth)
+    done = object()
+    errors = []
+
+    def producer():
+        try:
+            for day, s_all in fetch.iter_fetched_days(days, manifest, max_days_in_flight=1):
+                handoff.put((day, fetch.assemble_day(day, s_all)))
+        except Exception as e:
+            errors.append(e)
+            print(f"[ERROR] fetch: {e}")
+        finally:
+            handoff.put(done)
+
+    thread = threading.Thread(target=producer, name="fetch", daemon=True)
+    thread.start()
+
+    ok = True
+    try:
+        while (item := handoff.get()) is not done:
+            day, st = item
+            fetch.record_fetch(manifest, day, st)
+            if st is None:
+                continue
+            fetch.cache_day(manifest, day, s_all=st)
+            day = day.isoformat()
+            st = st.select(channel=amplitude.CHANNEL)
+            if len(st) == 0:
+                print(f"[WARN] No {amplitude.CHANNEL} for {day}")
+                continue
+            tr = amplitude.fill_gaps(st[0])
+            ok = run_trace(day, tr, pending_stages(day, stages, manifest), manifest) and ok
+    finally:
+        for stage in stages:
+            stage.close()
+    thread.join()
+    return ok and not errors
+
+
+def main_streaming():
+    stages = default_stages()
+    if ARCHIVE_MSEED:
+        stages.append(MseedArchiveStage())
+
+    start_date = datetime.fromisoformat(fetch.START_DATE_UTC).date()
+    end_date = datetime.fromisoformat(fetch.END_DATE_UTC).date()
+    with runReport.run("fused --stream"), Manifest() as manifest:
+        todo = set(manifest.plan_fetch(start_date, end_date))
+        # Only the processing stages decide what to fetch; the archive takes what comes
+        for stage in stages:
+            if stage.name != MseedArchiveStage.name:
+                todo.update(manifest.plan(stage.name, start_date, end_date, is_done=stage.exists))
+        todo = [date.fromisoformat(d) for d in sorted(todo) if not fetch.no_data_left(manifest, d)]
+        cached = {day: path for day in todo if (path := fetch.cached_day(manifest, day))}
+        days = [day for day in todo if day not in cached]
+        print(f"[INFO] Streaming {len(days)} days from {start_date} to {end_date} (exclusive), "
+              f"{len(cached)} from the waveform cache; stages: {', '.join(s.name for s in stages)}\n")
+
+        ok = True
+        for path in cached.values():
+            ok = run_day(path, stages, manifest) and ok
+        if days:
+            ok = run_streaming(days, stages, manifest) and ok
+        else:
+            for stage in stages:
+                stage.close()
+        if not ok:
+            print("[WARN] Errors occurred; failed days are retried on the next run.")
+
+
+def main():
+    if STREAM_FROM_FETCH or "--stream" in sys.argv[1:]:
+        main_streaming()
+        return
+
+    mseed_files = sorted([
+        Path(root) / name
+        for root, _, files in os.walk(INPUT_DIR)
+        for name in files if name.lower().endswith(".mseed")
+    ])
+    if not mseed_files:
+        print("No MiniSEED files found.")
+        return
+
+    stages = default_stages()
+    print(f"[INFO] Found {len(mseed_files)} files; stages: {', '.join(s.name for s in stages)}\n")
+
+    with runReport.run("fused"), Manifest() as manifest:
+        ok = run(mseed_files, stages, manifest)
+    if ok:
+        dayplots.clear_shake_data()
+    else:
+        print(f"[WARN] Errors occurred; keeping {INPUT_DIR} for the next run.")
+
+
+if __name__ == "__main__":
+    main()
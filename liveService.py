@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Near-real-time mode: a long-running service that keeps the amplitude store,
+the tremor detector, the activity scores and a dayplot of the current UTC
+day up to date a few minutes behind the station, instead of once a day.
+
+Every POLL_SECONDS it requests only the samples after the last request
+(up to LATENCY_SEC before now) from FDSN dataselect or a SeedLink server,
+and then:
+
+- computes the minutes completed since the last poll with the same windows
+  as BmakeKavachiNoiseProfile.amplitude_rows() and stores them (a minute
+  with missing samples is NaN, as in the daily run)
+- feeds them to the streaming tremor detector (tremorDetector.py), which
+  cleans and scores only the minutes from the poll's first one on (plus
+  the cleaning look-back), under the amplitude store's lock it shares
+  with the daily run
+- filters the new samples (with FILTER_PAD_SEC of context on both sides,
+  so the zero-phase filter has no edge there) and folds them into the
+  per-pixel envelopes of today's dayplot, which is drawn to
+  dayplots/<NET>_<STA>_<CHA>_live_5-40Hz.png (a grey palette PNG, like
+  the images of dayplotStore.py, but overwritten in place)
+- every ACTIVITY_REFRESH_SEC, patches the activity curves and dashboard
+  tiers with CsaveActivityCurves' incremental mode (once a full run exists)
+
+Only the samples since the previous poll are kept in memory and processed,
+so the work per poll is proportional to the new data; drawing the PNG is a
+fixed cost. On start the service backfills the current day in requests of
+at most MAX_REQUEST_SEC.
+
+Live minutes are provisional: the daily pipeline processes the finished day
+from complete data and replaces them, and renders the final dayplot (the
+manifest never records live work as done).
+
+Usage:
+    python liveService.py                          # FDSN (RASPISHAKE)
+    python liveService.py --url http://localhost:8080   # benchmarks/fdsn_stand_in.py
+    python liveService.py --seedlink rs.local:18000
+    python liveService.py --once                   # one poll, then exit
+"""
+
+import argparse
+import io
+import os
+import time
+
+import numpy as np
+from obspy import Stream, UTCDateTime
+from obspy.clients.fdsn import Client
+
+import AfetchData as fetch
+import BmakeKavachiNoiseProfile as amplitude
+import CsaveActivityCurves as activity
+import DsaveDayplots as dayplots
+import runReport
+import tremorDetector
+from amplitudeStore import AmplitudeStore
+from dayplotStore import encode
+
+# ---------------- CONFIG ----------------
+FDSN_URL = "RASPISHAKE"              # FDSN provider name or base URL
+SEEDLINK_SERVER = None               # "host:port" to poll SeedLink instead, e.g. a Shake's rs.local:18000
+POLL_SECONDS = 120                   # time between polls
+LATENCY_SEC = 30                     # newest seconds left for the next poll (still arriving at the server)
+MAX_REQUEST_SEC = 3600               # longest window per request (backfill after start or an outage)
+FILTER_PAD_SEC = 30                  # filter context before and after the samples drawn
+ACTIVITY_REFRESH_SEC = 3600          # activity curves gain one hourly row per hour
+LIVE_NAME = "live"                   # date part of the live dayplot's file name
+# ----------------------------------------
+
+
+class SeedLinkSource:
+    """SeedLink basic client with the get_waveforms(..., filename=) signature AfetchData uses."""
+
+    def __init__(self, server):
+        from obspy.clients.seedlink.basic_client import Client as SeedLinkClient
+        host, _, port = server.partition(":")
+        self.client = SeedLinkClient(host, int(port or 18000), timeout=60)
+
+    def get_waveforms(self, net, sta, loc, cha, t0, t1, filename=None):
+        st = self.client.get_waveforms(net, sta, loc, cha, t0, t1)
+        if filename is None:
+            return st
+        if len(st):
+            st.write(filename, format="MSEED")
+
+
+class LiveStation:
+    """Incremental state of one station: unconsumed samples, the next minute and today's dayplot."""
+
+    def __init__(self, source, start=None):
+        self.source = source
+        self.limiter = fetch.TokenBucket(fetch.RATE_LIMIT_PER_SEC, fetch.RATE_LIMIT_BURST)
+        self.store = AmplitudeStore(amplitude.STORE_DIR)
+
+        start = UTCDateTime(start or UTCDateTime().date)
+        self.requested = start       # samples before this time were requested
+        self.minute = start          # first minute not stored yet
+        self.buffer = Stream()       # samples not consumed by both minutes and dayplot
+        self.day = None              # UTC day start of the envelopes
+        self.envelopes = None
+        self.plotted = start         # first sample time not in the envelopes
+        self.stats = None            # trace header, for the dayplot title
+        self.activity_due = 0.0
+
+    # ---------------- Poll ----------------
+    def poll(self):
+        """Request the new samples and process them; returns the minutes stored."""
+        end = UTCDateTime() - LATENCY_SEC
+        since = int(self.minute.timestamp)
+        minutes = 0
+        while self.requested < end:
+            t0, t1 = self.requested, min(end, self.requested + MAX_REQUEST_SEC)
+            self.buffer += fetch.fetch_with_retries(self.source, fetch.NETWORK, fetch.STATION,
+                                                    fetch.LOCATION, fetch.CHANNEL, t0, t1, self.limiter)
+            self.requested = t1
+            minutes += self.consume()
+        self.render()
+        if minutes:
+            self.detect(since)
+        if time.monotonic() >= self.activity_due:
+            self.refresh_activity()
+        return minutes
+
+    def consume(self):
+        """Store completed minutes and draw the settled samples of the buffer; returns the minutes stored."""
+        st = self.buffer.select(channel=fetch.CHANNEL)
+        if len(st) == 0:
+            # Nothing arrived: minutes that are over are gaps all the same
+            return self.store_minutes(None)
+        st.merge(method=1)
+        tr = st[0]
+        self.stats = tr.stats
+        minutes = self.store_minutes(tr)
+        self.draw(tr)
+
+        # Keep what the next minute and the filter context still need
+        keep_from = min(self.minute, self.plotted - FILTER_PAD_SEC)
+        self.buffer = Stream([tr]).split().trim(starttime=keep_from)
+        return minutes
+
+    def store_minutes(self, tr):
+        """Amplitude rows of the minutes that ended (boundary sample included) before self.requested."""
+        fs = tr.stats.sampling_rate if tr is not None else 100.0
+        n = int((self.requested - self.minute - 1.0 / fs) // 60)
+        if n <= 0:
+            return 0
+        t0, t1 = self.minute, self.minute + n * 60
+        if tr is None:
+            rows = [{"time": f"{(t0 + k * 60).isoformat()}Z", "amplitude": np.nan} for k in range(n)]
+        else:
+            window = tr.copy().trim(t0, t1, pad=True)
+            rows = amplitude.amplitude_rows(amplitude.fill_gaps(window), n_windows=n)
+        amplitude.append_rows(self.store, rows, replace=True)
+        self.minute = t1
+        print(f"[LIVE] {len(rows)} minute(s) stored up to {t1.strftime('%H:%M')} UTC")
+        return n
+
+    def detect(self, since):
+        """Clean the minutes stored from since on and feed them to the detector."""
+        with self.store.locked():
+            # Saved state, not a copy kept here: the daily run may have fed it since
+            detector = tremorDetector.load_state() or tremorDetector.TremorDetector()
+            tremorDetector.run(self.store, detector, since=since)
+
+    # ---------------- Dayplot ----------------
+    def draw(self, tr):
+        """Filter the samples settled since the last poll and fold them into today's envelopes."""
+        fs = tr.stats.sampling_rate
+        until = self.requested - FILTER_PAD_SEC
+        while self.plotted < until:
+            day = UTCDateTime(self.plotted.date)
+            if day != self.day:
+                if self.envelopes is not None:
+                    self.render()          # the finished day's last live picture
+                self.day, self.envelopes = day, dayplots.empty_envelopes()
+            stop = min(until, day + 86400)
+
+            seg = tr.slice(self.plotted - FILTER_PAD_SEC, stop + FILTER_PAD_SEC)
+            if seg.stats.npts:
+                # Gaps are drawn as zeros, like the daily dayplot
+                data = np.ma.filled(seg.data, 0).astype(np.float64)
+                data -= data.mean()
+                dayplots.bandpass_inplace(data, fs)
+                first = int(round((seg.stats.starttime - day) * fs))
+                i0 = int(round((self.plotted - day) * fs)) - first
+                i1 = int(round((stop - day) * fs)) - first
+                dayplots.add_envelopes(self.envelopes, data[max(0, i0):max(0, i1)],
+                                       first + max(0, i0), fs)
+            self.plotted = stop
+
+    def render(self):
+        if self.envelopes is None or self.stats is None:
+            return
+        stats = self.stats.copy()
+        stats.starttime = self.day
+        out_file = dayplots.OUTPUT_DIR / (f"{stats.network}_{stats.station}_{dayplots.CHANNEL}"
+                                          f"_{LIVE_NAME}_5-40Hz.png")
+        dayplots.ensure_output_dir()
+        title = f"{stats.network}.{stats.station}.{stats.location}.{stats.channel} — 5–40 Hz, " \
+                f"{self.day.date} up to {self.plotted.strftime('%H:%M')} UTC"
+        png = io.BytesIO()
+        dayplots.draw_envelopes(self.envelopes, stats, png, title)
+        tmp = out_file.with_name(out_file.name + ".tmp")
+        tmp.write_bytes(encode(png.getvalue(), fmt="png", thumbnail=False)[0])
+        os.replace(tmp, out_file)   # the dashboard never reads half a picture
+
+    # ---------------- Activity ----------------
+    def refresh_activity(self):
+        """Patch the activity curves and tiers, if a full run left its state."""
+        self.activity_due = time.monotonic() + ACTIVITY_REFRESH_SEC
+        if not (os.path.exists(activity.STATE_FILE) and os.path.exists(activity.CSV_OUTPUT)):
+            print("[LIVE] Activity curves not initialized; run CsaveActivityCurves.py once.")
+            return
+        # The daily run updates the same curves and state
+        with self.store.locked(), runReport.span("activity", mode="live") as rec:
+            rec["rows"] = activity.run_incremental(self.store, activity.load_state())
+
+
+def open_source(url=None, seedlink=None):
+    seedlink = seedlink or SEEDLINK_SERVER
+    if seedlink:
+        return SeedLinkSource(seedlink)
+    # Only dataselect is used, so the service discovery requests are skipped
+    return Client(url or FDSN_URL, timeout=120, _discover_services=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help=f"FDSN provider or base URL (default {FDSN_URL})")
+    parser.add_argument("--seedlink", help="poll this SeedLink host:port instead of FDSN")
+    parser.add_argument("--start", help="first UTC time to ingest (default: start of today)")
+    parser.add_argument("--once", action="store_true", help="poll once and exit")
+    args = parser.parse_args()
+
+    station = LiveStation(open_source(args.url, args.seedlink), args.start)
+    print(f"[INFO] Live mode for {fetch.NETWORK}.{fetch.STATION}.{fetch.LOCATION}.{fetch.CHANNEL} "
+          f"from {station.requested}, polling every {POLL_SECONDS} s")
+    with runReport.run("live"):
+        try:
+            while True:
+                polled = time.monotonic()
+                with runReport.span("live_poll", station.requested.strftime("%Y-%m-%dT%H:%M")) as rec:
+                    rec["rows"] = station.poll()
+                if args.once:
+                    break
+                time.sleep(max(0.0, POLL_SECONDS - (time.monotonic() - polled)))
+        except KeyboardInterrupt:
+            print("\n[INFO] Live mode stopped.")
+
+
+if __name__ == "__main__":
+    main()
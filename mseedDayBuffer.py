@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Lean MiniSEED reader for whole UTC days: decoded samples go straight into
+one preallocated int32 day buffer at their sample offsets, next to a
+boolean mask of the samples that arrived. Replaces read() + merge() +
+trim(pad=True) (+ zero-filling), each of which holds or copies the whole
+day again.
+
+The file is memory-mapped and cut at record boundaries (found with
+libmseed's ms_detect) into slices of about SLICE_BYTES. Each slice is
+decoded in place by obspy's MiniSEED reader (libmseed's C decoder, which
+also skips bytes that are not records), and its few contiguous segments
+are copied into the buffer and dropped. Peak memory is therefore the day
+buffer plus one slice's samples, and the only per-record work is done in C.
+
+Corrupt data costs only the records it is in: a slice libmseed rejects
+(e.g. an impossible Steim nibble) is bisected until the bad record is
+isolated and dropped, where read() of the whole file fails, with or
+without ignore_data_errors.
+
+Segments are placed in file order, so where records overlap the later one
+wins, like Stream.merge(method=1) for time-ordered files. A day covers
+86400 s plus the first sample of the next day, like AfetchData's trimmed
+days.
+
+    tr = read_day(path, "EHZ")        # zero-filled, gaps in tr.stats.gap_spans
+    buf = DayBuffer(day_start)        # or DayBuffer.for_file(path, channel)
+    buf.add_bytes(data)               # add_file(path), add_stream(st)
+    tr = buf.trace(masked=True)       # masked array (no copy), like merge()
+
+Benchmark against read + merge + trim (benchmarks/bench_decode.py): on a
+plain day without gaps the gain is small, about 1.1-1.2x, since merge() and
+trim() have little to do; days with gaps or 512-byte records decode 2-3x
+faster. Peak memory is about 1.7x lower on gappy days.
+
+The slicing relies on obspy internals (obspy.io.mseed.core._read_mseed and
+libmseed's ms_detect through clibmseed), tested with the obspy version the
+workflows pin. Where they are missing, add_bytes() falls back to read() of
+all the bytes: same buffer, no bisection, so a corrupt record drops the file.
+"""
+
+import io
+import mmap
+
+import numpy as np
+from obspy import Trace, UTCDateTime, read
+from obspy.io.mseed import InternalMSEEDError, ObsPyMSEEDFilesizeTooSmallError
+
+try:
+    from obspy.io.mseed.core import _read_mseed
+    from obspy.io.mseed.headers import clibmseed
+    _ms_detect = clibmseed.lib.ms_detect
+except (ImportError, AttributeError):      # private API, not in every obspy release
+    _read_mseed = _ms_detect = None
+
+# ---------------- CONFIG ----------------
+SLICE_BYTES = 1 << 20                # MiniSEED bytes decoded per libmseed call
+DAY_SEC = 86400
+# ----------------------------------------
+
+_QUALITY = np.frombuffer(b"DRQM", dtype=np.uint8)
+
+
+def record_length(data, offset):
+    """Length of the complete MiniSEED record starting at `offset`, or None if there is none."""
+    if len(data) - offset < 48:
+        return None
+    view = np.frombuffer(data, dtype=np.int8, count=min(len(data) - offset, 1 << 16), offset=offset)
+    length = _ms_detect(view, len(view))
+    return length if 0 < length <= len(data) - offset else None
+
+
+def next_record(data, offset):
+    """Offset of the first readable record after `offset` (len(data) if there is none)."""
+    tail = np.frombuffer(data, dtype=np.uint8, offset=offset + 1)
+    # Candidates: a data quality indicator where a header has it (byte 6)
+    for i in np.flatnonzero(np.isin(tail[6:], _QUALITY)):
+        if record_length(data, offset + 1 + i):
+            return offset + 1 + int(i)
+    return len(data)
+
+
+def record_slices(data, size=SLICE_BYTES, start=0, stop=None):
+    """
+    [start, stop) byte ranges of about `size` that start and end at record
+    boundaries, skipping bytes that are not part of a record. Files of one
+    record length are cut by arithmetic, otherwise records are walked.
+    """
+    end = len(data) if stop is None else stop
+    while start < end:
+        length = record_length(data, start)
+        if length is None:
+            start = next_record(data, start)
+            continue
+        stop = min(end, start + max(1, size // length) * length)
+        if stop < end and record_length(data, stop) is None:
+            # Another record length or garbage ahead: walk the records
+            stop = start + length
+            while stop < end and stop - start < size and (length := record_length(data, stop)):
+                stop += length
+        yield start, min(stop, end)
+        start = stop
+
+
+class DayBuffer:
+    """One channel of one UTC day: int32 samples and a mask of the samples that arrived."""
+
+    def __init__(self, day_start=None, channel=None, sampling_rate=None):
+        """day_start=None: the UTC day of the first sample added."""
+        self.day_start = UTCDateTime(day_start) if day_start is not None else None
+        self.channel = channel
+        self.trace_id = None
+        self.sampling_rate = None
+        self.data = self.filled = None
+        self.skipped_bytes = 0       # in corrupt records and between records
+        if sampling_rate:
+            self._allocate(sampling_rate)
+
+    @classmethod
+    def for_file(cls, path, channel=None):
+        """Buffer for the UTC day of the file's first `channel` sample, filled from it."""
+        return cls(channel=channel).add_file(path)
+
+    def _allocate(self, sampling_rate):
+        self.sampling_rate = float(sampling_rate)
+        npts = int(round(DAY_SEC * self.sampling_rate)) + 1
+        # np.zeros maps fresh zero pages: gaps cost nothing until written
+        self.data = np.zeros(npts, dtype=np.int32)
+        self.filled = np.zeros(npts, dtype=bool)
+
+    # ---------------- Input ----------------
+    def add_file(self, path):
+        with open(path, "rb") as f, _mapped(f) as data:
+            return self.add_bytes(data)
+
+    def add_bytes(self, data):
+        """Decode MiniSEED bytes into the day, one slice at a time."""
+        if _read_mseed is None:
+            return self._add_whole(data)
+        raw = np.frombuffer(data, dtype=np.int8)
+        covered = 0
+        for start, stop in record_slices(data):
+            self._decode(data, raw, start, stop)
+            covered += stop - start
+        self.skipped_bytes += len(data) - covered
+        return self
+
+    def _add_whole(self, data):
+        # Fallback without obspy's internals: one read() of all the bytes
+        if len(data) == 0:
+            return self
+        try:
+            st = read(io.BytesIO(bytes(data)), format="MSEED")
+        except Exception as e:
+            print(f"[WARN] Skipping {len(data)} MiniSEED bytes: {e}")
+            self.skipped_bytes += len(data)
+            return self
+        return self.add_stream(st)
+
+    def _decode(self, data, raw, start, stop):
+        try:
+            # obspy's reader without read()'s plugin lookup, on a view of the bytes
+            st = _read_mseed(raw[start:stop])
+        except (InternalMSEEDError, ObsPyMSEEDFilesizeTooSmallError):
+            length = record_length(data, start)
+            if length is None or stop - start <= length:
+                self.skipped_bytes += stop - start
+                return
+            for a, b in record_slices(data, (stop - start) // 2, start, stop):
+                self._decode(data, raw, a, b)
+            return
+        self.add_stream(st)
+
+    def add_stream(self, st):
+        """Copy decoded traces into the day (the first trace id and rate seen are kept)."""
+        for tr in st:
+            if self.channel is not None and tr.stats.channel != self.channel:
+                continue
+            if self.trace_id is None:
+                self.trace_id = tr.id
+                if self.day_start is None:
+                    self.day_start = UTCDateTime(tr.stats.starttime.date)
+                if self.data is None:
+                    self._allocate(tr.stats.sampling_rate)
+            if tr.id != self.trace_id or tr.stats.sampling_rate != self.sampling_rate:
+                continue
+            i0 = int(round((tr.stats.starttime.ns - self.day_start.ns) * self.sampling_rate / 1e9))
+            skip = max(0, -i0)
+            n = min(tr.stats.npts, len(self.data) - i0) - skip
+            if n <= 0:
+                continue
+            i0 += skip
+            values = tr.data[skip:skip + n]
+            if np.ma.is_masked(values) or values.dtype.kind == "f":
+                valid = ~np.ma.getmaskarray(values)
+                self.data[i0:i0 + n][valid] = np.rint(np.ma.getdata(values)[valid])
+                self.filled[i0:i0 + n] |= valid
+            else:
+                self.data[i0:i0 + n] = np.ma.getdata(values)
+                self.filled[i0:i0 + n] = True
+        return self
+
+    # ---------------- Output ----------------
+    def gap_spans(self):
+        """[start, stop) sample spans that never arrived (see BmakeKavachiNoiseProfile.fill_gaps)."""
+        edges = (np.flatnonzero(self.filled[1:] != self.filled[:-1]) + 1).tolist()
+        if not self.filled[0]:
+            edges.insert(0, 0)
+        if not self.filled[-1]:
+            edges.append(len(self.filled))
+        return [edges[i:i + 2] for i in range(0, len(edges), 2)]
+
+    def trace(self, masked=False):
+        """
+        The day as a Trace sharing the buffer (None if nothing arrived). Gaps
+        are zeros listed in tr.stats.gap_spans, or masked with masked=True.
+        tr.stats.gap_fraction is their share of the day.
+        """
+        if self.data is None or not self.filled.any():
+            return None
+        data = np.ma.MaskedArray(self.data, mask=~self.filled) if masked else self.data
+        tr = Trace(data=data)
+        net, sta, loc, cha = self.trace_id.split(".")
+        tr.stats.network, tr.stats.station, tr.stats.location, tr.stats.channel = net, sta, loc, cha
+        tr.stats.sampling_rate = self.sampling_rate
+        tr.stats.starttime = self.day_start
+        tr.stats.gap_fraction = 1.0 - np.count_nonzero(self.filled) / len(self.filled)
+        if not masked:
+            tr.stats.gap_spans = self.gap_spans()
+        return tr
+
+
+def _mapped(f):
+    """The file's bytes as a read-only memory map (empty files as an empty buffer)."""
+    if f.seek(0, 2) == 0:
+        return memoryview(b"")
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_day(path, channel=None, masked=False):
+    """One MiniSEED day file as a single whole-day Trace of `channel` (None if empty)."""
+    return DayBuffer.for_file(path, channel).trace(masked=masked)
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Persistent record of what has been processed, per UTC day and stage,
+replacing the "does dayplots/*.png or shake_data/*.mseed exist" heuristics.
+
+One SQLite file (processing_manifest.sqlite) with a row per (stage, day):
+    status        done | partial | failed | empty | pending | forced | stale
+    rows          samples fetched / amplitude rows / 1 for a PNG
+    checksum      CRC-32 of the product (hex)
+    gap_fraction  share of the day that was zero-filled when fetched
+    version       STAGE_VERSIONS[stage] at the time it ran
+    updated       UTC timestamp of the last change
+
+'done' and 'empty' (the day had no data for the stage) are final; an empty
+day is only planned again when a later fetch of it gains data, which forces
+its stages (AfetchData), or with --force.
+
+Planning never walks the whole history in Python:
+- plan() counts the stage's rows in the range (one index scan) and lists
+  the days only when some are missing, e.g. beyond the last run or holes
+  left by force(days=...) and record() past the end;
+- so the work for a stage is its non-'done' rows (partial index) plus the
+  days without a row, i.e. O(pending).
+
+A stage the manifest has never seen adopts existing products once through
+an is_done(day) check (the old file heuristics), like open_store() imports
+the legacy CSV. Bumping STAGE_VERSIONS marks that stage's rows stale once.
+
+The stages table keeps each stage's version and, the first time the stage
+is seen, the day after the last day any other stage had done (`since`).
+For a product added to a running pipeline (NO_BACKFILL), days before it
+count as done, so the history is not re-downloaded for it.
+
+The chunks table tracks the fetch requests of days that are not complete
+yet ('ok' or 'missing', with the number of attempts), so AfetchData only
+re-requests the missing intervals.
+
+Usage:
+    python processingManifest.py                          # pending work per stage
+    python processingManifest.py --force dayplot 2025-06-02 2025-06-03
+    python processingManifest.py --force amplitude --from 2025-06-01 --to 2025-07-01
+"""
+
+import argparse
+import sqlite3
+import threading
+import zlib
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+from amplitudeStore import LEGACY_CSV, STORE_DIR, open_store, to_epoch_seconds
+from dayplotStore import DayplotStore
+
+# -----------------------
+# Config
+# -----------------------
+MANIFEST_FILE = Path("processing_manifest.sqlite")
+STAGE_VERSIONS = {            # bump a version to re-run that stage for every day
+    "fetch": "1",
+    "amplitude": "1",
+    "dayplot": "1",
+    "spectrogram": "1",
+}
+PROCESSING_STAGES = ("amplitude", "dayplot", "spectrogram")   # stages that need the fetched waveform
+DONE = "done"
+EMPTY = "empty"               # no data for the stage; final like DONE
+PARTIAL = "partial"           # fetched with chunks still missing; re-requested later
+DAYPLOT_DIR = Path("dayplots")
+DAYPLOT_PATTERN = "AM_RF90E_EHZ_{date}_5-40Hz.png"  # legacy PNG name, set per station by stationRunner.configure()
+SPECTROGRAM_DIR = Path("spectrograms")
+NO_BACKFILL = ("spectrogram",)   # days before the stage's first run count as done; backfill with --force
+# -----------------------
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    stage        TEXT NOT NULL,
+    day          TEXT NOT NULL,
+    status       TEXT NOT NULL,
+    rows         INTEGER,
+    checksum     TEXT,
+    gap_fraction REAL,
+    version      TEXT,
+    updated      TEXT NOT NULL,
+    PRIMARY KEY (stage, day)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS runs_open ON runs (stage, day) WHERE status != 'done';
+CREATE TABLE IF NOT EXISTS chunks (
+    day      TEXT NOT NULL,
+    start    TEXT NOT NULL,
+    status   TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    updated  TEXT NOT NULL,
+    PRIMARY KEY (day, start)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stages (
+    stage   TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    since   TEXT
+);
+"""
+
+
+def checksum(data):
+    """CRC-32 (8 hex digits) of bytes or an array's buffer."""
+    return f"{zlib.crc32(memoryview(data).cast('B')) & 0xFFFFFFFF:08x}"
+
+
+def file_checksum(path):
+    return checksum(Path(path).read_bytes())
+
+
+def _iso(day):
+    return day if isinstance(day, str) else day.isoformat()
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def amplitude_exists(day, store=None):
+    """
+    Pre-manifest check: the amplitude store already has rows for the day.
+    The store is opened with open_store(), so a legacy CSV is imported
+    first: the fetch stage plans before the amplitude stage runs.
+    """
+    if store is None:                 # an empty store is falsy (__len__)
+        store = open_store(STORE_DIR, LEGACY_CSV)
+    t0 = int(to_epoch_seconds([day])[0])
+    times, _ = store.load(start=t0, end=t0 + 86400, columns=())
+    return len(times) > 0
+
+
+def dayplot_exists(day):
+    """Pre-manifest check: the day is in the dayplot index, or its legacy PNG in dayplots/."""
+    return ((DAYPLOT_DIR / DAYPLOT_PATTERN.format(date=day)).exists()
+            or day in DayplotStore(DAYPLOT_DIR).days())
+
+
+def spectrogram_exists(day):
+    """Pre-manifest check: the day's spectrogram tile exists."""
+    return (SPECTROGRAM_DIR / f"{day}.u8.gz").exists()
+
+
+ADOPT = {"amplitude": amplitude_exists, "dayplot": dayplot_exists, "spectrogram": spectrogram_exists}
+
+
+class Manifest:
+    """
+    Per-(stage, day) processing status in SQLite. One connection, shared by
+    the fetch threads and the main thread under a lock.
+    """
+
+    def __init__(self, path=MANIFEST_FILE):
+        self.path = Path(path)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        if "since" not in {row[1] for row in self.db.execute("PRAGMA table_info(stages)")}:
+            # Manifests from before `since`: days the stage processed itself
+            # (rows set; adopted days have none) start where it was added
+            self.db.execute("ALTER TABLE stages ADD COLUMN since TEXT")
+            self.db.execute("UPDATE stages SET since = (SELECT MIN(day) FROM runs WHERE "
+                            "runs.stage = stages.stage AND rows IS NOT NULL)")
+        self.db.commit()
+        self._since = {}
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _query(self, sql, args=()):
+        with self.lock:
+            return self.db.execute(sql, args).fetchall()
+
+    def _write(self, sql, args=(), many=False):
+        with self.lock:
+            cur = self.db.executemany(sql, args) if many else self.db.execute(sql, args)
+            self.db.commit()
+            return cur.rowcount
+
+    # ---------------- Single day ----------------
+    def get(self, stage, day):
+        """Row for (stage, day) as a dict, or None if never recorded."""
+        rows = self._query(
+            "SELECT status, rows, checksum, gap_fraction, version, updated "
+            "FROM runs WHERE stage = ? AND day = ?", (stage, _iso(day)))
+        if not rows:
+            return None
+        return dict(zip(("status", "rows", "checksum", "gap_fraction", "version", "updated"), rows[0]))
+
+    def record(self, stage, day, status=DONE, rows=None, checksum=None, gap_fraction=None):
+        self._write("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (stage, _iso(day), status, rows, checksum, gap_fraction,
+                     STAGE_VERSIONS.get(stage), _now()))
+
+    def is_done(self, stage, day, adopt=None):
+        """
+        True if (stage, day) is done. A day without a row is checked once
+        with adopt(day) and recorded, so the heuristic never runs twice.
+        """
+        row = self.get(stage, day)
+        if row is not None:
+            return row["status"] in (DONE, EMPTY)
+        adopt = self._adopt(stage, adopt)
+        if adopt is not None and adopt(_iso(day)):
+            self.record(stage, day, DONE)
+            return True
+        return False
+
+    # ---------------- Fetch chunks ----------------
+    def chunks(self, day):
+        """{chunk start (ISO): (status, attempts)} of a day being fetched."""
+        return {start: (status, attempts) for start, status, attempts in self._query(
+            "SELECT start, status, attempts FROM chunks WHERE day = ?", (_iso(day),))}
+
+    def record_chunk(self, day, start, status):
+        """Log one chunk request ('ok' or 'missing'); attempts count every request."""
+        self._write(
+            "INSERT INTO chunks VALUES (?, ?, ?, 1, ?) ON CONFLICT (day, start) DO UPDATE "
+            "SET status = excluded.status, attempts = attempts + 1, updated = excluded.updated",
+            (_iso(day), str(start), status, _now()))
+
+    def drop_chunks(self, day):
+        """Forget a day's chunks once it will not be fetched again."""
+        self._write("DELETE FROM chunks WHERE day = ?", (_iso(day),))
+
+    # ---------------- Planning ----------------
+    def extent(self, stage):
+        """(first, last) day with a row for the stage; (None, None) if none."""
+        return self._query("SELECT MIN(day), MAX(day) FROM runs WHERE stage = ?", (stage,))[0]
+
+    def pending(self, stage, start=None, end=None, status=None):
+        """Recorded days (start <= day < end) not 'done' or 'empty' (or with `status`), sorted."""
+        sql = "SELECT day FROM runs WHERE stage = ? AND status != 'done' AND status != 'empty'"
+        args = [stage]
+        if status is not None:
+            sql += " AND status = ?"
+            args.append(status)
+        if start is not None:
+            sql += " AND day >= ?"
+            args.append(_iso(start))
+        if end is not None:
+            sql += " AND day < ?"
+            args.append(_iso(end))
+        return [d for (d,) in self._query(sql + " ORDER BY day", args)]
+
+    def plan(self, stage, start, end, is_done=None):
+        """
+        Days in [start, end) the stage still has to process, as ISO strings.
+        Days without a row are registered here (adopted as done if
+        is_done(day) says the product already exists).
+        """
+        self._check_version(stage)
+        is_done = self._adopt(stage, is_done)
+        start = date.fromisoformat(_iso(start))
+        end = date.fromisoformat(_iso(end))
+
+        # Rows can sit anywhere (force(days=...), record()), so holes are
+        # found by counting: one index range scan, days listed only if short
+        (have,), = self._query("SELECT COUNT(*) FROM runs WHERE stage = ? AND day >= ? AND day < ?",
+                               (stage, start.isoformat(), end.isoformat()))
+        new_rows = []
+        if have < (end - start).days:
+            known = {d for (d,) in self._query(
+                "SELECT day FROM runs WHERE stage = ? AND day >= ? AND day < ?",
+                (stage, start.isoformat(), end.isoformat()))}
+            day = start
+            while day < end:
+                if day.isoformat() not in known:
+                    status = DONE if is_done is not None and is_done(day.isoformat()) else "pending"
+                    new_rows.append((stage, day.isoformat(), status, None, None, None,
+                                     STAGE_VERSIONS.get(stage), _now()))
+                day += timedelta(days=1)
+        if new_rows:
+            self._write("INSERT OR IGNORE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)", new_rows, many=True)
+        return self.pending(stage, start, end)
+
+    def plan_fetch(self, start, end):
+        """
+        Days in [start, end) to download, sorted: those a processing stage
+        still needs, plus partially fetched days whose missing chunks are due
+        another request.
+        """
+        days = set(self.pending("fetch", start, end, status=PARTIAL))
+        for stage in PROCESSING_STAGES:
+            days.update(self.plan(stage, start, end, is_done=ADOPT.get(stage)))
+        return sorted(days)
+
+    def force(self, stage, days=None, start=None, end=None):
+        """Mark days (a list, or the range start <= day < end) to be re-run; returns the count."""
+        if days is not None:
+            days = [_iso(d) for d in days]
+            # Days the manifest has not seen yet get a row too
+            self._write("INSERT OR IGNORE INTO runs (stage, day, status, updated) VALUES (?, ?, 'forced', ?)",
+                        [(stage, d, _now()) for d in days], many=True)
+            self._write("UPDATE runs SET status = 'forced', updated = ? WHERE stage = ? AND day = ?",
+                        [(_now(), stage, d) for d in days], many=True)
+            return len(days)
+
+        sql = "UPDATE runs SET status = 'forced', updated = ? WHERE stage = ?"
+        args = [_now(), stage]
+        if start is not None:
+            sql += " AND day >= ?"
+            args.append(_iso(start))
+        if end is not None:
+            sql += " AND day < ?"
+            args.append(_iso(end))
+        return self._write(sql, args)
+
+    def since(self, stage):
+        """
+        First day the stage handles itself: the day after the last day any
+        other stage had done when it was first seen ('' if none had, i.e.
+        every day). Recorded in the stages table on the first call.
+        """
+        if stage not in self._since:
+            rows = self._query("SELECT since FROM stages WHERE stage = ?", (stage,))
+            if rows and rows[0][0] is not None:
+                self._since[stage] = rows[0][0]
+            else:
+                (last,), = self._query("SELECT MAX(day) FROM runs WHERE stage != ? AND status = ?",
+                                       (stage, DONE))
+                since = (date.fromisoformat(last) + timedelta(days=1)).isoformat() if last else ""
+                self._write("INSERT INTO stages VALUES (?, ?, ?) ON CONFLICT (stage) "
+                            "DO UPDATE SET since = excluded.since",
+                            (stage, STAGE_VERSIONS.get(stage, ""), since))
+                self._since[stage] = since
+        return self._since[stage]
+
+    def _adopt(self, stage, adopt):
+        # Days before a NO_BACKFILL stage's first run count as done
+        if stage not in NO_BACKFILL:
+            return adopt
+        since = self.since(stage)
+        return lambda day: day < since or (adopt is not None and adopt(day))
+
+    def _check_version(self, stage):
+        # One lookup per run; a changed version marks the stage's history stale once
+        version = STAGE_VERSIONS.get(stage)
+        if version is None:
+            return
+        rows = self._query("SELECT version FROM stages WHERE stage = ?", (stage,))
+        if rows and rows[0][0] != version:
+            n = self._write("UPDATE runs SET status = 'stale' WHERE stage = ? AND status = 'done'", (stage,))
+            print(f"[INFO] {stage} version {rows[0][0]} → {version}: {n} days marked stale")
+        self._write("INSERT INTO stages (stage, version) VALUES (?, ?) ON CONFLICT (stage) "
+                    "DO UPDATE SET version = excluded.version", (stage, version))
+
+    def summary(self):
+        """{stage: {status: count}}."""
+        out = {}
+        for stage, status, n in self._query(
+                "SELECT stage, status, COUNT(*) FROM runs GROUP BY stage, status ORDER BY stage"):
+            out.setdefault(stage, {})[status] = n
+        return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--force", metavar="STAGE", help="mark days of STAGE to be re-run")
+    parser.add_argument("days", nargs="*", help="YYYY-MM-DD days for --force")
+    parser.add_argument("--from", dest="start", help="first day for --force (inclusive)")
+    parser.add_argument("--to", dest="end", help="last day for --force (exclusive)")
+    args = parser.parse_args()
+
+    with Manifest() as manifest:
+        if args.force:
+            if args.days:
+                n = manifest.force(args.force, days=args.days)
+            else:
+                n = manifest.force(args.force, start=args.start, end=args.end)
+            print(f"[OK] {n} {args.force} day(s) marked for re-run")
+            return
+
+        summary = manifest.summary()
+        if not summary:
+            print(f"[INFO] {MANIFEST_FILE} is empty.")
+        for stage, counts in summary.items():
+            parts = ", ".join(f"{status}: {n}" for status, n in sorted(counts.items()))
+            print(f"{stage:<10} {parts}")
+            for day in manifest.pending(stage)[:10]:
+                print(f"    pending {day}")
+
+
+if __name__ == "__main__":
+    main()
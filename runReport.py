@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Structured run reports for the pipeline scripts.
+
+Every script's main() runs inside `with runReport.run("<script>"):` and the
+work per stage and day inside `with runReport.span(stage, day) as rec:`.
+A span measures wall time, CPU time of its thread and the peak RSS of the
+process, collects counters reported by the code it wraps
+(runReport.count(bytes=..., retries=1)) and keeps the fields set on `rec`
+(rows, status, ...). Every finished span is one JSON line in REPORT_FILE;
+the run ends with a per-stage summary line, which is also printed.
+
+Counters:
+    bytes      MiniSEED bytes downloaded
+    requests   FDSN requests sent (retries included)
+    retries    failed requests that were retried
+    throttled  429 / rate-limit responses among them
+    wait_s     seconds spent waiting on the rate limiter and on backoff
+
+Runs nest: under stationRunner, the scripts' runs join the station's run.
+Without an active run (the modules imported elsewhere, pool workers) spans
+only measure and nothing is written; measure() returns the same numbers as
+a dict for work done in other processes, which finish() adds to the report.
+
+Hot-path investigation, switched on by environment variables:
+    PIPELINE_PROFILE=1       cProfile the run; stats go to PROFILE_FILE (or to
+                             the variable's value if it is a path) and the top
+                             PROFILE_TOP functions are printed
+    PIPELINE_TRACEMALLOC=1   trace allocations; spans add py_peak_mb, the peak
+                             of Python/numpy allocations during the span
+
+Usage:
+    python runReport.py          # summary of the last run in REPORT_FILE
+    python runReport.py --all    # summary of every run
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+# ---------------- CONFIG ----------------
+REPORT_FILE = Path("run_report.jsonl")
+PROFILE_FILE = Path("run_profile.prof")
+PROFILE_TOP = 25                     # functions printed from the profile
+PROFILE_ENV = "PIPELINE_PROFILE"
+TRACEMALLOC_ENV = "PIPELINE_TRACEMALLOC"
+# ----------------------------------------
+
+SUMMED = ("wall_s", "cpu_s", "rows", "bytes", "requests", "retries", "throttled", "wait_s")
+PEAKS = ("rss_peak_mb", "py_peak_mb")
+
+_active = None
+_local = threading.local()
+
+
+def peak_rss_mb():
+    """Peak RSS of this process in MiB."""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10   # bytes on macOS, KiB elsewhere
+
+
+def merge(into, fields):
+    """Add one span's fields to a record: counters summed, peaks maxed, the rest overwritten."""
+    for key, value in fields.items():
+        if key in SUMMED and isinstance(value, (int, float)):
+            into[key] = round(into.get(key, 0) + value, 4)
+        elif key in PEAKS:
+            into[key] = max(into.get(key, 0), value)
+        else:
+            into[key] = value
+    return into
+
+
+@contextmanager
+def measure():
+    """Wall time, thread CPU time and peak memory of the block, filled into the yielded dict on exit."""
+    m = {}
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield m
+    finally:
+        m["wall_s"] = round(time.perf_counter() - wall, 4)
+        m["cpu_s"] = round(time.thread_time() - cpu, 4)
+        m["rss_peak_mb"] = round(peak_rss_mb(), 1)
+        if tracing:
+            m["py_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+
+
+class RunReport:
+    """JSONL report of one run; spans of the same (stage, day) add up until finished."""
+
+    def __init__(self, script, path=REPORT_FILE):
+        self.id = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+        self.script = script
+        self.path = Path(path)
+        self.started = time.perf_counter()
+        self.open = {}      # (stage, day) -> fields of spans not finished yet
+        self.records = []   # finished stage records
+        self.lock = threading.Lock()
+        self.file = open(self.path, "a", encoding="utf-8")
+        self._write({"type": "run", "script": script,
+                     "started": time.strftime("%Y-%m-%dT%H:%M:%S"), "pid": os.getpid()})
+
+    def _write(self, rec):
+        with self.lock:
+            self.file.write(json.dumps({"run": self.id, **rec}) + "\n")
+            self.file.flush()
+
+    def add(self, stage, day, fields):
+        with self.lock:
+            merge(self.open.setdefault((stage, day), {"stage": stage, "day": day}), fields)
+
+    def finish(self, stage, day, fields):
+        with self.lock:
+            rec = merge(self.open.pop((stage, day), {"stage": stage, "day": day}), fields)
+            self.records.append(rec)
+        self._write({"type": "stage", **rec})
+
+    def close(self):
+        """Finish spans that never completed, write and print the summary."""
+        for stage, day in list(self.open):
+            self.finish(stage, day, {"status": "unfinished"})
+        summary = {"type": "summary", "script": self.script,
+                   "wall_s": round(time.perf_counter() - self.started, 2),
+                   "rss_peak_mb": round(peak_rss_mb(), 1),
+                   "stages": summarize(self.records)}
+        self._write(summary)
+        self.file.close()
+        print_summary(self.id, summary, self.path)
+
+
+def summarize(records):
+    """Per-stage totals of stage records: days, summed counters and times, max peaks."""
+    stages = {}
+    for rec in records:
+        total = stages.setdefault(rec["stage"], {"days": 0})
+        total["days"] += 1
+        merge(total, {k: v for k, v in rec.items() if k in SUMMED or k in PEAKS})
+    return stages
+
+
+def print_summary(run_id, summary, path=REPORT_FILE):
+    print(f"\n[REPORT] {summary.get('script', '')} run {run_id}: {summary.get('wall_s', 0):.1f} s, "
+          f"peak RSS {summary.get('rss_peak_mb', 0):.0f} MiB → {path}")
+    stages = summary["stages"]
+    if not stages:
+        return
+    print(f"  {'stage':<12}{'days':>6}{'wall s':>10}{'cpu s':>10}{'rows':>10}{'MB':>9}"
+          f"{'retries':>9}{'429':>6}{'wait s':>9}{'peak MiB':>10}")
+    for stage, t in stages.items():
+        print(f"  {stage:<12}{t['days']:>6}{t.get('wall_s', 0):>10.1f}{t.get('cpu_s', 0):>10.1f}"
+              f"{t.get('rows', 0):>10}{t.get('bytes', 0) / 1e6:>9.1f}{t.get('retries', 0):>9}"
+              f"{t.get('throttled', 0):>6}{t.get('wait_s', 0):>9.1f}{t.get('rss_peak_mb', 0):>10.0f}")
+
+
+# ---------------- API used by the scripts ----------------
+@contextmanager
+def run(script):
+    """Report the enclosed run; joins the active run if there is one."""
+    global _active
+    if _active is not None:
+        yield _active
+        return
+
+    profile = os.environ.get(PROFILE_ENV)
+    profiler = cProfile.Profile() if profile else None
+    started_tracing = bool(os.environ.get(TRACEMALLOC_ENV)) and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+
+    _active = RunReport(script)
+    if profiler:
+        profiler.enable()
+    try:
+        yield _active
+    finally:
+        if profiler:
+            profiler.disable()
+        report, _active = _active, None
+        report.close()
+        if profiler:
+            out = PROFILE_FILE if profile == "1" else Path(profile)
+            profiler.dump_stats(out)
+            print(f"[REPORT] cProfile stats written to {out}")
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        if started_tracing:
+            tracemalloc.stop()
+
+
+@contextmanager
+def span(stage, day=None, finish=True, **fields):
+    """
+    Measure one stage for one day (or the whole run, day=None). Fields set on
+    the yielded dict and counters reported inside go into its record.
+    finish=False keeps adding to the record until finish() (e.g. the chunk
+    requests of a day, from several threads).
+    """
+    rec = dict(fields)
+    counters = {}
+    stack = _local.__dict__.setdefault("stack", [])
+    stack.append(counters)
+    try:
+        with measure() as m:
+            yield rec
+    except BaseException:
+        rec.setdefault("status", "error")
+        raise
+    finally:
+        stack.pop()
+        report = _active
+        if report is not None:
+            fields = {**rec, **m, **counters}
+            if finish:
+                report.finish(stage, day, fields)
+            else:
+                report.add(stage, day, fields)
+
+
+def count(**counters):
+    """Add counters to the innermost span of this thread (no-op outside spans)."""
+    stack = getattr(_local, "stack", None)
+    if stack:
+        top = stack[-1]
+        for key, value in counters.items():
+            top[key] = top.get(key, 0) + value
+
+
+def finish(stage, day=None, **fields):
+    """
+    Close the record of spans opened with finish=False, or add one measured
+    elsewhere (e.g. measure() in a pool worker).
+    """
+    if _active is not None:
+        _active.finish(stage, day, fields)
+
+
+def main():
+    if not REPORT_FILE.exists():
+        print(f"No report at {REPORT_FILE}.")
+        return
+    runs = {}
+    with open(REPORT_FILE, encoding="utf-8") as f:
+        for line in f:
+            rec = json.loads(line)
+            runs.setdefault(rec["run"], []).append(rec)
+    for run_id in (list(runs) if "--all" in sys.argv[1:] else list(runs)[-1:]):
+        recs = runs[run_id]
+        summary = next((r for r in recs if r["type"] == "summary"), None)
+        if summary is None:   # run did not end (killed): summarize what it wrote
+            start = next((r for r in recs if r["type"] == "run"), {})
+            summary = {"script": start.get("script", "") + " (unfinished)",
+                       "stages": summarize([r for r in recs if r["type"] == "stage"])}
+        print_summary(run_id, summary)
+
+
+if __name__ == "__main__":
+    main()
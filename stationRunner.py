@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Run the whole pipeline (fetch → amplitude profile + dayplots → activity
+curves → tremor detector) for every station-channel in stations.json,
+several at a time.
+
+Registry entries:
+    network, station, location, channel   FDSN identifiers (required)
+    output_dir        namespace for everything the pipeline writes: shake_data,
+                      dayplots, amplitude_store, manifest, activity CSV, ...
+                      Default: stations/<NET>.<STA>.<LOC>.<CHA>; "." keeps the
+                      original station's files where the dashboard reads them.
+    start_date        first UTC day to fetch (default AfetchData.START_DATE_UTC)
+    rate_limit_per_sec, fetch_workers
+                      per-station FDSN budget (defaults from AfetchData)
+
+Every station runs in its own process of one shared pool (STATION_WORKERS),
+inside its output_dir, so the scripts' relative paths become per-station
+namespaces and their module settings (CHANNEL, ...) never clash. Each
+station keeps its own token bucket, so adding stations does not raise any
+single station's request rate. The log of a station goes to
+<output_dir>/pipeline.log, and the scripts' run report covers the whole
+station run in <output_dir>/run_report.jsonl (see runReport.py).
+
+Usage:
+    python stationRunner.py                  # every station in stations.json
+    python stationRunner.py AM.RF90E.00.EHZ  # only the given ones
+"""
+
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout, redirect_stderr
+from pathlib import Path
+
+import AfetchData as fetch
+import BmakeKavachiNoiseProfile as amplitude
+import CsaveActivityCurves as activity
+import DsaveDayplots as dayplots
+import fusedPipeline
+import processingManifest
+import runReport
+import tremorDetector
+
+# ---------------- CONFIG ----------------
+REGISTRY = Path("stations.json")
+STATIONS_ROOT = Path("stations")     # parent of the default per-station output dirs
+STATION_WORKERS = min(4, os.cpu_count() or 1)  # stations processed at the same time
+LOG_NAME = "pipeline.log"
+ECHO_LOGS = True                     # copy each station's log of this run to stdout when it ends
+# ----------------------------------------
+
+# Module settings before any station was applied (workers are reused across stations)
+DEFAULTS = {
+    "start_date": fetch.START_DATE_UTC,
+    "rate_limit_per_sec": fetch.RATE_LIMIT_PER_SEC,
+    "fetch_workers": fetch.FETCH_WORKERS,
+}
+
+
+def station_id(entry):
+    return f"{entry['network']}.{entry['station']}.{entry['location']}.{entry['channel']}"
+
+
+def load_registry(path=REGISTRY):
+    """Station entries with output_dir resolved (absolute, relative to the registry)."""
+    if not Path(path).exists():
+        # No registry: the station configured in AfetchData, in place
+        return [{"network": fetch.NETWORK, "station": fetch.STATION, "location": fetch.LOCATION,
+                 "channel": fetch.CHANNEL, "output_dir": str(Path(".").resolve())}]
+
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)["stations"]
+    base = Path(path).resolve().parent
+    for entry in entries:
+        out = entry.get("output_dir") or str(STATIONS_ROOT / station_id(entry))
+        entry["output_dir"] = str((base / out).resolve())
+    return entries
+
+
+def configure(entry):
+    """Point the pipeline modules at one station (called inside its worker process)."""
+    fetch.NETWORK = entry["network"]
+    fetch.STATION = entry["station"]
+    fetch.LOCATION = entry["location"]
+    fetch.CHANNEL = entry["channel"]
+    fetch.START_DATE_UTC = entry.get("start_date", DEFAULTS["start_date"])
+    fetch.RATE_LIMIT_PER_SEC = entry.get("rate_limit_per_sec", DEFAULTS["rate_limit_per_sec"])
+    fetch.FETCH_WORKERS = entry.get("fetch_workers", DEFAULTS["fetch_workers"])
+    amplitude.CHANNEL = entry["channel"]
+    dayplots.CHANNEL = entry["channel"]
+    processingManifest.DAYPLOT_PATTERN = (
+        f"{entry['network']}_{entry['station']}_{entry['channel']}_{{date}}_5-40Hz.png")
+
+
+def share_cpus(workers):
+    """Pool initializer: split the CPUs between the stations running at the same time."""
+    amplitude.FFT_WORKERS = max(1, (os.cpu_count() or 1) // workers)
+
+
+def run_station(entry):
+    """Full pipeline for one station in its output_dir; returns (id, ok, seconds)."""
+    start = time.time()
+    out_dir = Path(entry["output_dir"])
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cwd = os.getcwd()
+    ok = True
+    with open(out_dir / LOG_NAME, "a", encoding="utf-8") as log, \
+            redirect_stdout(log), redirect_stderr(log):
+        print(f"\n===== {station_id(entry)} {time.strftime('%Y-%m-%d %H:%M:%S')} =====")
+        try:
+            os.chdir(out_dir)
+            configure(entry)
+            with runReport.run(f"station {station_id(entry)}"):
+                if fusedPipeline.STREAM_FROM_FETCH:
+                    fusedPipeline.main_streaming()
+                else:
+                    fetch.main()
+                    fusedPipeline.main()
+                activity.main()
+                tremorDetector.main()
+        except Exception as e:
+            print(f"[ERROR] {station_id(entry)}: {e!r}")
+            ok = False
+        finally:
+            os.chdir(cwd)
+    return station_id(entry), ok, time.time() - start
+
+
+def main():
+    entries = load_registry()
+    wanted = set(sys.argv[1:])
+    if wanted:
+        entries = [e for e in entries if station_id(e) in wanted]
+    if not entries:
+        print("No stations to process.")
+        return
+
+    workers = max(1, min(STATION_WORKERS, len(entries)))
+    print(f"[INFO] {len(entries)} station(s), {workers} at a time.\n")
+
+    logs = [Path(e["output_dir"]) / LOG_NAME for e in entries]
+    offsets = [log.stat().st_size if log.exists() else 0 for log in logs]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=share_cpus, initargs=(workers,)) as pool:
+        # One station's failure is logged and does not stop the others
+        for (sid, ok, seconds), log, offset in zip(pool.map(run_station, entries), logs, offsets):
+            if ECHO_LOGS:
+                with open(log, encoding="utf-8") as f:
+                    f.seek(offset)
+                    print(f.read())
+            print(f"[{'OK' if ok else 'ERROR'}] {sid} in {seconds:.0f} s — log: {log}")
+
+
+if __name__ == "__main__":
+    main()
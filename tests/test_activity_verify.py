@@ -0,0 +1,84 @@
+"""
+CsaveActivityCurves.verify_incremental() on a synthetic amplitude store:
+the incremental and the chunked modes stay within VERIFY_TOLERANCE of a
+full recompute, and a corrupted output is caught.
+
+    python -m pytest tests
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+import CsaveActivityCurves as activity  # noqa: E402
+from amplitudeCleaning import clean_store  # noqa: E402
+from amplitudeStore import AmplitudeStore  # noqa: E402
+from synthetic import make_minute_amplitudes  # noqa: E402
+
+DAYS = 60          # history of the full run
+NEW_DAYS = 5       # days added one incremental run at a time
+MINUTES = activity.MINUTES_PER_DAY
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """A cleaned store of DAYS days; outputs go to tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    times, amps = make_minute_amplitudes(DAYS + NEW_DAYS, seed=1)
+    s = AmplitudeStore(tmp_path / "amplitude_store")
+    s.append(times[:DAYS * MINUTES], amplitude=amps[:DAYS * MINUTES])
+    clean_store(s)
+    s.new_days = (times[DAYS * MINUTES:], amps[DAYS * MINUTES:])
+    return s
+
+
+def add_days(store):
+    """Append the remaining days one at a time, with an incremental run after each."""
+    times, amps = store.new_days
+    for d in range(NEW_DAYS):
+        day = slice(d * MINUTES, (d + 1) * MINUTES)
+        store.append(times[day], amplitude=amps[day])
+        clean_store(store)
+        activity.run_incremental(store, activity.load_state())
+
+
+def test_incremental_within_tolerance(store):
+    activity.run_full(store, chunked=False)
+    add_days(store)
+    assert activity.verify_incremental(store)
+
+
+def test_chunked_within_tolerance(store):
+    # DAYS spans two blocks of BLOCK_MINUTES
+    activity.run_full(store, chunked=True)
+    assert activity.verify_incremental(store)
+
+
+def test_deviation_is_caught(store):
+    activity.run_full(store, chunked=False)
+    df = pd.read_csv(activity.CSV_OUTPUT)
+    middle = len(df) // 2
+    df.loc[middle, "tremor_score_blue"] = np.clip(
+        df.loc[middle, "tremor_score_blue"] + 2 * activity.VERIFY_TOLERANCE, 0, None)
+    df.to_csv(activity.CSV_OUTPUT, index=False)
+    assert not activity.verify_incremental(store)
+
+
+def test_replaced_history_is_recomputed(store):
+    activity.run_full(store, chunked=False)
+    add_days(store)
+    # Re-process a day deep in the frozen history: same minutes, other values
+    times, cols = store.load(start=int(store.first_time()) + 10 * MINUTES * 60,
+                             end=int(store.first_time()) + 11 * MINUTES * 60)
+    store.append(times, replace=True, amplitude=cols["amplitude"] * 5)
+    assert store.replaced_from() == times[0]
+    clean_store(store)
+    activity.run_incremental(store, activity.load_state())
+    assert store.replaced_from() is None
+    assert activity.verify_incremental(store)
@@ -0,0 +1,30 @@
+"""
+BmakeKavachiNoiseProfile: the per-minute and the batched paths agree on a
+synthetic day with gaps and overlaps, and gap minutes are NaN in both.
+
+    python -m pytest tests
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+import BmakeKavachiNoiseProfile as amplitude  # noqa: E402
+from synthetic import write_day_file  # noqa: E402
+
+
+def test_gap_minutes_are_nan_in_both_paths(tmp_path):
+    path = write_day_file(tmp_path, defects=True)
+    legacy = amplitude.process_miniseed_file_in_chunks(path)
+    batched = amplitude.process_miniseed_file_batched(path)
+    assert [r["time"] for r in legacy] == [r["time"] for r in batched]
+
+    legacy = np.array([r["amplitude"] for r in legacy])
+    batched = np.array([r["amplitude"] for r in batched])
+    assert np.isnan(legacy).any()
+    np.testing.assert_array_equal(np.isnan(legacy), np.isnan(batched))
+    np.testing.assert_allclose(legacy, batched, rtol=1e-6)
@@ -0,0 +1,101 @@
+"""
+amplitudeStore: appends that dedupe and replace across month partitions,
+loads by time and by row, new columns and the legacy CSV import.
+
+    python -m pytest tests
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+from amplitudeStore import AmplitudeStore, open_store, to_epoch_seconds  # noqa: E402
+
+# Three days across the June / July boundary
+START = int(to_epoch_seconds(["2025-06-29T00:00:00Z"])[0])
+TIMES = START + 60 * np.arange(3 * 1440, dtype=np.int64)
+AMPS = np.arange(TIMES.size, dtype=np.float32)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AmplitudeStore(tmp_path / "amplitude_store")
+
+
+def test_append_splits_months(store):
+    assert store.append(TIMES, amplitude=AMPS) == TIMES.size
+    assert [p.name for p in store.partitions()] == ["2025-06", "2025-07"]
+    assert len(store) == TIMES.size
+    assert (store.first_time(), store.last_time()) == (TIMES[0], TIMES[-1])
+
+    times, cols = store.load()
+    np.testing.assert_array_equal(times, TIMES)
+    np.testing.assert_array_equal(cols["amplitude"], AMPS)
+
+
+def test_append_dedupes_across_partitions(store):
+    # Unsorted, with duplicates inside the input: first occurrence wins
+    half = TIMES.size // 2
+    store.append(TIMES[:half][::-1], amplitude=AMPS[:half][::-1])
+    added = store.append(np.r_[TIMES, TIMES[-5:]], amplitude=np.r_[AMPS + 1000, np.zeros(5, np.float32)])
+    assert added == TIMES.size - half
+
+    times, cols = store.load()
+    np.testing.assert_array_equal(times, TIMES)
+    np.testing.assert_array_equal(cols["amplitude"], np.r_[AMPS[:half], AMPS[half:] + 1000])
+    assert store.replaced_from() is None
+
+
+def test_replace_overwrites_across_partitions(store):
+    store.append(TIMES, amplitude=AMPS)
+    # The last day of June and the first of July, processed again
+    sel = slice(1440, 3 * 1440 - 1440 // 2)
+    assert store.append(TIMES[sel], replace=True, amplitude=AMPS[sel] * 2) == 0
+
+    times, cols = store.load()
+    expected = AMPS.copy()
+    expected[sel] *= 2
+    np.testing.assert_array_equal(cols["amplitude"], expected)
+    # The first changed value; AMPS[1440] * 2 differs from AMPS[1440]
+    assert store.replaced_from() == TIMES[1440]
+
+
+def test_replace_with_same_values_keeps_watermark(store):
+    store.append(TIMES, amplitude=AMPS)
+    store.append(TIMES, replace=True, amplitude=AMPS)
+    assert store.replaced_from() is None
+
+
+def test_new_column_is_nan_for_older_rows(store):
+    store.append(TIMES[:1440], amplitude=AMPS[:1440])
+    store.append(TIMES[1440:], amplitude=AMPS[1440:], quality=np.ones(TIMES.size - 1440))
+    times, cols = store.load(columns=("amplitude", "quality"))
+    assert np.isnan(cols["quality"][:1440]).all()
+    assert (cols["quality"][1440:] == 1).all()
+
+
+def test_load_by_time_and_by_row(store):
+    store.append(TIMES, amplitude=AMPS)
+    start, end = TIMES[1000], TIMES[3000]
+    times, cols = store.load(start=start, end=end)
+    np.testing.assert_array_equal(times, TIMES[1000:3000])
+
+    times, cols = store.load_rows(1000, 3000)
+    np.testing.assert_array_equal(times, TIMES[1000:3000])
+    np.testing.assert_array_equal(cols["amplitude"], AMPS[1000:3000])
+
+
+def test_open_store_imports_legacy_csv_once(tmp_path):
+    csv = tmp_path / "mean_amplitudes.csv"
+    iso = pd.to_datetime(TIMES[:100], unit="s", utc=True).strftime("%Y-%m-%dT%H:%M:%SZ")
+    pd.DataFrame({"time": iso, "amplitude": AMPS[:100]}).to_csv(csv, index=False)
+
+    store = open_store(tmp_path / "amplitude_store", csv)
+    assert len(store) == 100
+    csv.write_text("time,amplitude\n")
+    assert len(open_store(tmp_path / "amplitude_store", csv)) == 100
@@ -0,0 +1,89 @@
+"""
+amplitudeCleaning: Hampel despiking, gap filling and incremental cleaning
+of the store.
+
+    python -m pytest tests
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+import amplitudeCleaning as cleaning  # noqa: E402
+from amplitudeCleaning import (  # noqa: E402
+    clean, clean_store, hampel, QUALITY_OK, QUALITY_SPIKE, QUALITY_GAP, QUALITY_MISSING)
+from amplitudeStore import AmplitudeStore  # noqa: E402
+from synthetic import make_minute_amplitudes  # noqa: E402
+
+MINUTES = 1440
+
+
+@pytest.fixture
+def day():
+    times, amps = make_minute_amplitudes(1, seed=3)
+    return times, amps.astype(np.float64)
+
+
+def test_hampel_flags_only_spikes():
+    rng = np.random.default_rng(0)
+    values = rng.uniform(-0.05, 0.05, 1000)
+    values[[100, 500, 501]] += 2.0
+    assert np.flatnonzero(hampel(values)).tolist() == [100, 500, 501]
+
+
+def test_hampel_ignores_flat_stretches():
+    # MIN_MAD keeps a constant series with tiny steps from being all outliers
+    values = np.r_[np.zeros(200), np.full(200, 0.005)]
+    assert not hampel(values).any()
+
+
+def test_spikes_are_interpolated(day):
+    times, amps = day
+    raw = amps.copy()
+    raw[[200, 900]] *= 1000
+    cleaned, quality = clean(times, raw)
+    _, before = clean(times, amps)
+    # The synthetic series has spikes of its own
+    assert np.flatnonzero((quality == QUALITY_SPIKE) & (before != QUALITY_SPIKE)).tolist() == [200, 900]
+    # Log-linear between the neighbours
+    np.testing.assert_allclose(cleaned[200], np.sqrt(amps[199] * amps[201]), rtol=1e-6)
+    np.testing.assert_array_equal(cleaned[quality == QUALITY_OK], amps[quality == QUALITY_OK])
+
+
+def test_short_gaps_filled_long_gaps_kept(day):
+    times, amps = day
+    raw = amps.copy()
+    raw[100:110] = np.nan
+    raw[300:305] = 0.0                                   # zero-filled data
+    raw[600:600 + cleaning.MAX_INTERP_MINUTES + 1] = np.nan
+    cleaned, quality = clean(times, raw)
+
+    assert (quality[100:110] == QUALITY_GAP).all() and np.isfinite(cleaned[100:110]).all()
+    assert (quality[300:305] == QUALITY_GAP).all() and np.isfinite(cleaned[300:305]).all()
+    long_gap = slice(600, 600 + cleaning.MAX_INTERP_MINUTES + 1)
+    assert (quality[long_gap] == QUALITY_MISSING).all() and np.isnan(cleaned[long_gap]).all()
+
+
+def test_clean_store_matches_full_clean(tmp_path):
+    times, amps = make_minute_amplitudes(5, seed=4)
+    amps[3 * MINUTES + 17] *= 1000
+    store = AmplitudeStore(tmp_path / "amplitude_store")
+    store.append(times[:3 * MINUTES], amplitude=amps[:3 * MINUTES])
+    assert clean_store(store) == 3 * MINUTES
+    assert clean_store(store) == 0
+
+    # New days are cleaned with CLEAN_CONTEXT_MINUTES of look-back, not from the start
+    store.append(times[3 * MINUTES:], amplitude=amps[3 * MINUTES:])
+    written = clean_store(store)
+    assert written < 3 * MINUTES
+
+    _, cols = store.load(columns=(cleaning.CLEAN_COLUMN, cleaning.QUALITY_COLUMN))
+    expected, quality = clean(times, amps)
+    np.testing.assert_array_equal(cols[cleaning.QUALITY_COLUMN], quality)
+    np.testing.assert_allclose(cols[cleaning.CLEAN_COLUMN], expected, rtol=1e-6)
+    assert cols[cleaning.QUALITY_COLUMN][3 * MINUTES + 17] == QUALITY_SPIKE
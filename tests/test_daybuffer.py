@@ -0,0 +1,98 @@
+"""
+mseedDayBuffer: read_day() against obspy's read() + merge(), corrupt
+records and junk bytes costing only themselves (bisection), and the
+fallback used when obspy's private MiniSEED internals are missing.
+
+    python -m pytest tests
+"""
+
+import io
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from obspy import read, Stream
+from obspy.io.mseed import InternalMSEEDError
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+import mseedDayBuffer  # noqa: E402
+from mseedDayBuffer import DayBuffer, read_day  # noqa: E402
+from synthetic import make_day_trace, write_day_file, CHANNEL  # noqa: E402
+
+RECLEN = 512                 # as the Raspberry Shake servers deliver it
+
+
+@pytest.fixture
+def day_file(tmp_path):
+    return write_day_file(tmp_path, defects=True)
+
+
+def obspy_day(path):
+    st = read(str(path))
+    st.merge(method=1)
+    return st.select(channel=CHANNEL)[0]
+
+
+def test_matches_obspy_merge(day_file):
+    tr = read_day(day_file, CHANNEL, masked=True)
+    ref = obspy_day(day_file)
+    assert tr.stats.starttime == ref.stats.starttime
+    n = ref.stats.npts
+    np.testing.assert_array_equal(np.ma.getmaskarray(tr.data)[:n], np.ma.getmaskarray(ref.data))
+    np.testing.assert_array_equal(tr.data[:n].compressed(), ref.data.compressed())
+
+
+def test_fallback_without_obspy_internals(day_file, monkeypatch):
+    expected = read_day(day_file, CHANNEL)
+    monkeypatch.setattr(mseedDayBuffer, "_read_mseed", None)
+    tr = read_day(day_file, CHANNEL)
+    np.testing.assert_array_equal(tr.data, expected.data)
+    assert tr.stats.gap_spans == expected.stats.gap_spans
+
+
+@pytest.fixture(scope="module")
+def records():
+    """A plain synthetic day as (trace, MiniSEED bytes in RECLEN records)."""
+    tr = make_day_trace()
+    buf = io.BytesIO()
+    Stream([tr]).write(buf, format="MSEED", reclen=RECLEN, encoding="STEIM2")
+    return tr, buf.getvalue()
+
+
+# First record, both sides of a slice boundary, the middle and the last record
+PER_SLICE = mseedDayBuffer.SLICE_BYTES // RECLEN
+
+
+@pytest.mark.parametrize("k", [0, PER_SLICE - 1, PER_SLICE, 10 * PER_SLICE + 7, -1])
+def test_corrupt_record_costs_only_itself(records, k):
+    tr, data = records
+    k %= len(data) // RECLEN
+    bad = bytearray(data)
+    bad[k * RECLEN + 64:k * RECLEN + 128] = b"\xff" * 64    # impossible Steim frames
+    with pytest.raises(InternalMSEEDError):
+        read(io.BytesIO(bytes(bad)), format="MSEED")
+
+    buf = DayBuffer().add_bytes(bytes(bad))
+    assert buf.skipped_bytes == RECLEN
+    # The gap is exactly the samples of the dropped record
+    lost = read(io.BytesIO(data[k * RECLEN:(k + 1) * RECLEN]), format="MSEED")[0]
+    i0 = int(round((lost.stats.starttime - tr.stats.starttime) * tr.stats.sampling_rate))
+    day = buf.trace()
+    assert day.stats.gap_spans == [[i0, i0 + lost.stats.npts]]
+    keep = np.ones(tr.stats.npts, dtype=bool)
+    keep[i0:i0 + lost.stats.npts] = False
+    np.testing.assert_array_equal(day.data[keep], tr.data[keep])
+
+
+def test_junk_between_records_is_skipped(records):
+    tr, data = records
+    k = len(data) // RECLEN // 3
+    junk = data[:k * RECLEN] + bytes(100) + data[k * RECLEN:]
+    buf = DayBuffer().add_bytes(junk)
+    assert buf.skipped_bytes == 100
+    day = buf.trace()
+    assert day.stats.gap_spans == []
+    np.testing.assert_array_equal(day.data, tr.data)
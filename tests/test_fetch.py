@@ -0,0 +1,141 @@
+"""
+AfetchData: the shared token bucket and its 429 freeze; partial days
+resumed chunk by chunk and missing chunks given up after
+MAX_CHUNK_ATTEMPTS runs.
+
+    python -m pytest tests
+"""
+
+import sys
+import time
+from datetime import date
+from pathlib import Path
+
+import pytest
+from obspy import Stream
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+import AfetchData as fetch  # noqa: E402
+from AfetchData import TokenBucket  # noqa: E402
+from processingManifest import Manifest, DONE, PARTIAL  # noqa: E402
+from synthetic import MockClient, make_day_trace, write_day_file, NETWORK, STATION, LOCATION, CHANNEL  # noqa: E402
+
+DAY = "2025-06-01"
+
+
+@pytest.fixture(autouse=True)
+def no_jitter(monkeypatch):
+    monkeypatch.setattr(fetch, "JITTER_MAX", 0.0)
+
+
+def timed(f, *args):
+    t = time.monotonic()
+    f(*args)
+    return time.monotonic() - t
+
+
+def acquire(bucket, n):
+    for _ in range(n):
+        bucket.acquire()
+
+
+def test_bucket_paces_requests():
+    bucket = TokenBucket(rate=50, burst=1)
+    # The first token is there; the next five come at 1/rate intervals
+    assert timed(acquire, bucket, 6) >= 5 / 50 * 0.9
+
+
+def test_bucket_allows_burst():
+    bucket = TokenBucket(rate=1, burst=5)
+    assert timed(acquire, bucket, 5) < 0.5
+
+
+def test_penalize_freezes_a_full_bucket():
+    bucket = TokenBucket(rate=1000, burst=10)
+    bucket.penalize(0.2)
+    assert timed(bucket.acquire) >= 0.2 * 0.9
+
+
+def test_429_freezes_the_shared_bucket(tmp_path, monkeypatch):
+    path = write_day_file(tmp_path, day=DAY)
+    client = MockClient([path], fetch.chunk_bounds_for_day, fail_every=2)
+    t0, t1 = fetch.chunk_bounds_for_day(date.fromisoformat(DAY), fetch.CHUNK_HOURS)[0]
+
+    penalties = []
+    bucket = TokenBucket(rate=1000, burst=1)
+    bucket.penalize = penalties.append
+    monkeypatch.setattr(fetch, "polite_sleep", lambda s: pytest.fail("a 429 must not sleep one worker"))
+
+    assert len(fetch.fetch_with_retries(client, NETWORK, STATION, LOCATION, CHANNEL, t0, t1, bucket)) == 1
+    # Second request: 429 with Retry-After: 0, which freezes every worker, then a retry
+    assert len(fetch.fetch_with_retries(client, NETWORK, STATION, LOCATION, CHANNEL, t0, t1, bucket)) == 1
+    assert penalties == [0]
+    assert client.requests == 3
+
+
+# ---------------- Chunk resume ----------------
+@pytest.fixture
+def manifest(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with Manifest(tmp_path / "manifest.sqlite") as m:
+        yield m
+
+
+def day_chunks():
+    """The synthetic day cut at CHUNK_HOURS bounds: [((t0, t1), stream)]."""
+    tr = make_day_trace(DAY)
+    bounds = fetch.chunk_bounds_for_day(date.fromisoformat(DAY), fetch.CHUNK_HOURS)
+    return [((t0, t1), Stream([tr.slice(t0, t1)])) for t0, t1 in bounds]
+
+
+def test_partial_day_resumes_from_stored_chunks(manifest):
+    day = date.fromisoformat(DAY)
+    chunks = day_chunks()
+    for (t0, t1), st in chunks[:2]:
+        fetch.save_chunk(manifest, day, t0, t1, st)
+    fetch.record_fetch(manifest, day, fetch.assemble_day(day, fetch.stored_chunks(day)))
+    assert manifest.get("fetch", day)["status"] == PARTIAL
+    assert fetch.chunks_to_fetch(manifest, day) == [b for b, _ in chunks[2:]]
+
+    # The next run fetches only the rest; the day is assembled from both runs
+    s_all = fetch.stored_chunks(day)
+    for (t0, t1), st in chunks[2:]:
+        fetch.save_chunk(manifest, day, t0, t1, st)
+        s_all += st
+    fetch.record_fetch(manifest, day, fetch.assemble_day(day, s_all))
+    assert manifest.get("fetch", day)["status"] == DONE
+    assert manifest.get("fetch", day)["gap_fraction"] == 0
+    assert not (fetch.CHUNK_DIR / DAY).exists()
+    assert manifest.chunks(day) == {}
+
+
+def test_missing_chunk_given_up_after_max_attempts(manifest):
+    day = date.fromisoformat(DAY)
+    chunks = day_chunks()
+    (g0, g1), _ = chunks[3]
+    for (t0, t1), st in chunks[:3] + chunks[4:]:
+        fetch.save_chunk(manifest, day, t0, t1, st)
+
+    for attempt in range(1, fetch.MAX_CHUNK_ATTEMPTS + 1):
+        assert fetch.chunks_to_fetch(manifest, day) == [(g0, g1)]
+        fetch.save_chunk(manifest, day, g0, g1, Stream())
+        fetch.record_fetch(manifest, day, fetch.assemble_day(day, fetch.stored_chunks(day)))
+        status = DONE if attempt == fetch.MAX_CHUNK_ATTEMPTS else PARTIAL
+        assert manifest.get("fetch", day)["status"] == status
+
+    # The gap is accepted: the day is kept with it and not requested again
+    assert manifest.pending("fetch", status=PARTIAL) == []
+    assert 0 < manifest.get("fetch", day)["gap_fraction"] < 1
+    assert not fetch.no_data_left(manifest, day)
+
+
+def test_day_without_data_is_not_requested_again(manifest):
+    day = date.fromisoformat(DAY)
+    for _ in range(fetch.MAX_CHUNK_ATTEMPTS):
+        for t0, t1 in fetch.chunks_to_fetch(manifest, day):
+            fetch.save_chunk(manifest, day, t0, t1, Stream())
+        fetch.record_fetch(manifest, day, fetch.assemble_day(day, Stream()))
+    assert manifest.pending("fetch", status=PARTIAL) == []
+    assert fetch.no_data_left(manifest, day)
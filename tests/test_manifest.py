@@ -0,0 +1,126 @@
+"""
+processingManifest: planning, adoption of products made before the
+manifest, forcing and version bumps.
+
+    python -m pytest tests
+"""
+
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+import processingManifest  # noqa: E402
+from amplitudeStore import AmplitudeStore  # noqa: E402
+from processingManifest import Manifest, DONE, EMPTY  # noqa: E402
+
+START = date(2025, 6, 1)
+DAYS = 10
+
+
+def day(i):
+    return (START + timedelta(days=i)).isoformat()
+
+
+@pytest.fixture
+def manifest(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with Manifest(tmp_path / "manifest.sqlite") as m:
+        yield m
+
+
+def write_legacy_products(days):
+    """mean_amplitudes.csv and legacy dayplot PNGs of an install from before the manifest."""
+    times = pd.date_range(START, periods=days * 24, freq="h", tz="UTC")
+    pd.DataFrame({"time": times.strftime("%Y-%m-%dT%H:%M:%SZ"), "amplitude": 1.0}).to_csv(
+        "mean_amplitudes.csv", index=False)
+    processingManifest.DAYPLOT_DIR.mkdir()
+    for i in range(days):
+        (processingManifest.DAYPLOT_DIR / processingManifest.DAYPLOT_PATTERN.format(date=day(i))).touch()
+
+
+def test_upgrade_adopts_legacy_csv_before_fetching(manifest):
+    # The fetch stage plans first, before the amplitude stage imports the CSV
+    write_legacy_products(DAYS)
+    assert manifest.plan_fetch(START, START + timedelta(days=DAYS)) == []
+    assert manifest.summary()["amplitude"] == {DONE: DAYS}
+    # Only the days after the legacy products are new work
+    assert manifest.plan_fetch(START, START + timedelta(days=DAYS + 2)) == [day(DAYS), day(DAYS + 1)]
+
+
+def test_forced_day_past_extent_leaves_no_hole(manifest):
+    end = START + timedelta(days=DAYS)
+    assert manifest.plan("dayplot", START, end) == [day(i) for i in range(DAYS)]
+    for i in range(DAYS):
+        manifest.record("dayplot", day(i))
+    # Forcing a day beyond the extent must not hide the days before it
+    manifest.force("dayplot", days=[day(DAYS + 3)])
+    assert manifest.plan("dayplot", START, end + timedelta(days=5)) == [
+        day(DAYS), day(DAYS + 1), day(DAYS + 2), day(DAYS + 3), day(DAYS + 4)]
+
+
+def test_plan_registers_days_and_skips_done(manifest):
+    end = START + timedelta(days=DAYS)
+    assert manifest.plan("dayplot", START, end) == [day(i) for i in range(DAYS)]
+    manifest.record("dayplot", day(0))
+    manifest.record("dayplot", day(1), EMPTY)
+    manifest.record("dayplot", day(2), "failed")
+    assert manifest.plan("dayplot", START, end) == [day(i) for i in range(2, DAYS)]
+    assert manifest.summary()["dayplot"] == {DONE: 1, EMPTY: 1, "failed": 1, "pending": DAYS - 3}
+
+
+def test_adopt_checks_each_day_once(manifest):
+    checked = []
+
+    def exists(d):
+        checked.append(d)
+        return d < day(5)
+
+    end = START + timedelta(days=DAYS)
+    assert manifest.plan("dayplot", START, end, is_done=exists) == [day(i) for i in range(5, DAYS)]
+    assert manifest.plan("dayplot", START, end, is_done=exists) == [day(i) for i in range(5, DAYS)]
+    assert checked == [day(i) for i in range(DAYS)]
+
+
+def test_force_days_and_range(manifest):
+    end = START + timedelta(days=DAYS)
+    for i in range(DAYS):
+        manifest.record("dayplot", day(i))
+    assert manifest.force("dayplot", days=[day(1)]) == 1
+    assert manifest.force("dayplot", start=day(5), end=day(7)) == 2
+    assert manifest.plan("dayplot", START, end) == [day(1), day(5), day(6)]
+    assert manifest.is_done("amplitude", day(1)) is False
+
+
+def test_version_bump_marks_done_days_stale(manifest, monkeypatch):
+    end = START + timedelta(days=DAYS)
+    manifest.plan("dayplot", START, end)
+    for i in range(DAYS - 1):
+        manifest.record("dayplot", day(i))
+    monkeypatch.setitem(processingManifest.STAGE_VERSIONS, "dayplot", "2")
+    assert manifest.plan("dayplot", START, end) == [day(i) for i in range(DAYS)]
+    assert manifest.summary()["dayplot"] == {"stale": DAYS - 1, "pending": 1}
+    # Once per version: days redone at the new version stay done
+    manifest.record("dayplot", day(0))
+    assert manifest.plan("dayplot", START, end)[0] == day(1)
+    assert manifest.get("dayplot", day(0))["version"] == "2"
+
+
+def test_no_backfill_stage_starts_after_existing_days(manifest):
+    end = START + timedelta(days=DAYS)
+    for i in range(5):
+        manifest.record("amplitude", day(i))
+    # The spectrogram stage is new: days the pipeline had already done are not planned for it
+    assert manifest.plan("spectrogram", START, end) == [day(i) for i in range(5, DAYS)]
+    assert manifest.since("spectrogram") == day(5)
+
+
+def test_amplitude_exists_uses_the_given_store(manifest, tmp_path):
+    write_legacy_products(DAYS)
+    empty = AmplitudeStore(tmp_path / "other_store")
+    assert not processingManifest.amplitude_exists(day(0), empty)
+    assert not processingManifest.STORE_DIR.exists()
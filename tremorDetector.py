@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Streaming tremor / activity detector on the cleaned minute amplitudes
+(amplitudeCleaning.py).
+
+CsaveActivityCurves derives its scores from centered windows, a full-series
+Hilbert transform and min/max normalization over the whole history, so past
+hours change as data arrives. This detector consumes minutes one at a time,
+with constant work per minute, and never revises a score once emitted:
+
+- smooth_hour / smooth_day: trailing means over ring buffers (WINDOW_HOUR,
+  WINDOW_DAY minutes); gaps are pushed as NaN and skipped by the means
+- difference: smooth_hour - smooth_day, demeaned by its running mean
+- envelope (tremor): causal rectify-and-average envelope, the mean of
+  |difference| over ENVELOPE_WINDOW minutes scaled by pi/2 (the mean of a
+  rectified sine is 2/pi of its amplitude)
+- activity: smooth_day
+- normalization: running QUANTILE_LOW / QUANTILE_HIGH quantiles of each
+  indicator (P-square estimators, five markers each) instead of min/max,
+  clipped to [0, 1]; scores are NaN until QUANTILE_MIN_SAMPLES indicator
+  values have been seen
+- events: a score crossing its *_ON level starts an event, falling below
+  *_OFF ends it (hysteresis, so noise around one level does not flap)
+
+Trailing windows lag: smooth_day by half a day, the envelope by half of
+ENVELOPE_WINDOW. ENVELOPE_WINDOW is therefore shorter than the 1200-minute
+centered smoothing of the batch curves, which would delay alerts by ten hours.
+
+Each run feeds the minutes added to the amplitude store since the previous
+one, saves the detector to STATE_FILE and writes:
+    SCORE_DIR/      per-minute tremor / activity scores (amplitudeStore layout)
+    EVENTS_FILE     one JSON line per event start / end
+    STATUS_FILE     current scores and alert level, for the dashboard
+
+The live service and the daily run both feed the detector. They do so under
+the amplitude store's lock (AmplitudeStore.locked()), loading STATE_FILE
+inside it, so each picks up where the other stopped and no minute is fed
+twice.
+
+Usage:
+    python tremorDetector.py            # feed new minutes
+    python tremorDetector.py --reset    # replay the whole store from scratch
+"""
+
+import json
+import math
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+import runReport
+from amplitudeStore import AmplitudeStore
+from amplitudeCleaning import clean_store, CLEAN_COLUMN
+from CsaveActivityCurves import STORE_DIR, AMPLITUDE_SCALE, WINDOW_HOUR, WINDOW_DAY, MINUTES_PER_DAY
+
+# ---------------- CONFIG ----------------
+ENVELOPE_WINDOW = 180                # minutes of rectified difference averaged into the envelope
+MIN_FILL = 0.5                       # share of a window that must hold data for its mean
+MAX_GAP_MINUTES = MINUTES_PER_DAY    # longer gaps restart the windows (quantiles are kept)
+QUANTILE_LOW, QUANTILE_HIGH = 0.01, 0.99   # normalization range of each indicator
+QUANTILE_MIN_SAMPLES = MINUTES_PER_DAY     # indicator values seen before scores are emitted
+TREMOR_ON, TREMOR_OFF = 0.8, 0.6     # tremor event starts at / ends below
+ACTIVITY_ON, ACTIVITY_OFF = 0.8, 0.6
+
+STATE_FILE = "detector_state.npz"
+SCORE_DIR = Path("live_scores")
+EVENTS_FILE = "tremor_events.jsonl"
+STATUS_FILE = "tremor_status.json"
+# ----------------------------------------
+
+NAN = float("nan")
+ENVELOPE_SCALE = math.pi / 2
+
+
+class RingMean:
+    """Trailing mean of the last `size` values, NaN skipped, O(1) per push."""
+
+    __slots__ = ("buf", "pos", "total", "count", "min_count")
+
+    def __init__(self, size, min_fill=MIN_FILL):
+        self.buf = [NAN] * size
+        self.pos = 0
+        self.total = 0.0
+        self.count = 0
+        self.min_count = max(1, int(size * min_fill))
+
+    def push(self, x):
+        buf, pos = self.buf, self.pos
+        old = buf[pos]
+        if old == old:
+            self.total -= old
+            self.count -= 1
+        buf[pos] = x
+        if x == x:
+            self.total += x
+            self.count += 1
+        pos += 1
+        if pos == len(buf):
+            pos = 0
+            # Re-sum once per lap, so add/subtract rounding never accumulates
+            self.total = math.fsum(v for v in buf if v == v)
+        self.pos = pos
+        return self.total / self.count if self.count >= self.min_count else NAN
+
+    def clear(self):
+        self.buf = [NAN] * len(self.buf)
+        self.pos = 0
+        self.total = 0.0
+        self.count = 0
+
+
+class P2Quantile:
+    """
+    Running p-quantile of everything pushed, in constant memory (Jain &
+    Chlamtac's P-square algorithm: five markers moved by parabolic steps).
+    """
+
+    __slots__ = ("p", "q", "n", "want", "step", "seen")
+
+    def __init__(self, p):
+        self.p = p
+        self.q = []                                        # marker heights
+        self.n = [1.0, 2.0, 3.0, 4.0, 5.0]                 # marker positions
+        self.want = [1.0, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5.0]   # desired positions
+        self.step = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+        self.seen = 0
+
+    def push(self, x):
+        self.seen += 1
+        q = self.q
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        n, want = self.n, self.want
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            want[i] += self.step[i]
+        for i in (1, 2, 3):
+            d = want[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                qi = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < qi < q[i + 1]:
+                    qi = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = qi
+                n[i] += d
+
+    def value(self):
+        q = self.q
+        if len(q) < 5:
+            return q[min(len(q) - 1, int(self.p * len(q)))] if q else NAN
+        return q[2]
+
+
+class Trigger:
+    """Hysteresis on one score: events start at >= on and end below off."""
+
+    __slots__ = ("active", "since", "peak")
+
+    def __init__(self):
+        self.active = False
+        self.since = -1
+        self.peak = NAN
+
+    def step(self, name, t, score, on, off):
+        """Event dict when the state changes at minute t, else None."""
+        if score != score:
+            return None
+        if self.active:
+            self.peak = max(self.peak, score)
+            if score < off:
+                self.active = False
+                return {"event": name, "state": "end", "time": _iso(t), "started": _iso(self.since),
+                        "minutes": (t - self.since) // 60, "peak": round(self.peak, 4)}
+        elif score >= on:
+            self.active, self.since, self.peak = True, t, score
+            return {"event": name, "state": "start", "time": _iso(t), "score": round(score, 4)}
+        return None
+
+
+def _iso(t):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(t))
+
+
+class TremorDetector:
+    """Minute-by-minute tremor and activity scores; see the module docstring."""
+
+    def __init__(self):
+        self.hour = RingMean(WINDOW_HOUR)
+        self.day = RingMean(WINDOW_DAY)
+        self.envelope = RingMean(ENVELOPE_WINDOW)
+        self.tremor_low, self.tremor_high = P2Quantile(QUANTILE_LOW), P2Quantile(QUANTILE_HIGH)
+        self.activity_low, self.activity_high = P2Quantile(QUANTILE_LOW), P2Quantile(QUANTILE_HIGH)
+        self.tremor_trigger, self.activity_trigger = Trigger(), Trigger()
+        self.diff_sum = 0.0
+        self.diff_count = 0
+        self.last_time = -1          # epoch seconds of the last minute fed, -1 before the first
+        self.tremor = NAN            # latest scores
+        self.activity = NAN
+
+    def _step(self, amp):
+        """Push one minute (NaN for a gap); returns (tremor, activity)."""
+        hour = self.hour.push(amp)
+        day = self.day.push(amp)
+        diff = hour - day
+        if diff == diff:
+            self.diff_sum += diff
+            self.diff_count += 1
+            env = self.envelope.push(abs(diff - self.diff_sum / self.diff_count)) * ENVELOPE_SCALE
+        else:
+            env = self.envelope.push(NAN) * ENVELOPE_SCALE
+        return (_score(env, self.tremor_low, self.tremor_high),
+                _score(day, self.activity_low, self.activity_high))
+
+    def update(self, t, amp):
+        """
+        Feed the minute starting at epoch second t; returns the events it
+        triggered (usually none). Minutes at or before the last one are ignored.
+        """
+        last = self.last_time
+        if last >= 0:
+            if t <= last:
+                return []
+            missing = (t - last) // 60 - 1
+            if missing > MAX_GAP_MINUTES:
+                self.restart()
+            else:
+                for _ in range(missing):
+                    self._step(NAN)
+        self.last_time = t
+        self.tremor, self.activity = self._step(amp)
+        events = []
+        for event in (self.tremor_trigger.step("tremor", t, self.tremor, TREMOR_ON, TREMOR_OFF),
+                      self.activity_trigger.step("activity", t, self.activity, ACTIVITY_ON, ACTIVITY_OFF)):
+            if event is not None:
+                events.append(event)
+        return events
+
+    def process(self, times, amplitudes):
+        """Feed arrays of minutes; returns (tremor scores, activity scores, events)."""
+        tremor = np.full(len(times), np.nan)
+        activity = np.full(len(times), np.nan)
+        events = []
+        update = self.update
+        for i, (t, amp) in enumerate(zip(times.tolist(), amplitudes.tolist())):
+            found = update(t, amp)
+            if found:
+                events.extend(found)
+            tremor[i], activity[i] = self.tremor, self.activity
+        return tremor, activity, events
+
+    def restart(self):
+        """Empty the windows after a long outage; normalization history is kept."""
+        for ring in (self.hour, self.day, self.envelope):
+            ring.clear()
+
+    def status(self):
+        """Current scores and alert level as a JSON-ready dict."""
+        level = "tremor" if self.tremor_trigger.active else \
+            "activity" if self.activity_trigger.active else "quiet"
+        return {
+            "time": _iso(self.last_time) if self.last_time >= 0 else None,
+            "tremor": None if math.isnan(self.tremor) else round(self.tremor, 4),
+            "activity": None if math.isnan(self.activity) else round(self.activity, 4),
+            "level": level,
+            "tremor_since": _iso(self.tremor_trigger.since) if self.tremor_trigger.active else None,
+            "activity_since": _iso(self.activity_trigger.since) if self.activity_trigger.active else None,
+        }
+
+
+def _score(x, low, high):
+    """Normalize x by the running quantiles (which it updates); NaN while they warm up."""
+    if x != x:
+        return NAN
+    low.push(x)
+    high.push(x)
+    if low.seen < QUANTILE_MIN_SAMPLES:
+        return NAN
+    lo, hi = low.value(), high.value()
+    if hi <= lo:
+        return 0.0
+    return min(1.0, max(0.0, (x - lo) / (hi - lo)))
+
+
+# ---------------- State ----------------
+def save_state(detector, path=STATE_FILE):
+    """Every attribute of the detector and its parts as arrays, 'part.attr' keys."""
+    arrays = {}
+    for name, value in vars(detector).items():
+        if hasattr(value, "__slots__"):
+            for slot in value.__slots__:
+                arrays[f"{name}.{slot}"] = np.asarray(getattr(value, slot))
+        else:
+            arrays[name] = np.asarray(value)
+    tmp = f"{path}.tmp.npz"
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+def load_state(path=STATE_FILE):
+    """The saved detector, or None if there is none or it was saved with other window sizes."""
+    if not os.path.exists(path):
+        return None
+    detector = TremorDetector()
+    with np.load(path) as z:
+        for key in z.files:
+            name, _, slot = key.partition(".")
+            if slot:
+                setattr(getattr(detector, name), slot, z[key].tolist())
+            else:
+                setattr(detector, name, z[key].tolist())
+    sizes = (len(detector.hour.buf), len(detector.day.buf), len(detector.envelope.buf))
+    if sizes != (WINDOW_HOUR, WINDOW_DAY, ENVELOPE_WINDOW):
+        print("[WARN] Detector state has other window sizes; replaying from scratch.")
+        return None
+    return detector
+
+
+# ---------------- Run ----------------
+def run(store, detector, since=None):
+    """
+    Feed the store's minutes after detector.last_time; returns the minutes
+    processed. since (epoch seconds) bounds the cleaning to the minutes from
+    then on (clean_store); call it holding store.locked().
+    """
+    clean_store(store, since=since)
+    start = detector.last_time + 1 if detector.last_time >= 0 else None
+    times, cols = store.load(start=start, columns=(CLEAN_COLUMN,))
+    if len(times) == 0:
+        print("[INFO] No new minutes for the detector.")
+        return 0
+
+    t0 = time.perf_counter()
+    amps = cols[CLEAN_COLUMN].astype(float) / AMPLITUDE_SCALE
+    tremor, activity, events = detector.process(times, amps)
+    seconds = time.perf_counter() - t0
+    print(f"[OK] Detector: {len(times)} minutes in {seconds:.2f} s "
+          f"({seconds / len(times) * 1e6:.1f} µs per minute), {len(events)} event(s)")
+
+    AmplitudeStore(SCORE_DIR).append(times, replace=True, tremor=tremor, activity=activity)
+    if events:
+        with open(EVENTS_FILE, "a", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps(event) + "\n")
+                print(f"[EVENT] {event['event']} {event['state']} at {event['time']}")
+    with open(STATUS_FILE, "w", encoding="utf-8") as f:
+        json.dump(detector.status(), f, indent=1)
+    save_state(detector)
+    return len(times)
+
+
+def main():
+    store = AmplitudeStore(STORE_DIR)
+    if not store.partitions():
+        print(f"[INFO] No amplitude store at {STORE_DIR}; nothing to detect.")
+        return
+
+    with runReport.run("detector"), store.locked():
+        detector = None if "--reset" in sys.argv[1:] else load_state()
+        if detector is None:
+            detector = TremorDetector()
+            if os.path.exists(EVENTS_FILE):
+                os.remove(EVENTS_FILE)       # replayed from the start, events included
+
+        with runReport.span("detector") as rec:
+            rec["rows"] = run(store, detector)
+    print(f"[INFO] Alert level: {detector.status()['level']}")
+
+
+if __name__ == "__main__":
+    main()
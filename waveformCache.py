@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Local cache of downloaded waveform days, so days can be processed again
+(new FREQ_RANGE, CHUNK_DURATION_SEC, thresholds, a forced or version-bumped
+stage) from disk instead of through the rate-limited FDSN endpoint.
+
+Layout: one MiniSEED file per UTC day, CACHE_DIR/<YYYY-MM-DD>.mseed, with
+gaps kept as breaks between records (as AfetchData writes shake_data).
+Steim-2 MiniSEED is kept as the on-disk format: on Raspberry Shake data it
+is smaller than zlib-compressed int32 deltas and decodes a day in about a
+tenth of a second, so reprocessing a year is a local job of minutes.
+
+- Days fetched into shake_data are hard-linked in (no extra disk space
+  until clear_shake_data() removes the originals); streamed days are written.
+- Eviction is least recently used by size: every read or write refreshes a
+  day's mtime, and put() drops the oldest days beyond CACHE_MAX_BYTES.
+- Only complete days (fetch status done) are served; a partial day is still
+  fetched again chunk by chunk.
+
+Usage:
+    python waveformCache.py           # days and size in the cache
+    python waveformCache.py --evict   # apply CACHE_MAX_BYTES now
+"""
+
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+
+from obspy import Stream
+
+# ---------------- CONFIG ----------------
+CACHE_ENABLED = True
+CACHE_DIR = Path("waveform_cache")
+CACHE_MAX_BYTES = 5 * 2**30          # least recently used days beyond this are removed
+# ----------------------------------------
+
+
+def _touch(path):
+    # Explicit nanosecond time: a plain utime() takes the file system's coarse
+    # clock, which leaves days used in quick succession with the same mtime
+    now = time.time_ns()
+    os.utime(path, ns=(now, now))
+
+
+class WaveformCache:
+    """Day MiniSEED files under `root`, evicted least recently used first."""
+
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+
+    def path(self, day):
+        return self.root / f"{day}.mseed"
+
+    def days(self):
+        """Cached days, oldest first."""
+        if not self.root.exists():
+            return []
+        return sorted(p.stem for p in self.root.glob("*.mseed"))
+
+    def size(self):
+        return sum(p.stat().st_size for p in self.root.glob("*.mseed")) if self.root.exists() else 0
+
+    def get(self, day):
+        """Path of the cached day (marked as used), or None."""
+        path = self.path(day)
+        if not path.exists():
+            return None
+        _touch(path)
+        return path
+
+    def put(self, day, st):
+        """Cache an assembled (possibly masked) day stream; gaps are written as record breaks."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / f".{day}.mseed.tmp"
+        Stream([tr.copy() for tr in st]).split().write(str(tmp), format="MSEED")
+        os.replace(tmp, self.path(day))
+        _touch(self.path(day))
+        self.evict()
+
+    def put_file(self, day, file_path):
+        """Cache a day MiniSEED file by hard link (copy if linking is not possible)."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / f".{day}.mseed.tmp"
+        tmp.unlink(missing_ok=True)
+        try:
+            os.link(file_path, tmp)
+        except OSError:
+            shutil.copyfile(file_path, tmp)
+        os.replace(tmp, self.path(day))
+        _touch(self.path(day))
+        self.evict()
+
+    def restore(self, day, dest):
+        """Put the cached day at `dest` (hard link or copy); True if it was cached."""
+        path = self.get(day)
+        if path is None:
+            return False
+        dest = Path(dest)
+        dest.unlink(missing_ok=True)
+        try:
+            os.link(path, dest)
+        except OSError:
+            shutil.copyfile(path, dest)
+        return True
+
+    def evict(self):
+        """Remove least recently used days until the cache fits max_bytes; returns the days removed."""
+        if self.max_bytes is None or not self.root.exists():
+            return []
+        files = sorted(((p.stat(), p) for p in self.root.glob("*.mseed")),
+                       key=lambda item: item[0].st_mtime)
+        total = sum(st.st_size for st, _ in files)
+        removed = []
+        # The most recently used day stays, even if it alone is larger than the limit
+        for st, path in files[:-1]:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= st.st_size
+            removed.append(path.stem)
+        return removed
+
+
+def open_cache():
+    """The waveform cache, or None if CACHE_ENABLED is off."""
+    return WaveformCache() if CACHE_ENABLED else None
+
+
+def main():
+    cache = WaveformCache()
+    if "--evict" in sys.argv[1:]:
+        removed = cache.evict()
+        print(f"[INFO] Evicted {len(removed)} day(s).")
+    days = cache.days()
+    if not days:
+        print(f"No days cached in {cache.root}.")
+        return
+    print(f"{len(days)} day(s) in {cache.root}, {days[0]} … {days[-1]}, "
+          f"{cache.size() / 2**20:.0f} MiB of {cache.max_bytes / 2**20:.0f} MiB")
+
+
+if __name__ == "__main__":
+    main()